@@ -0,0 +1,320 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Time the command handlers and the rendering of /metrics against
+synthetic clusters, e.g.
+
+    python -m ceph_exporter.benchmark --size 100:4096 --size 1000:32768 --output before.json
+
+and after a change
+
+    python -m ceph_exporter.benchmark --size 100:4096 --size 1000:32768 --compare before.json
+
+Results are written as JSON keyed by cluster size, stage and measure,
+so two runs of the same sizes can be compared measure by measure."""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+import arrow
+
+from ..prometheus import exposition
+from ..prometheus import metrics
+from ..prometheus import Snapshot
+from ..ceph.commands.ceph_df import CephDf
+from ..ceph.commands.ceph_mds_dump import CephMdsDump
+from ..ceph.commands.ceph_osd_dump import CephOsdDump
+from ..ceph.commands.ceph_pg_dump import CephPgDump
+from ..ceph.commands.ceph_pg_dump import CephPgDumpBrief
+from ..ceph.commands.ceph_quorum_status import CephQuorumStatus
+from ..ceph.commands.ceph_status import CephStatus
+from .synthetic import SyntheticCluster
+
+commands = [CephDf, CephMdsDump, CephOsdDump, CephPgDump, CephPgDumpBrief, CephQuorumStatus, CephStatus]
+
+# a measure is a regression if it grew by more than the threshold;
+# every measure is one where smaller is better
+regression_suffixes = ('_s', '_bytes', '_blocks')
+
+fsid = '00000000-0000-0000-0000-000000000000'
+
+def cluster_size(value):
+    osds, separator, pgs = value.partition(':')
+    try:
+        osds = int(osds)
+        pgs = int(pgs)
+    except ValueError:
+        raise argparse.ArgumentTypeError('expected OSDS:PGS, e.g. "100:4096"')
+    if not separator or osds <= 0 or pgs <= 0:
+        raise argparse.ArgumentTypeError('expected OSDS:PGS, e.g. "100:4096"')
+    return osds, pgs
+
+def timed(f, *args):
+    start = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - start
+
+def summarize(prefix, times):
+    return {'{}_cold_s'.format(prefix): times[0],
+            '{}_s'.format(prefix): min(times[1:] or times),
+            '{}_median_s'.format(prefix): statistics.median(times[1:] or times)}
+
+class Benchmark(object):
+    def __init__(self, options):
+        self.options = options
+
+    def reset(self):
+        for metric in metrics.values():
+            metric.reset()
+        exposition.update()
+        gc.collect()
+
+    def benchmarkCommand(self, command, data):
+        """Run processData of *command* on *data* once cold, with nothing
+        interned yet, and then repeat times more."""
+        result = {}
+        process_data = []
+        prepare = []
+        commit = []
+        previous = None
+        for run in range(self.options.repeat + 1):
+            snapshot = Snapshot(arrow.get(1477515392.5))
+            process_data.append(timed(command.processData, data, snapshot))
+            # what a worker does, in every format so that the exposition
+            # timings below only put the fragments together
+            prepare.append(timed(snapshot.prepare, exposition.formats))
+            commit.append(timed(snapshot.commit, previous))
+            previous = snapshot
+        result.update(summarize('process_data', process_data))
+        result.update(summarize('prepare', prepare))
+        result.update(summarize('commit', commit))
+        result['series'] = sum([len(slots) for slots, values in previous.series.values()])
+
+        if self.options.memory:
+            gc.collect()
+            tracemalloc.start()
+            before = tracemalloc.take_snapshot()
+            tracemalloc.reset_peak()
+            start, ignored = tracemalloc.get_traced_memory()
+            snapshot = Snapshot(arrow.get(1477515392.5))
+            command.processData(data, snapshot)
+            current, peak = tracemalloc.get_traced_memory()
+            after = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            result['process_data_peak_bytes'] = peak - start
+            result['process_data_retained_bytes'] = current - start
+            result['process_data_allocated_blocks'] = sum([max(0, statistic.count_diff)
+                                                           for statistic in after.compare_to(before, 'filename')])
+            snapshot.commit(previous)
+        return result
+
+    def benchmarkExposition(self):
+        result = {}
+        fmt = []
+        for run in range(self.options.repeat):
+            for metric in metrics.values():
+                metric.invalidate()
+            start = time.perf_counter()
+            for metric in metrics.values():
+                metric.fmt()
+            fmt.append(time.perf_counter() - start)
+        result['fmt_s'] = min(fmt)
+
+        # update() puts together the text format and the formats scrapes
+        # have asked for from the fragments the snapshots rendered when
+        # they were prepared, each of which is timed on its own here
+        for format in exposition.formats:
+            times = []
+            for run in range(self.options.repeat):
+                for metric in metrics.values():
+                    metric.invalidate()
+                if format == 'text':
+                    times.append(timed(exposition.update))
+                else:
+                    exposition.update()
+                    times.append(timed(exposition.render, format))
+            result['render_{}_s'.format(format)] = min(times)
+            result['render_{}_body_bytes'.format(format)] = len(exposition.render(format))
+
+        times = []
+        for run in range(self.options.repeat):
+            exposition.update()
+            times.append(timed(exposition.encode, 'gzip'))
+        result['gzip_s'] = min(times)
+        result['gzip_body_bytes'] = len(exposition.encode('gzip'))
+        return result
+
+    def benchmarkSize(self, osds, pgs):
+        self.reset()
+        cluster = SyntheticCluster(osds, pgs, pools = self.options.pools, seed = self.options.seed)
+        outputs = dict([(' '.join(subcommand), data) for subcommand, data in cluster.commands()])
+        if self.options.write_fixtures is not None:
+            self.writeFixtures(cluster, osds, pgs)
+
+        result = {}
+        for command_class in commands:
+            command = command_class(fsid, None)
+            name = ' '.join(command.subcommand)
+            result[name] = self.benchmarkCommand(command, outputs[name])
+        result['exposition'] = self.benchmarkExposition()
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform != 'darwin':
+            maxrss *= 1024
+        result['process'] = {'peak_rss_bytes': maxrss}
+        return result
+
+    def writeFixtures(self, cluster, osds, pgs):
+        directory = os.path.join(self.options.write_fixtures, '{:d}_{:d}'.format(osds, pgs))
+        os.makedirs(directory, exist_ok = True)
+        for subcommand, data in cluster.commands():
+            with open(os.path.join(directory, 'ceph_{}.json'.format('_'.join(subcommand))), 'w') as f:
+                json.dump(data, f)
+
+    def run(self):
+        results = {'meta': {'date': datetime.datetime.now(datetime.timezone.utc).isoformat().replace('+00:00', 'Z'),
+                            'python': platform.python_version(),
+                            'implementation': platform.python_implementation(),
+                            'platform': platform.platform(),
+                            'pools': self.options.pools,
+                            'repeat': self.options.repeat,
+                            'seed': self.options.seed},
+                   'results': {}}
+        for osds, pgs in self.options.size:
+            name = '{:d}:{:d}'.format(osds, pgs)
+            sys.stderr.write('benchmarking {} OSDs and {} PGs\n'.format(osds, pgs))
+            results['results'][name] = self.benchmarkSize(osds, pgs)
+        return results
+
+def flatten(results):
+    """Return the measures of *results* as a dict keyed by (size, stage,
+    measure)."""
+    flat = {}
+    for size, stages in results['results'].items():
+        for stage, measures in stages.items():
+            for measure, value in measures.items():
+                flat[size, stage, measure] = value
+    return flat
+
+def compare(old, new, threshold):
+    """Return a list of (size, stage, measure, old, new, ratio,
+    regressed) for the measures found in both *old* and *new*."""
+    old = flatten(old)
+    new = flatten(new)
+    comparison = []
+    for key in sorted(set(old.keys()) & set(new.keys())):
+        old_value = old[key]
+        new_value = new[key]
+        ratio = new_value / old_value if old_value else None
+        regressed = (key[2].endswith(regression_suffixes) and
+                     ratio is not None and
+                     ratio > 1.0 + threshold)
+        comparison.append(key + (old_value, new_value, ratio, regressed))
+    return comparison
+
+def report(results, output):
+    for size, stages in sorted(results['results'].items()):
+        for stage, measures in sorted(stages.items()):
+            for measure, value in sorted(measures.items()):
+                output.write('{:<14} {:<16} {:<34} {:>16}\n'.format(size, stage, measure, fmt_measure(measure, value)))
+
+def fmt_measure(measure, value):
+    if measure.endswith('_s'):
+        return '{:.3f} ms'.format(value * 1000)
+    return '{:d}'.format(value)
+
+def report_comparison(comparison, output):
+    for size, stage, measure, old, new, ratio, regressed in comparison:
+        output.write('{:<14} {:<16} {:<34} {:>16} {:>16} {:>8}{}\n'.format(size, stage, measure,
+                                                                          fmt_measure(measure, old),
+                                                                          fmt_measure(measure, new),
+                                                                          '-' if ratio is None else '{:.2f}x'.format(ratio),
+                                                                          ' REGRESSION' if regressed else ''))
+
+def main(args = None):
+    parser = argparse.ArgumentParser(prog = 'python -m ceph_exporter.benchmark')
+    parser.add_argument('--size',
+                        default=[],
+                        action='append',
+                        type=cluster_size,
+                        metavar='OSDS:PGS',
+                        help="Size of a synthetic cluster to benchmark, may be given more than once, default is `10:512` and `100:4096`")
+    parser.add_argument('--pools',
+                        default=8,
+                        type=int,
+                        help="Number of pools the PGs are spread over, default is `8`")
+    parser.add_argument('--repeat',
+                        default=3,
+                        type=int,
+                        help="Number of timed runs after the first, the best of which is reported, default is `3`")
+    parser.add_argument('--seed',
+                        default=0,
+                        type=int,
+                        help="Seed of the synthetic clusters, default is `0`")
+    parser.add_argument('--no-memory',
+                        dest='memory',
+                        default=True,
+                        action='store_false',
+                        help="Skip the tracemalloc run that measures allocations")
+    parser.add_argument('--output',
+                        default=None,
+                        help="Write the results as JSON to this file")
+    parser.add_argument('--compare',
+                        default=None,
+                        help="Compare the results with those of an earlier run written by `--output`, and exit with status 1 if any measure regressed")
+    parser.add_argument('--threshold',
+                        default=0.1,
+                        type=float,
+                        help="Fraction by which a measure has to grow to count as a regression, default is `0.1`")
+    parser.add_argument('--write-fixtures',
+                        default=None,
+                        metavar='DIRECTORY',
+                        help="Also write the synthetic command output to a subdirectory of DIRECTORY per size, for use with `--backend=fixture`")
+
+    options = parser.parse_args(args)
+    if not options.size:
+        options.size = [(10, 512), (100, 4096)]
+
+    results = Benchmark(options).run()
+
+    if options.output is not None:
+        with open(options.output, 'w') as f:
+            json.dump(results, f, indent = 2, sort_keys = True)
+
+    if options.compare is None:
+        report(results, sys.stdout)
+        return 0
+
+    with open(options.compare) as f:
+        baseline = json.load(f)
+    comparison = compare(baseline, results, options.threshold)
+    report_comparison(comparison, sys.stdout)
+    if any([entry[-1] for entry in comparison]):
+        return 1
+    return 0
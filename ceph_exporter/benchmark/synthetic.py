@@ -0,0 +1,347 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Generate the JSON output of Ceph commands for made up clusters of
+any size, in the layout of the Hammer release that the command
+handlers are written against."""
+
+import datetime
+import random
+
+pg_states = [('active+clean', 0.95),
+             ('active+clean+scrubbing', 0.02),
+             ('active+clean+scrubbing+deep', 0.01),
+             ('active+undersized+degraded', 0.01),
+             ('active+remapped+wait_backfill', 0.005),
+             ('peering', 0.005)]
+
+mds_states = ['up:active', 'up:standby', 'up:replay']
+
+stat_sum_keys = ['num_bytes',
+                 'num_objects',
+                 'num_object_clones',
+                 'num_object_copies',
+                 'num_objects_missing_on_primary',
+                 'num_objects_missing',
+                 'num_objects_degraded',
+                 'num_objects_misplaced',
+                 'num_objects_unfound',
+                 'num_objects_dirty',
+                 'num_whiteouts',
+                 'num_read',
+                 'num_read_kb',
+                 'num_write',
+                 'num_write_kb',
+                 'num_scrub_errors',
+                 'num_shallow_scrub_errors',
+                 'num_deep_scrub_errors',
+                 'num_objects_recovered',
+                 'num_bytes_recovered',
+                 'num_keys_recovered',
+                 'num_objects_omap',
+                 'num_objects_hit_set_archive',
+                 'num_bytes_hit_set_archive',
+                 'num_flush',
+                 'num_flush_kb',
+                 'num_evict',
+                 'num_evict_kb',
+                 'num_promote',
+                 'num_flush_mode_high',
+                 'num_flush_mode_low',
+                 'num_evict_mode_some',
+                 'num_evict_mode_full',
+                 'num_objects_pinned']
+
+pg_timestamp_keys = ['last_fresh',
+                     'last_change',
+                     'last_active',
+                     'last_peered',
+                     'last_clean',
+                     'last_became_active',
+                     'last_became_peered',
+                     'last_unstale',
+                     'last_undegraded',
+                     'last_fullsized',
+                     'last_scrub_stamp',
+                     'last_deep_scrub_stamp',
+                     'last_clean_scrub_stamp']
+
+def fmt_timestamp(value):
+    return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+class SyntheticCluster(object):
+    """A made up cluster with *osds* OSDs and *pgs* PGs spread over
+    *pools* pools.
+
+    The same seed always gives the same output, so results of
+    different runs can be compared."""
+
+    def __init__(self, osds, pgs, pools = 8, mdss = 3, mons = 3, replicas = 3, seed = 0):
+        self.osds = osds
+        self.pgs = pgs
+        self.pools = min(pools, pgs)
+        self.mdss = mdss
+        self.mons = mons
+        self.replicas = min(replicas, osds)
+        self.seed = seed
+        self.now = datetime.datetime(2016, 10, 26, 20, 53, 13, 95067)
+        self.epoch = 8329
+        self.pgmap_version = 2252356
+
+    def random(self, name):
+        return random.Random('{}:{}'.format(self.seed, name))
+
+    def pgCounts(self):
+        """Return the number of PGs of every pool, a power of two for all
+        but the last pool, which takes the rest."""
+        counts = []
+        remaining = self.pgs
+        for pool in range(self.pools - 1):
+            count = 1
+            while count * 2 <= self.pgs // self.pools:
+                count *= 2
+            counts.append(count)
+            remaining -= count
+        counts.append(remaining)
+        return counts
+
+    def pgState(self, rng):
+        value = rng.random()
+        for state, share in pg_states:
+            value -= share
+            if value < 0:
+                return state
+        return pg_states[0][0]
+
+    def statSum(self, rng, objects):
+        stat_sum = dict([(key, 0) for key in stat_sum_keys])
+        stat_sum['num_objects'] = objects
+        stat_sum['num_object_copies'] = objects * self.replicas
+        stat_sum['num_bytes'] = objects * rng.randint(1024, 4 * 1024 * 1024)
+        stat_sum['num_read'] = rng.randint(0, 10000000)
+        stat_sum['num_read_kb'] = stat_sum['num_read'] * rng.randint(4, 1024)
+        stat_sum['num_write'] = rng.randint(0, 10000000)
+        stat_sum['num_write_kb'] = stat_sum['num_write'] * rng.randint(4, 1024)
+        stat_sum['num_objects_recovered'] = rng.randint(0, objects)
+        stat_sum['num_bytes_recovered'] = stat_sum['num_objects_recovered'] * 4 * 1024 * 1024
+        return stat_sum
+
+    def addStatSum(self, total, stat_sum):
+        for key in stat_sum_keys:
+            total[key] += stat_sum[key]
+
+    def pgDump(self):
+        rng = self.random('pg dump')
+        pg_stats = []
+        pool_stats = []
+        total = dict([(key, 0) for key in stat_sum_keys])
+        osd_ids = list(range(self.osds))
+        # PGs that changed at the same time share their timestamps, as
+        # they do on a real cluster
+        stamps = [fmt_timestamp(self.now - datetime.timedelta(seconds = rng.randint(0, 7 * 86400),
+                                                              microseconds = rng.randint(0, 999999)))
+                  for index in range(max(16, self.pgs // 64))]
+
+        for pool, count in enumerate(self.pgCounts()):
+            pool_sum = dict([(key, 0) for key in stat_sum_keys])
+            for seed in range(count):
+                stat_sum = self.statSum(rng, rng.randint(0, 20000))
+                self.addStatSum(pool_sum, stat_sum)
+                acting = rng.sample(osd_ids, self.replicas)
+                fresh = fmt_timestamp(self.now - datetime.timedelta(seconds = rng.randint(0, 30)))
+                pg = {'pgid': '{:d}.{:x}'.format(pool, seed),
+                      'version': "{:d}'{:d}".format(self.epoch, rng.randint(0, 2000000)),
+                      'reported_seq': '{:d}'.format(rng.randint(0, 3000000)),
+                      'reported_epoch': '{:d}'.format(self.epoch),
+                      'state': self.pgState(rng),
+                      'stat_sum': stat_sum,
+                      'up': acting,
+                      'acting': acting,
+                      'up_primary': acting[0],
+                      'acting_primary': acting[0],
+                      'blocked_by': []}
+                for key in pg_timestamp_keys:
+                    if key in ('last_fresh', 'last_active', 'last_clean', 'last_unstale', 'last_undegraded', 'last_fullsized', 'last_peered'):
+                        pg[key] = fresh
+                    else:
+                        pg[key] = rng.choice(stamps)
+                pg_stats.append(pg)
+            self.addStatSum(total, pool_sum)
+            pool_stats.append({'poolid': pool,
+                               'stat_sum': pool_sum,
+                               'log_size': 0,
+                               'ondisk_log_size': 0,
+                               'up': count * self.replicas,
+                               'acting': count * self.replicas})
+
+        osd_stats = []
+        for osd in osd_ids:
+            kb = rng.randint(1, 8) * 1024 * 1024 * 1024
+            kb_used = rng.randint(0, kb)
+            osd_stats.append({'osd': osd,
+                              'kb': kb,
+                              'kb_used': kb_used,
+                              'kb_avail': kb - kb_used,
+                              'hb_in': [],
+                              'hb_out': [],
+                              'snap_trim_queue_len': rng.randint(0, 10),
+                              'num_snap_trimming': rng.randint(0, 2),
+                              'op_queue_age_hist': {'histogram': [], 'upper_bound': 1},
+                              'fs_perf_stat': {'commit_latency_ms': rng.randint(0, 100),
+                                               'apply_latency_ms': rng.randint(0, 100)}})
+
+        return {'version': self.pgmap_version,
+                'stamp': fmt_timestamp(self.now),
+                'last_osdmap_epoch': self.epoch,
+                'last_pg_scan': self.epoch,
+                'full_ratio': 0.95,
+                'near_full_ratio': 0.85,
+                'pg_stats_sum': {'stat_sum': total,
+                                 'log_size': 0,
+                                 'ondisk_log_size': 0,
+                                 'up': self.pgs * self.replicas,
+                                 'acting': self.pgs * self.replicas},
+                'osd_stats_sum': {},
+                'pg_stats_delta': {},
+                'pg_stats': pg_stats,
+                'pool_stats': pool_stats,
+                'osd_stats': osd_stats}
+
+    def pgsBrief(self):
+        return [dict([(key, pg[key]) for key in ['pgid', 'state', 'up', 'acting', 'up_primary', 'acting_primary']])
+                for pg in self.pgDump()['pg_stats']]
+
+    def osdDump(self):
+        rng = self.random('osd dump')
+        pools = []
+        for pool, count in enumerate(self.pgCounts()):
+            pools.append({'pool': pool,
+                          'pool_name': 'pool{:d}'.format(pool),
+                          'type': 1,
+                          'size': self.replicas,
+                          'min_size': max(1, self.replicas - 1),
+                          'crush_ruleset': 0,
+                          'pg_num': count,
+                          'pg_placement_num': count})
+        osds = []
+        for osd in range(self.osds):
+            up = 1 if rng.random() > 0.01 else 0
+            osds.append({'osd': osd,
+                         'uuid': '{:08x}-0000-0000-0000-{:012x}'.format(self.seed, osd),
+                         'up': up,
+                         'in': up,
+                         'weight': 1.0,
+                         'primary_affinity': 1.0,
+                         'last_clean_begin': 0,
+                         'last_clean_end': 0,
+                         'up_from': self.epoch - 100,
+                         'up_thru': self.epoch - 10,
+                         'down_at': 0,
+                         'lost_at': 0,
+                         'public_addr': '10.0.{:d}.{:d}:6800/{:d}'.format(osd // 256, osd % 256, osd),
+                         'state': ['exists', 'up'] if up else ['exists']})
+        return {'epoch': self.epoch,
+                'fsid': '00000000-0000-0000-0000-{:012x}'.format(self.seed),
+                'created': fmt_timestamp(self.now - datetime.timedelta(days = 365)),
+                'modified': fmt_timestamp(self.now),
+                'flags': '',
+                'pool_max': self.pools - 1,
+                'max_osd': self.osds,
+                'pools': pools,
+                'osds': osds}
+
+    def df(self):
+        rng = self.random('df')
+        pools = []
+        for pool in range(self.pools):
+            objects = rng.randint(0, 20000) * self.pgs // self.pools
+            pools.append({'name': 'pool{:d}'.format(pool),
+                          'id': pool,
+                          'stats': {'kb_used': objects * 4096,
+                                    'bytes_used': objects * 4096 * 1024,
+                                    'max_avail': rng.randint(0, 2 ** 50),
+                                    'objects': objects}})
+        total = self.osds * 4 * 2 ** 40
+        used = rng.randint(0, total)
+        return {'stats': {'total_bytes': total,
+                          'total_used_bytes': used,
+                          'total_avail_bytes': total - used},
+                'pools': pools}
+
+    def status(self):
+        rng = self.random('status')
+        counts = {}
+        for pg in range(self.pgs):
+            state = self.pgState(rng)
+            counts[state] = counts.get(state, 0) + 1
+        return {'fsid': '00000000-0000-0000-0000-{:012x}'.format(self.seed),
+                'health': {'overall_status': 'HEALTH_OK'},
+                'election_epoch': 42,
+                'quorum': list(range(self.mons)),
+                'pgmap': {'pgs_by_state': [{'state_name': state, 'count': count}
+                                           for state, count in sorted(counts.items())],
+                          'version': self.pgmap_version,
+                          'num_pgs': self.pgs}}
+
+    def mdsDump(self):
+        rng = self.random('mds dump')
+        info = {}
+        for rank in range(self.mdss):
+            gid = 4000 + rank
+            entry = {'gid': gid,
+                     'name': 'mds{:d}'.format(rank),
+                     'rank': rank if rank == 0 else -1,
+                     'incarnation': 1,
+                     'state': mds_states[0] if rank == 0 else rng.choice(mds_states[1:]),
+                     'state_seq': rng.randint(1, 100),
+                     'addr': '10.0.0.{:d}:6800/{:d}'.format(rank, gid)}
+            if rng.random() < 0.1:
+                entry['laggy_since'] = fmt_timestamp(self.now - datetime.timedelta(seconds = rng.randint(0, 600)))
+            info['gid_{:d}'.format(gid)] = entry
+        return {'epoch': self.epoch,
+                'flags': 0,
+                'created': fmt_timestamp(self.now - datetime.timedelta(days = 365)),
+                'modified': fmt_timestamp(self.now),
+                'info': info}
+
+    def quorumStatus(self):
+        mons = [{'rank': rank,
+                 'name': 'mon{:d}'.format(rank),
+                 'addr': '10.0.1.{:d}:6789/0'.format(rank)} for rank in range(self.mons)]
+        return {'election_epoch': 42,
+                'quorum': list(range(self.mons)),
+                'quorum_names': [mon['name'] for mon in mons],
+                'quorum_leader_name': mons[0]['name'] if mons else '',
+                'monmap': {'epoch': 3,
+                           'fsid': '00000000-0000-0000-0000-{:012x}'.format(self.seed),
+                           'modified': fmt_timestamp(self.now),
+                           'created': fmt_timestamp(self.now - datetime.timedelta(days = 365)),
+                           'mons': mons}}
+
+    def commands(self):
+        """Return a list of (subcommand, output) for every command the
+        exporter runs."""
+        return [(['df'], self.df()),
+                (['mds', 'dump'], self.mdsDump()),
+                (['osd', 'dump'], self.osdDump()),
+                (['pg', 'dump'], self.pgDump()),
+                (['pg', 'dump', 'pgs_brief'], self.pgsBrief()),
+                (['quorum_status'], self.quorumStatus()),
+                (['status'], self.status())]
@@ -0,0 +1,81 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+import argparse
+import io
+import json
+import os
+import sys
+
+from ...prometheus import metrics
+from ..run import cluster_size
+from ..run import compare
+from ..run import main
+
+class ClusterSizeTest(TestCase):
+    def test_parse(self):
+        self.assertEqual(cluster_size('100:4096'), (100, 4096))
+
+    def test_invalid(self):
+        for value in ['100', '100:', 'a:b', '0:10']:
+            self.assertRaises(argparse.ArgumentTypeError, cluster_size, value)
+
+class CompareTest(TestCase):
+    def results(self, process_data, series):
+        return {'meta': {},
+                'results': {'10:512': {'pg dump': {'process_data_s': process_data,
+                                                   'series': series}}}}
+
+    def test_regression(self):
+        comparison = compare(self.results(1.0, 10), self.results(1.2, 20), 0.1)
+        self.assertEqual(comparison,
+                         [('10:512', 'pg dump', 'process_data_s', 1.0, 1.2, 1.2, True),
+                          ('10:512', 'pg dump', 'series', 10, 20, 2.0, False)])
+
+    def test_within_threshold(self):
+        comparison = compare(self.results(1.0, 10), self.results(1.05, 10), 0.1)
+        self.assertFalse(any([entry[-1] for entry in comparison]))
+
+class MainTest(TestCase):
+    def setUp(self):
+        self.patch(sys, 'stdout', io.StringIO())
+        self.patch(sys, 'stderr', io.StringIO())
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+
+    def tearDown(self):
+        for metric in metrics.values():
+            metric.reset()
+
+    def test_output_and_compare(self):
+        output = os.path.join(self.directory, 'results.json')
+        self.assertEqual(main(['--size', '3:16', '--repeat', '1', '--output', output]), 0)
+        with open(output) as f:
+            results = json.load(f)
+        self.assertIn('process_data_s', results['results']['3:16']['pg dump'])
+        self.assertIn('render_protobuf_s', results['results']['3:16']['exposition'])
+        self.assertIn('peak_rss_bytes', results['results']['3:16']['process'])
+        self.assertEqual(main(['--size', '3:16', '--repeat', '1', '--no-memory', '--compare', output, '--threshold', '1000']), 0)
+
+    def test_write_fixtures(self):
+        main(['--size', '3:16', '--repeat', '1', '--no-memory', '--write-fixtures', self.directory])
+        self.assertTrue(os.path.exists(os.path.join(self.directory, '3_16', 'ceph_pg_dump.json')))
@@ -0,0 +1,62 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+import arrow
+
+from ...prometheus import metrics
+from ...prometheus import Snapshot
+from ...ceph.commands.ceph_pg_dump import pgid_to_pool
+from ..run import commands
+from ..synthetic import SyntheticCluster
+
+class SyntheticClusterTest(TestCase):
+    def setUp(self):
+        self.cluster = SyntheticCluster(7, 100, pools = 3)
+
+    def tearDown(self):
+        for metric in metrics.values():
+            metric.clear()
+
+    def test_pg_counts(self):
+        self.assertEqual(sum(self.cluster.pgCounts()), 100)
+        self.assertEqual(len(self.cluster.pgCounts()), 3)
+
+    def test_pg_dump(self):
+        data = self.cluster.pgDump()
+        self.assertEqual(len(data['pg_stats']), 100)
+        self.assertEqual(len(data['osd_stats']), 7)
+        for pool in data['pool_stats']:
+            pgs = [pg for pg in data['pg_stats'] if pgid_to_pool(pg['pgid']) == '{:d}'.format(pool['poolid'])]
+            self.assertEqual(pool['stat_sum']['num_objects'], sum([pg['stat_sum']['num_objects'] for pg in pgs]))
+        self.assertEqual(data['pg_stats_sum']['stat_sum']['num_objects'],
+                         sum([pg['stat_sum']['num_objects'] for pg in data['pg_stats']]))
+
+    def test_deterministic(self):
+        self.assertEqual(SyntheticCluster(7, 100, pools = 3).commands(), self.cluster.commands())
+
+    def test_processed(self):
+        outputs = dict([(' '.join(subcommand), data) for subcommand, data in self.cluster.commands()])
+        for command_class in commands:
+            command = command_class('fsid', None)
+            snapshot = Snapshot(arrow.get(1477515392.5))
+            command.processData(outputs[' '.join(command.subcommand)], snapshot)
+            self.assertTrue(snapshot.series)
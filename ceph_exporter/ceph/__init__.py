@@ -19,96 +19,57 @@
 # <http://www.gnu.org/licenses/>.
 
 import arrow
+import functools
 import json
+import random
+import time
 
 from twisted.internet import reactor
-from twisted.internet.defer import Deferred
-from twisted.internet.error import ProcessDone
-from twisted.internet.error import ProcessTerminated
-from twisted.internet.protocol import ProcessProtocol
+from twisted.internet.defer import TimeoutError
 from twisted.logger import Logger
 
-from ..prometheus import Label
-from ..prometheus import Metric
-from ..prometheus import Sample
+from ..prometheus import committed
+from ..prometheus import exposition
+from ..prometheus import millis
+from ..prometheus import Snapshot
 
+from .backends import RunStats
+from .filter import SeriesFilter
 from .metrics.ceph import ceph
+from .metrics.ceph_command_interval import ceph_command_interval
+from .metrics.ceph_command_period import ceph_command_period
 from .metrics.ceph_command_runtime import ceph_command_runtime
+from .metrics.ceph_command_skipped import ceph_command_skipped
+from .metrics.ceph_command_timeouts import ceph_command_timeouts
+from .metrics.ceph_exporter_command_epoch_cache import ceph_exporter_command_epoch_cache
+from .metrics.ceph_exporter_command_phase_seconds import ceph_exporter_command_phase_seconds
+from .metrics.ceph_exporter_command_read_bytes import ceph_exporter_command_read_bytes
+from .metrics.ceph_exporter_command_samples import ceph_exporter_command_samples
 
-class CephJsonProtocol(ProcessProtocol):
+class Ceph(object):
     log = Logger()
 
-    def __init__(self, fsid, finished, command):
-        self.fsid = fsid
-        self.finished = finished
-        self.command = command
-        self.out_data = []
-        self.err_data = []
-        self.start_time = None
-        self.end_time = None
-        
-    def connectionMade(self):
-        self.start_time = arrow.now()
-        self.transport.closeStdin()
-
-    def outReceived(self, data):
-        self.out_data.append(data)
-
-    def errReceived(self, data):
-        self.err_data.append(data)
-
-    def inConnectionLost(self):
-        pass
-
-    def outConnectionLost(self):
-        self.end_time = arrow.now()
-
-    def errConnectionLost(self):
-        pass
-
-    def processExited(self, status):
-        pass
-
-    def processEnded(self, status):
-        if not isinstance(status.value, (ProcessDone, ProcessTerminated)):
-            self.log.debug('process ended {r:}', r = status.value)
-            self.finished.callback(None)
-            return
-
-        if isinstance(status.value, ProcessTerminated):
-            self.log.debug('process ended {r:}', r = status.value)
-            self.log.debug('{e:}', e = (b''.join(self.err_data)).decode('utf-8'))
-            self.finished.callback(None)
-            return
-
-        runtime = self.end_time - self.start_time
-        timestamp = self.start_time + (runtime / 2)
-
-        try:
-            data = b''.join(self.out_data)
-            data = data.decode('utf-8')
-            data = json.loads(data)
-        except ValueError as e:
-            self.log.debug('command: {c:}\noutput: {o:r}', c = self.command, o = self.out_data)
-            self.finished.errback(e)
-            return
+    interval = 30.0
 
-        Sample('ceph',
-               [Label('fsid', self.fsid)],
-               1,
-               timestamp)
-        Sample('ceph_command_runtime',
-               [Label('fsid', self.fsid),
-                Label('command', ' '.join(self.command))],
-               runtime.total_seconds(),
-               timestamp)
+    # when a run takes longer than this fraction of the interval the
+    # delay to the next run is doubled, up to max_backoff times the
+    # interval, and it is halved again once runs are quick
+    backoff_threshold = 0.5
+    max_backoff = 8
 
-        self.finished.callback((data, timestamp))
+    # members of the command output whose array elements are handed to
+    # the named method one at a time while the output is still being
+    # read, where the backend supports it
+    streamed = {}
 
-class Ceph(object):
-    log = Logger()
+    # the arguments of the mon_command that subcommand stands for, for
+    # the backends that talk to the monitors directly, when they are
+    # more than {'prefix': ' '.join(subcommand)}
+    mon_command = None
 
-    interval = 30.0
+    # commands whose output is a cluster map set this and implement
+    # mapEpoch(), see buildSnapshot()
+    epoch_cache = False
 
     states = set(['activating',
                   'activating+degraded',
@@ -149,40 +110,317 @@ class Ceph(object):
                   'stale+active+clean',
                   'stale+active+remapped+backfilling'])
 
-    def __init__(self, fsid, options):
+    def __init__(self, fsid, options, backend = None, workers = None):
         self.fsid = fsid
         self.options = options
+        self.backend = backend
+        self.workers = workers
+        self.snapshot = None
+        self.status = None
+        self.last_start = None
+        self.period = None
+        self.running = False
+        self.skipped = 0
+        self.timeouts = 0
+        self.read_bytes = 0
+        self.samples = 0
+        self.extractors = []
+        self.next_run = None
+        # the map epoch of the output that self.snapshot was built from
+        self.epoch = None
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+        if options is not None:
+            self.interval = dict(options.command_interval).get(' '.join(self.subcommand), self.defaultInterval(options))
+
+        self.delay = self.interval
 
-    def start(self):
-        reactor.callWhenRunning(self.getData)
+        # drop the series of this command once it has failed to report
+        # for this many intervals
+        self.stale_after = 3.0
+        if options is not None:
+            self.stale_after = options.stale_after
 
-    def buildCommand(self):
-        real_command = ['ceph',
-                        '--conf', self.options.config,
-                        '--keyring', self.options.keyring,
-                        '--name', self.options.name] + \
-                        self.subcommand + \
-                        ['--format', 'json']
-        short_command = ['ceph'] + self.subcommand
-        #self.log.debug('{c:}', c = command)
-        return real_command, short_command
+        self.timeout = self.interval
+        if options is not None and options.timeout is not None:
+            self.timeout = options.timeout
+
+        if options is not None:
+            self.series_filter = SeriesFilter(options.include, options.exclude)
+        else:
+            self.series_filter = SeriesFilter()
+
+    def defaultInterval(self, options):
+        """Return the interval of this command if it is not given with
+        --command-interval."""
+        return options.interval
+
+    def mapEpoch(self, data):
+        """Return the epoch of the cluster map in *data*."""
+        return None
+
+    def reuseSnapshot(self, previous, snapshot):
+        """Stage the series of the *previous* run in *snapshot* in place of
+        processing the output of this run again."""
+        snapshot.reuse(previous)
+
+    def subscribe(self, extractor):
+        """Also hand the output of every run of this command to
+        *extractor*.
+
+        extractor(command, data, snapshot) is called after processData
+        with the same data, in which the streamed members are empty,
+        and adds its series to the same snapshot.  That way a new
+        metric family that can be read from the output of a command
+        that is polled anyway costs no extra call to the monitors.
+        With workers it is called from a worker thread."""
+        self.extractors.append(extractor)
+
+    def wants(self, metric, scope):
+        """Return True if series of *metric* at *scope* are exported.
+
+        Handlers check this before building the labels of a series, so
+        that filtered series cost nothing beyond the check."""
+        return self.series_filter.wants(metric, scope)
+
+    def start(self, offset = 0.0):
+        # spread out the first poll of each command so that they don't
+        # all hit the monitors at the same moment every interval
+        delay = offset
+        if self.options is not None:
+            delay += random.uniform(0.0, min(self.options.start_jitter, self.interval))
+        self.next_run = reactor.callLater(delay, self.getData)
+        self.commitStatus()
+
+    def runEarly(self, fraction):
+        """Bring the next run forward to now, unless the command is running
+        or its last run started less than *fraction* of the current delay
+        ago.  Returns True if it was brought forward.
+
+        The spacing is measured against the delay rather than the
+        interval so that a command that has backed off because it is
+        slow is not run early any more often than that."""
+        if self.running or self.next_run is None or not self.next_run.active():
+            return False
+        if self.last_start is not None and reactor.seconds() - self.last_start < self.delay * fraction:
+            return False
+        self.next_run.cancel()
+        self.getData()
+        return True
 
     def getData(self):
-        reactor.callLater(self.interval, self.getData)
+        self.next_run = reactor.callLater(self.delay, self.getData)
+
+        if self.running:
+            self.skipped += 1
+            self.log.warn('"{command:}" is still running, skipping this run',
+                          command = ' '.join(['ceph'] + self.subcommand))
+            self.commitStatus()
+            return
+
+        self.running = True
 
-        real_command, short_command = self.buildCommand()
+        now = reactor.seconds()
+        if self.last_start is not None:
+            self.period = now - self.last_start
+        self.last_start = now
 
-        finished = Deferred()
-        finished.addCallback(self.processData)
-        finished.addErrback(self.processError, real_command)
+        snapshot = Snapshot()
+        stats = RunStats()
 
-        protocol = CephJsonProtocol(self.fsid, finished, short_command)
+        if self.workers is None:
+            streamed = {}
+            for key, method in self.streamed.items():
+                streamed[key] = functools.partial(self.streamElement, getattr(self, method), stats, snapshot = snapshot)
 
-        reactor.spawnProcess(protocol,
-                             self.options.executable,
-                             real_command)
+            finished = self.backend.run(self.subcommand, streamed, stats = stats, mon_command = self.mon_command)
+            if self.timeout:
+                finished.addTimeout(self.timeout, reactor)
+            finished.addCallback(self.processResult, snapshot, stats)
+        else:
+            # leave decoding the output to the worker as well
+            finished = self.backend.run(self.subcommand, decode = False, stats = stats, mon_command = self.mon_command)
+            if self.timeout:
+                finished.addTimeout(self.timeout, reactor)
+            finished.addCallback(self.processInWorker, snapshot, stats)
+        finished.addErrback(self.processError)
+        finished.addBoth(self.finishRun)
 
-    def processError(self, failure, real_command):
-        self.log.failure('command failed: "{real_command:}"',
-                         real_command = real_command,
+    def finishRun(self, result):
+        self.running = False
+
+        elapsed = reactor.seconds() - self.last_start
+        if elapsed > self.interval * self.backoff_threshold:
+            delay = min(self.delay * 2, self.interval * self.max_backoff)
+        else:
+            delay = max(self.delay / 2, self.interval)
+
+        if delay != self.delay:
+            self.log.info('"{command:}" took {elapsed:.1f}s, now running it every {delay:.1f}s',
+                          command = ' '.join(['ceph'] + self.subcommand),
+                          elapsed = elapsed,
+                          delay = delay)
+            grown = delay > self.delay
+            self.delay = delay
+            self.reschedule(grown)
+            self.commitStatus()
+
+    def reschedule(self, grown):
+        """Move the pending run to self.delay after the start of the last
+        one.
+
+        The next run is scheduled when a run starts, with the delay as
+        it was then, so without this a changed delay would only apply
+        to the run after next.  A grown delay never brings the pending
+        run forward, and a run is never scheduled in the past."""
+        if self.next_run is None or not self.next_run.active():
+            return
+        when = self.last_start + self.delay
+        if grown:
+            when = max(when, self.next_run.getTime())
+        self.next_run.reset(max(0.0, when - reactor.seconds()))
+
+    def streamElement(self, handler, stats, element, snapshot = None):
+        start = time.perf_counter()
+        try:
+            return handler(element, snapshot = snapshot)
+        finally:
+            stats.streamed += time.perf_counter() - start
+
+    def processInWorker(self, result, snapshot, stats = None):
+        finished = self.workers.run(self.prepareSnapshot, result, snapshot, stats)
+        finished.addCallback(self.commitSnapshot, stats)
+        return finished
+
+    def prepareSnapshot(self, result, snapshot = None, stats = None):
+        """Build the snapshot and also render its series, so that all
+        that is left for the reactor thread to do is commit it."""
+        snapshot = self.buildSnapshot(result, snapshot, stats)
+        if snapshot is not None:
+            snapshot.prepare(exposition.wanted)
+        return snapshot
+
+    def processResult(self, result, snapshot = None, stats = None):
+        self.commitSnapshot(self.buildSnapshot(result, snapshot, stats), stats)
+
+    def buildSnapshot(self, result, snapshot = None, stats = None):
+        if result is None:
+            return None
+
+        if stats is None:
+            stats = RunStats()
+
+        data, timestamp, runtime = result
+
+        if isinstance(data, bytes):
+            start = time.perf_counter()
+            data = json.loads(data.decode('utf-8'))
+            stats.decode += time.perf_counter() - start
+
+        if snapshot is None:
+            snapshot = Snapshot()
+        snapshot.timestamp = millis(timestamp)
+        fsid = ('fsid', self.fsid)
+
+        snapshot.set(ceph,
+                     (fsid,),
+                     1)
+        snapshot.set(ceph_command_runtime,
+                     (fsid,
+                      ('command', ' '.join(['ceph'] + self.subcommand))),
+                     runtime.total_seconds())
+        if self.period is not None:
+            snapshot.set(ceph_command_period,
+                         (fsid,
+                          ('command', ' '.join(['ceph'] + self.subcommand))),
+                         self.period)
+
+        start = time.perf_counter()
+        epoch = None
+        if self.epoch_cache:
+            epoch = self.mapEpoch(data)
+        # a map is the same as long as its epoch is, so the series of the
+        # last run, including those of the extractors, are reused with
+        # the timestamp of this run, unless they have been withdrawn and
+        # their slots may have been freed since
+        if epoch is not None and epoch == self.epoch and self.snapshot in committed:
+            self.reuseSnapshot(self.snapshot, snapshot)
+            stats.cached = True
+        else:
+            self.processData(data, snapshot)
+            for extractor in self.extractors:
+                extractor(self, data, snapshot)
+            self.epoch = epoch
+            if self.epoch_cache:
+                stats.cached = False
+        stats.process += time.perf_counter() - start
+
+        return snapshot
+
+    def commitSnapshot(self, snapshot, stats = None):
+        if snapshot is None:
+            return
+
+        snapshot.commit(self.snapshot, self.stale_after * self.delay)
+        self.snapshot = snapshot
+
+        if stats is not None:
+            self.recordStats(snapshot, stats)
+
+    def recordStats(self, snapshot, stats):
+        """Account for where the time of a successful run went.
+
+        The elements handed to streamed handlers are decoded and
+        processed in turn, so the time spent in the handlers is moved
+        from the decode phase to the process_data phase.  Phases that
+        the backend does not measure are not observed."""
+        labels = (('fsid', self.fsid),
+                  ('command', ' '.join(['ceph'] + self.subcommand)))
+        phases = [('spawn', stats.spawn),
+                  ('wait', stats.wait),
+                  ('decode', max(0.0, stats.decode - stats.streamed)),
+                  ('process_data', stats.process + stats.streamed)]
+        for phase, seconds in phases:
+            if seconds > 0.0:
+                ceph_exporter_command_phase_seconds.observe(labels + (('phase', phase),), seconds)
+
+        self.read_bytes += stats.read_bytes
+        self.samples += snapshot.samples()
+        if stats.cached is True:
+            self.cache_hits += 1
+        elif stats.cached is False:
+            self.cache_misses += 1
+        self.commitStatus()
+
+    def commitStatus(self):
+        """Export the scheduling state of this command.
+
+        This is committed on its own rather than with the output of a
+        run, so skipped and timed out runs are visible even while no
+        run succeeds."""
+        snapshot = Snapshot(arrow.now())
+        labels = (('fsid', self.fsid),
+                  ('command', ' '.join(['ceph'] + self.subcommand)))
+        snapshot.set(ceph_command_interval, labels, self.delay)
+        snapshot.set(ceph_command_skipped, labels, self.skipped)
+        snapshot.set(ceph_command_timeouts, labels, self.timeouts)
+        snapshot.set(ceph_exporter_command_read_bytes, labels, self.read_bytes)
+        snapshot.set(ceph_exporter_command_samples, labels, self.samples)
+        if self.epoch_cache:
+            snapshot.set(ceph_exporter_command_epoch_cache, labels + (('result', 'hit'),), self.cache_hits)
+            snapshot.set(ceph_exporter_command_epoch_cache, labels + (('result', 'miss'),), self.cache_misses)
+        snapshot.commit(self.status)
+        self.status = snapshot
+
+    def processError(self, failure):
+        if failure.check(TimeoutError):
+            self.timeouts += 1
+            self.log.warn('"{command:}" did not finish within {timeout:}s',
+                          command = ' '.join(['ceph'] + self.subcommand),
+                          timeout = self.timeout)
+            self.commitStatus()
+            return
+        self.log.failure('command failed: "{command:}"',
+                         command = ' '.join(['ceph'] + self.subcommand),
                          failure = failure)
@@ -0,0 +1,60 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+class RunStats(object):
+    """Where the time of one run of a command went, in seconds, and how
+    much output it read.
+
+    The backend fills in what it can measure and leaves the rest at
+    zero: *spawn* is the time until the child was started, *wait* the
+    time spent waiting for its output and *decode* the time spent
+    decoding the output, including any time spent in streamed handlers.
+    The command itself adds the time of its streamed handlers to
+    *streamed* and the time it spent in processData to *process*, and
+    sets *cached* to whether it could reuse the series of its previous
+    run, if it tries to."""
+
+    def __init__(self):
+        self.spawn = 0.0
+        self.wait = 0.0
+        self.decode = 0.0
+        self.streamed = 0.0
+        self.process = 0.0
+        self.read_bytes = 0
+        self.cached = None
+
+class LimitedBackend(object):
+    """Run the commands of another backend through a DeferredSemaphore,
+    so that the commands of every backend sharing the semaphore, e.g.
+    the backends of several clusters, run at most that many at a time.
+
+    Time spent waiting for the semaphore counts against the timeout of
+    the command, and cancelling a command that is still waiting just
+    takes it out of the queue."""
+
+    def __init__(self, backend, semaphore):
+        self.backend = backend
+        self.semaphore = semaphore
+
+    def setTimeout(self, timeout):
+        self.backend.setTimeout(timeout)
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        return self.semaphore.run(self.backend.run, subcommand, streamed, decode = decode, stats = stats, mon_command = mon_command)
@@ -0,0 +1,65 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import arrow
+import datetime
+import json
+import os
+import time
+
+from twisted.internet.defer import fail
+from twisted.internet.defer import succeed
+from twisted.logger import Logger
+
+class FixtureBackend(object):
+    """Replay saved JSON output instead of talking to a cluster.
+
+    The output of ``ceph pg dump --format json`` is read from
+    ``ceph_pg_dump.json`` in the fixture directory, and likewise for
+    the other commands.  The file is re-read on every poll so it can
+    be edited while the exporter is running.  *streamed* is not used,
+    the command sees the complete output."""
+
+    log = Logger()
+
+    def __init__(self, options):
+        self.directory = options.fixtures
+
+    def setTimeout(self, timeout):
+        pass
+
+    def path(self, subcommand):
+        return os.path.join(self.directory, '_'.join(['ceph'] + subcommand) + '.json')
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        try:
+            with open(self.path(subcommand), 'rb') as f:
+                data = f.read()
+            if stats is not None:
+                stats.read_bytes = len(data)
+            if decode:
+                start = time.perf_counter()
+                data = json.loads(data.decode('utf-8'))
+                if stats is not None:
+                    stats.decode = time.perf_counter() - start
+        except (IOError, ValueError) as e:
+            return fail(e)
+
+        return succeed((data, arrow.now(), datetime.timedelta(0)))
@@ -0,0 +1,126 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import arrow
+import json
+import math
+import time
+
+from twisted.internet.defer import DeferredLock
+from twisted.internet.threads import deferToThread
+from twisted.logger import Logger
+
+try:
+    import rados
+except ImportError:
+    rados = None
+
+class RadosBackend(object):
+    """Send every command as a mon_command over one long lived librados
+    session instead of starting a new client for each poll.
+
+    librados calls block, so they are made from the reactor thread
+    pool.  The reply arrives in one piece, so *streamed* is not used
+    and the command sees its complete output."""
+
+    log = Logger()
+
+    def __init__(self, options):
+        if rados is None:
+            raise RuntimeError('the rados backend needs the Python rados bindings (python3-rados)')
+        self.options = options
+        self.timeout = options.timeout
+        self.cluster = None
+        self.lock = DeferredLock()
+
+    def setTimeout(self, timeout):
+        """Make librados give up on a command after *timeout* seconds,
+        the longest timeout of the commands run through this backend, or
+        never if it is 0 or None.  Only sessions connected from now on
+        are affected."""
+        self.timeout = timeout
+
+    def connect(self):
+        conf = {'keyring': self.options.keyring}
+        if self.timeout:
+            # a thread blocked in librados can't be cancelled, so let
+            # librados give up on its own when a command times out
+            conf['rados_mon_op_timeout'] = '{:d}'.format(int(math.ceil(self.timeout)))
+        cluster = rados.Rados(conffile = self.options.config,
+                              name = self.options.name,
+                              conf = conf)
+        cluster.connect()
+        return cluster
+
+    def connected(self, cluster):
+        self.log.info('connected to cluster {fsid:}', fsid = cluster.get_fsid())
+        self.cluster = cluster
+        return cluster
+
+    def getCluster(self):
+        if self.cluster is not None:
+            return self.cluster
+        d = deferToThread(self.connect)
+        d.addCallback(self.connected)
+        return d
+
+    def disconnect(self, failure):
+        if failure.check(rados.Error) and self.cluster is not None:
+            self.log.debug('dropping librados session: {e:}', e = failure.value)
+            cluster = self.cluster
+            self.cluster = None
+            deferToThread(cluster.shutdown)
+        return failure
+
+    def monCommand(self, cluster, subcommand, decode, stats, mon_command = None):
+        # the monitors only know the prefix of a command, its other words
+        # are arguments that the command has to spell out for them
+        if mon_command is None:
+            mon_command = {'prefix': ' '.join(subcommand)}
+        command = dict(mon_command)
+        command['format'] = 'json'
+        command = json.dumps(command)
+        start_time = arrow.now()
+        start = time.perf_counter()
+        ret, outbuf, outs = cluster.mon_command(command, b'')
+        end = time.perf_counter()
+        end_time = arrow.now()
+        if ret != 0:
+            raise OSError(-ret, outs)
+
+        runtime = end_time - start_time
+        timestamp = start_time + (runtime / 2)
+
+        if stats is not None:
+            stats.wait = end - start
+            stats.read_bytes = len(outbuf)
+
+        if decode:
+            data = json.loads(outbuf.decode('utf-8'))
+            if stats is not None:
+                stats.decode = time.perf_counter() - end
+            return data, timestamp, runtime
+        return outbuf, timestamp, runtime
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        d = self.lock.run(self.getCluster)
+        d.addCallback(lambda cluster: deferToThread(self.monCommand, cluster, subcommand, decode, stats, mon_command))
+        d.addErrback(self.disconnect)
+        return d
@@ -0,0 +1,193 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import arrow
+import json
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ProcessDone
+from twisted.internet.error import ProcessExitedAlready
+from twisted.internet.error import ProcessTerminated
+from twisted.internet.protocol import ProcessProtocol
+from twisted.logger import Logger
+from twisted.python.failure import Failure
+
+from ...jsonstream import JsonObjectStream
+from . import RunStats
+
+class CephJsonProtocol(ProcessProtocol):
+    log = Logger()
+
+    def __init__(self, finished, command, streamed = None, decode = True, stats = None):
+        self.finished = finished
+        self.command = command
+        self.decode = decode
+        self.stats = stats
+        if self.stats is None:
+            self.stats = RunStats()
+        self.spawned = time.perf_counter()
+        self.connected = None
+        self.feeding = 0.0
+        self.out_data = []
+        self.err_data = []
+        self.start_time = None
+        self.end_time = None
+        self.stream = None
+        self.stream_failure = None
+        if streamed:
+            self.stream = JsonObjectStream(streamed)
+
+    def connectionMade(self):
+        self.start_time = arrow.now()
+        self.connected = time.perf_counter()
+        self.stats.spawn = self.connected - self.spawned
+        self.transport.closeStdin()
+
+    def outReceived(self, data):
+        self.stats.read_bytes += len(data)
+
+        if self.stream is None:
+            if self.stream_failure is None:
+                self.out_data.append(data)
+            return
+
+        start = time.perf_counter()
+        try:
+            self.stream.feed(data)
+        except Exception:
+            self.stream_failure = Failure()
+            self.stream = None
+        self.feeding += time.perf_counter() - start
+
+    def errReceived(self, data):
+        self.err_data.append(data)
+
+    def inConnectionLost(self):
+        pass
+
+    def outConnectionLost(self):
+        self.end_time = arrow.now()
+
+    def errConnectionLost(self):
+        pass
+
+    def processExited(self, status):
+        pass
+
+    def kill(self):
+        try:
+            self.transport.signalProcess('KILL')
+        except ProcessExitedAlready:
+            pass
+
+    def processEnded(self, status):
+        if self.finished.called:
+            # cancelled, e.g. because the command timed out
+            self.log.debug('process ended {r:} after it was cancelled', r = status.value)
+            return
+
+        if not isinstance(status.value, (ProcessDone, ProcessTerminated)):
+            self.log.debug('process ended {r:}', r = status.value)
+            self.finished.callback(None)
+            return
+
+        if isinstance(status.value, ProcessTerminated):
+            self.log.debug('process ended {r:}', r = status.value)
+            self.log.debug('{e:}', e = (b''.join(self.err_data)).decode('utf-8'))
+            self.finished.callback(None)
+            return
+
+        runtime = self.end_time - self.start_time
+        timestamp = self.start_time + (runtime / 2)
+
+        # the time spent decoding streamed output while it arrived is
+        # not time spent waiting for it
+        start = time.perf_counter()
+        if self.connected is not None:
+            self.stats.wait = start - self.connected - self.feeding
+
+        if self.stream_failure is not None:
+            self.finished.errback(self.stream_failure)
+            return
+
+        try:
+            if self.stream is not None:
+                data = self.stream.finish()
+            elif not self.decode:
+                data = b''.join(self.out_data)
+            else:
+                data = b''.join(self.out_data)
+                data = data.decode('utf-8')
+                data = json.loads(data)
+        except ValueError as e:
+            self.log.debug('command: {c:}\noutput: {o:r}', c = self.command, o = self.out_data)
+            self.finished.errback(e)
+            return
+        finally:
+            self.stats.decode = self.feeding + time.perf_counter() - start
+
+        self.finished.callback((data, timestamp, runtime))
+
+class ProcessBackend(object):
+    """Run every command by spawning the Ceph command line client.
+
+    Members named in *streamed* are parsed while the output is still
+    arriving and their elements handed to the given callables one at a
+    time, so the output of a large ``pg dump`` is never held in memory
+    as a whole.  With *decode* false the raw output is returned
+    undecoded.  If *stats* is given it is filled in with the time spent
+    starting the child, waiting for it and decoding its output."""
+
+    log = Logger()
+
+    def __init__(self, options):
+        self.options = options
+
+    def setTimeout(self, timeout):
+        # every command kills its own child when it times out
+        pass
+
+    def buildCommand(self, subcommand):
+        real_command = ['ceph',
+                        '--conf', self.options.config,
+                        '--keyring', self.options.keyring,
+                        '--name', self.options.name] + \
+                        subcommand + \
+                        ['--format', 'json']
+        short_command = ['ceph'] + subcommand
+        #self.log.debug('{c:}', c = command)
+        return real_command, short_command
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        real_command, short_command = self.buildCommand(subcommand)
+
+        # cancelling the result, e.g. when the command times out, kills
+        # the child
+        finished = Deferred(lambda d: protocol.kill())
+
+        protocol = CephJsonProtocol(finished, short_command, streamed, decode, stats)
+
+        reactor.spawnProcess(protocol,
+                             self.options.executable,
+                             real_command)
+
+        return finished
@@ -0,0 +1,116 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+import shutil
+import tempfile
+import uuid
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.trial.unittest import TestCase
+
+from ....prometheus import metrics
+from ...commands.ceph_pg_dump import CephPgDump
+from ..fixture import FixtureBackend
+
+class FixtureBackendTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(os.path.dirname(__file__), '..', '..', 'commands', 'test', 'data', 'ceph_pg_dump_hammer_1.json'),
+                    os.path.join(self.directory, 'ceph_pg_dump.json'))
+        self.backend = FixtureBackend(argparse.Namespace(fixtures = self.directory))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        for metric in metrics.values():
+            metric.clear()
+
+    def test_path(self):
+        self.assertEqual(self.backend.path(['pg', 'dump']),
+                         os.path.join(self.directory, 'ceph_pg_dump.json'))
+
+    def test_run(self):
+        d = self.backend.run(['pg', 'dump'])
+        result = self.successResultOf(d)
+        data, timestamp, runtime = result
+        self.assertIn('pg_stats', data)
+
+    def test_missing(self):
+        d = self.backend.run(['osd', 'dump'])
+        self.failureResultOf(d, IOError)
+
+    def test_process_result(self):
+        fsid = '{}'.format(uuid.uuid4())
+        ceph_pg_dump = CephPgDump(fsid, None, self.backend)
+        d = self.backend.run(ceph_pg_dump.subcommand)
+        d.addCallback(ceph_pg_dump.processResult)
+        self.successResultOf(d)
+        self.assertEqual(metrics['ceph'].get((('fsid', fsid),)), 1)
+        self.assertIsNotNone(metrics['ceph_command_runtime'].get((('fsid', fsid), ('command', 'ceph pg dump'))))
+
+class InlineWorkers(object):
+    def __init__(self):
+        self.pending = []
+
+    def run(self, f, *args, **kwargs):
+        d = Deferred()
+        self.pending.append((d, f, args, kwargs))
+        return d
+
+    def finish(self):
+        while self.pending:
+            d, f, args, kwargs = self.pending.pop(0)
+            maybeDeferred(f, *args, **kwargs).chainDeferred(d)
+
+class WorkerProcessingTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        shutil.copy(os.path.join(os.path.dirname(__file__), '..', '..', 'commands', 'test', 'data', 'ceph_pg_dump_hammer_1.json'),
+                    os.path.join(self.directory, 'ceph_pg_dump.json'))
+        self.backend = FixtureBackend(argparse.Namespace(fixtures = self.directory))
+        self.workers = InlineWorkers()
+        self.fsid = '{}'.format(uuid.uuid4())
+        self.ceph_pg_dump = CephPgDump(self.fsid, None, self.backend, self.workers)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        for metric in metrics.values():
+            metric.clear()
+
+    def poll(self):
+        d = self.backend.run(self.ceph_pg_dump.subcommand, decode = False)
+        d.addCallback(self.ceph_pg_dump.processInWorker, None)
+        return d
+
+    def test_prepared_in_worker(self):
+        d = self.backend.run(self.ceph_pg_dump.subcommand, decode = False)
+        snapshot = self.ceph_pg_dump.prepareSnapshot(self.successResultOf(d))
+        self.assertIn('text', snapshot.fragments[metrics['ceph_command_runtime']])
+        self.assertIn(('fsid="{}"'.format(self.fsid)).encode('utf-8'), snapshot.fragments[metrics['ceph_command_runtime']]['text'])
+        self.assertIsNone(metrics['ceph'].get((('fsid', self.fsid),)))
+
+    def test_commit_after_worker(self):
+        d = self.poll()
+        self.assertIsNone(metrics['ceph'].get((('fsid', self.fsid),)))
+        self.workers.finish()
+        self.successResultOf(d)
+        self.assertEqual(metrics['ceph'].get((('fsid', self.fsid),)), 1)
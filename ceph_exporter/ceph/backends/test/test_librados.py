@@ -0,0 +1,70 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import argparse
+import json
+import types
+
+from twisted.trial.unittest import TestCase
+
+from ...commands.ceph_pg_dump import CephPgDumpBrief
+from .. import librados
+
+class FakeCluster(object):
+    def __init__(self):
+        self.commands = []
+
+    def mon_command(self, command, inbuf):
+        self.commands.append(json.loads(command))
+        return 0, b'[]', ''
+
+class FakeRados(object):
+    def __init__(self, conffile = None, name = None, conf = None):
+        self.conf = conf
+
+    def connect(self):
+        pass
+
+class RadosBackendTest(TestCase):
+    def setUp(self):
+        self.patch(librados, 'rados', types.SimpleNamespace(Error = Exception))
+        self.backend = librados.RadosBackend(argparse.Namespace(keyring = None, timeout = 0))
+        self.cluster = FakeCluster()
+
+    def test_prefix(self):
+        data, timestamp, runtime = self.backend.monCommand(self.cluster, ['osd', 'dump'], True, None)
+        self.assertEqual(data, [])
+        self.assertEqual(self.cluster.commands, [{'prefix': 'osd dump', 'format': 'json'}])
+
+    def test_mon_command(self):
+        self.backend.monCommand(self.cluster, CephPgDumpBrief.subcommand, True, None, CephPgDumpBrief.mon_command)
+        self.assertEqual(self.cluster.commands, [{'prefix': 'pg dump', 'dumpcontents': ['pgs_brief'], 'format': 'json'}])
+        self.assertEqual(CephPgDumpBrief.mon_command, {'prefix': 'pg dump', 'dumpcontents': ['pgs_brief']})
+
+    def test_timeout_unset(self):
+        self.patch(librados, 'rados', types.SimpleNamespace(Error = Exception, Rados = FakeRados))
+        backend = librados.RadosBackend(argparse.Namespace(keyring = None, config = None, name = None, timeout = None))
+        self.assertNotIn('rados_mon_op_timeout', backend.connect().conf)
+
+    def test_timeout(self):
+        self.patch(librados, 'rados', types.SimpleNamespace(Error = Exception, Rados = FakeRados))
+        backend = librados.RadosBackend(argparse.Namespace(keyring = None, config = None, name = None, timeout = None))
+        backend.setTimeout(299.5)
+        self.assertEqual(backend.connect().conf['rados_mon_op_timeout'], '300')
@@ -0,0 +1,77 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import DeferredSemaphore
+from twisted.trial.unittest import TestCase
+
+from .. import LimitedBackend
+
+class PendingBackend(object):
+    def __init__(self):
+        self.runs = []
+        self.cancelled = 0
+
+    def cancel(self, d):
+        self.cancelled += 1
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        d = Deferred(self.cancel)
+        self.runs.append((subcommand, d))
+        self.mon_command = mon_command
+        return d
+
+class LimitedBackendTest(TestCase):
+    def setUp(self):
+        self.backend = PendingBackend()
+        self.semaphore = DeferredSemaphore(1)
+        self.east = LimitedBackend(self.backend, self.semaphore)
+        self.west = LimitedBackend(self.backend, self.semaphore)
+
+    def test_bounded(self):
+        first = self.east.run(['status'])
+        second = self.west.run(['df'])
+        self.assertEqual([subcommand for subcommand, d in self.backend.runs], [['status']])
+        self.backend.runs[0][1].callback('done')
+        self.assertEqual(self.successResultOf(first), 'done')
+        self.assertEqual([subcommand for subcommand, d in self.backend.runs], [['status'], ['df']])
+        self.assertNoResult(second)
+
+    def test_cancel_waiting(self):
+        first = self.east.run(['status'])
+        second = self.west.run(['df'])
+        second.cancel()
+        self.failureResultOf(second)
+        self.assertEqual(self.backend.cancelled, 0)
+        self.backend.runs[0][1].callback('done')
+        self.assertEqual(self.successResultOf(first), 'done')
+        self.assertEqual(len(self.backend.runs), 1)
+        self.assertEqual(self.semaphore.tokens, 1)
+
+    def test_cancel_running(self):
+        first = self.east.run(['status'])
+        first.cancel()
+        self.failureResultOf(first)
+        self.assertEqual(self.backend.cancelled, 1)
+        self.assertEqual(self.semaphore.tokens, 1)
+
+    def test_mon_command(self):
+        self.east.run(['pg', 'dump', 'pgs_brief'], mon_command = {'prefix': 'pg dump', 'dumpcontents': ['pgs_brief']})
+        self.assertEqual(self.backend.mon_command, {'prefix': 'pg dump', 'dumpcontents': ['pgs_brief']})
@@ -0,0 +1,69 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import arrow
+import json
+import os
+
+from twisted.internet.defer import Deferred
+from twisted.internet.error import ProcessDone
+from twisted.python.failure import Failure
+from twisted.trial.unittest import TestCase
+
+from ..process import CephJsonProtocol
+
+class CephJsonProtocolTest(TestCase):
+    def setUp(self):
+        path = os.path.join(os.path.dirname(__file__), '..', '..', 'commands', 'test', 'data', 'ceph_pg_dump_hammer_1.json')
+        with open(path, 'rb') as f:
+            self.output = f.read()
+
+    def run_protocol(self, streamed):
+        finished = Deferred()
+        protocol = CephJsonProtocol(finished, ['ceph', 'pg', 'dump'], streamed)
+        protocol.start_time = arrow.now()
+        for i in range(0, len(self.output), 65536):
+            protocol.outReceived(self.output[i:i + 65536])
+        protocol.outConnectionLost()
+        protocol.processEnded(Failure(ProcessDone(0)))
+        return self.successResultOf(finished)
+
+    def test_buffered(self):
+        data, timestamp, runtime = self.run_protocol(None)
+        self.assertEqual(data, json.loads(self.output.decode('utf-8')))
+
+    def test_streamed(self):
+        pgs = []
+        data, timestamp, runtime = self.run_protocol({'pg_stats': pgs.append})
+        expected = json.loads(self.output.decode('utf-8'))
+        self.assertEqual(pgs, expected['pg_stats'])
+        self.assertEqual(data['pg_stats'], [])
+        self.assertEqual(data['osd_stats'], expected['osd_stats'])
+
+    def test_streamed_handler_error(self):
+        def fail(element):
+            raise KeyError('stat_sum')
+        finished = Deferred()
+        protocol = CephJsonProtocol(finished, ['ceph', 'pg', 'dump'], {'pg_stats': fail})
+        protocol.start_time = arrow.now()
+        protocol.outReceived(self.output)
+        protocol.outConnectionLost()
+        protocol.processEnded(Failure(ProcessDone(0)))
+        self.failureResultOf(finished, KeyError)
@@ -20,54 +20,35 @@
 
 from twisted.logger import Logger
 
-from ...prometheus import Sample
-from ...prometheus import Label
-
 from .. import Ceph
-from ..metrics import ceph_objects
-from ..metrics import ceph_pool
-from ..metrics import ceph_storage_bytes
+from ..mapping import compile_fields
+from ..mapping import Field
+from ..metrics.ceph_objects import ceph_objects
+from ..metrics.ceph_storage_bytes import ceph_storage_bytes
+
+# stats
+cluster_fields = [Field(('total_used_bytes',), ceph_storage_bytes, (('type', 'used'),)),
+                  Field(('total_avail_bytes',), ceph_storage_bytes, (('type', 'available'),))]
+
+# every element of pools
+pool_fields = [Field(('stats', 'bytes_used'), ceph_storage_bytes, (('type', 'used'),)),
+               Field(('stats', 'objects'), ceph_objects, (('type', 'objects'),))]
 
 class CephDf(Ceph):
     log = Logger()
+    # ceph_pool is left to osd dump, which lists the same pools
     subcommand = ['df']
 
-    def processData(self, result):
-        data, timestamp = result
+    def __init__(self, fsid, options, backend = None, workers = None):
+        Ceph.__init__(self, fsid, options, backend, workers)
+        self.extractCluster = compile_fields(cluster_fields, 'cluster', self.wants, fsid, 'stats')
+        self.extractPool = compile_fields(pool_fields, 'pool', self.wants, fsid, 'pools')
 
-        Sample('ceph_storage_bytes',
-               [Label('fsid', self.fsid),
-                Label('scope', 'cluster'),
-                Label('type', 'used')],
-               data['stats']['total_used_bytes'],
-               timestamp)
-        Sample('ceph_storage_bytes',
-               [Label('fsid', self.fsid),
-                Label('scope', 'cluster'),
-                Label('type', 'available')],
-               data['stats']['total_avail_bytes'],
-               timestamp)
+    def processData(self, data, snapshot):
+        self.extractCluster(data['stats'], (), snapshot)
 
         for pool in data['pools']:
-            Sample('ceph_pool',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['id'])),
-                    Label('name', pool['name'])],
-                   1,
-                   timestamp)
-            Sample('ceph_storage_bytes',
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'pool'),
-                    Label('pool', '{:d}'.format(pool['id'])),
-                    Label('name', pool['name']),
-                    Label('type', 'used')],
-                   pool['stats']['bytes_used'],
-                   timestamp)
-            Sample('ceph_objects',
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'pool'),
-                    Label('pool', '{:d}'.format(pool['id'])),
-                    Label('name', pool['name']),
-                    Label('type', 'objects')],
-                   pool['stats']['objects'],
-                   timestamp)
+            self.extractPool(pool,
+                             (('pool', '{:d}'.format(pool['id'])),
+                              ('name', pool['name'])),
+                             snapshot)
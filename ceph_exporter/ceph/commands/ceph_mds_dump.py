@@ -20,10 +20,8 @@
 
 from twisted.logger import Logger
 
-from ...prometheus import Sample
-from ...prometheus import Label
-
 from .. import Ceph
+from ..timestamps import ceph_timestamp
 
 from ..metrics.ceph_epoch import ceph_epoch
 from ..metrics.ceph_mds_state import ceph_mds_state
@@ -32,56 +30,70 @@ from ..metrics.ceph_mds_laggy_since import ceph_mds_laggy_since
 class CephMdsDump(Ceph):
     log = Logger()
     subcommand = ['mds', 'dump']
+    epoch_cache = True
+
+    def __init__(self, fsid, options, backend = None, workers = None):
+        Ceph.__init__(self, fsid, options, backend, workers)
+        # (ceph_mds_laggy_since slot, laggy since or None if the MDS is
+        # not laggy) as of the last processed map
+        self.laggy_since = []
+
+    def mapEpoch(self, data):
+        return data['epoch']
+
+    def reuseSnapshot(self, previous, snapshot):
+        # an MDS that is not laggy is reported as laggy since now, which
+        # has to be refreshed even though the map is the same
+        snapshot.reuse(previous, skip = (ceph_mds_laggy_since,))
+        for slot, laggy_since in self.laggy_since:
+            if laggy_since is None:
+                laggy_since = snapshot.timestamp / 1000.0
+            snapshot.setSlot(ceph_mds_laggy_since, slot, laggy_since)
 
     # this is changed in Jewel
-    def processData(self, result):
-        data, timestamp = result
+    def processData(self, data, snapshot):
+        fsid = ('fsid', self.fsid)
+        self.laggy_since = []
+
+        if self.wants(ceph_epoch, 'cluster'):
+            snapshot.set(ceph_epoch,
+                         (fsid,
+                          ('type', 'mds')),
+                         data['epoch'])
 
-        Sample('ceph_epoch',
-               [Label('fsid', self.fsid),
-                Label('type', 'mds')],
-               data['epoch'],
-               timestamp)
+        want_state = self.wants(ceph_mds_state, 'cluster')
+        want_laggy_since = self.wants(ceph_mds_laggy_since, 'cluster')
 
         for info in data['info'].values():
-            for state in ['up:active', 'up:replay', 'up:rejoin']:
-                if state == info['state']:
-                    value = 1
-                else:
-                    value = 0
-
-                Sample('ceph_mds_state',
-                       [Label('fsid', self.fsid),
-                        Label('gid', '{}'.format(info['gid'])),
-                        Label('rank', '{}'.format(info['rank'])),
-                        Label('name', info['name']),
-                        Label('state', state)],
-                       value,
-                       timestamp)
-
-            if info['state'] not in ['up:active', 'up:replay', 'up:rejoin']:
-                Sample('ceph_mds_state',
-                       [Label('fsid', self.fsid),
-                        Label('gid', '{}'.format(info['gid'])),
-                        Label('rank', '{}'.format(info['rank'])),
-                        Label('name', info['name']),
-                        Label('state', info['state'])],
-                       1,
-                       timestamp)
+            mds = (fsid,
+                   ('gid', '{}'.format(info['gid'])),
+                   ('rank', '{}'.format(info['rank'])),
+                   ('name', info['name']))
+
+            if want_state:
+                for state in ['up:active', 'up:replay', 'up:rejoin']:
+                    if state == info['state']:
+                        value = 1
+                    else:
+                        value = 0
+
+                    snapshot.set(ceph_mds_state,
+                                 mds + (('state', state),),
+                                 value)
+
+                if info['state'] not in ['up:active', 'up:replay', 'up:rejoin']:
+                    snapshot.set(ceph_mds_state,
+                                 mds + (('state', info['state']),),
+                                 1)
+
+            if not want_laggy_since:
+                continue
 
+            slot = ceph_mds_laggy_since.slot(mds)
             if 'laggy_since' in info:
-                Sample('ceph_mds_laggy_since',
-                       [Label('fsid', self.fsid),
-                        Label('gid', '{}'.format(info['gid'])),
-                        Label('rank', '{}'.format(info['rank'])),
-                        Label('name', info['name'])],
-                       arrow.get(info['laggy_since']).replace(tzinfo=tzlocal()).float_timestamp,
-                       timestamp)
+                laggy_since = ceph_timestamp(info['laggy_since'])
+                snapshot.setSlot(ceph_mds_laggy_since, slot, laggy_since)
+                self.laggy_since.append((slot, laggy_since))
             else:
-                Sample('ceph_mds_laggy_since',
-                       [Label('fsid', self.fsid),
-                        Label('gid', '{}'.format(info['gid'])),
-                        Label('rank', '{}'.format(info['rank'])),
-                        Label('name', info['name'])],
-                       timestamp.float_timestamp,
-                       timestamp)
+                snapshot.setSlot(ceph_mds_laggy_since, slot, snapshot.timestamp / 1000.0)
+                self.laggy_since.append((slot, None))
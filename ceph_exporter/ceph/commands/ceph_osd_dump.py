@@ -20,11 +20,9 @@
 
 from twisted.logger import Logger
 
-from ...prometheus import Label
-from ...prometheus import Metric
-from ...prometheus import Sample
-
 from .. import Ceph
+from ..mapping import compile_fields
+from ..mapping import Field
 
 from ..metrics.ceph_osd import ceph_osd
 from ..metrics.ceph_osd_down import ceph_osd_down
@@ -37,68 +35,42 @@ from ..metrics.ceph_pool_pg_num import ceph_pool_pg_num
 from ..metrics.ceph_pool_pgp_num import ceph_pool_pgp_num
 from ..metrics.ceph_pool_size import ceph_pool_size
 
+def complement(value):
+    return 1 - value
+
+# every element of pools
+pool_fields = [Field(None, ceph_pool, scoped = False),
+               Field(('size',), ceph_pool_size, scoped = False),
+               Field(('min_size',), ceph_pool_min_size, scoped = False),
+               Field(('pg_num',), ceph_pool_pg_num, scoped = False),
+               Field(('pg_placement_num',), ceph_pool_pgp_num, scoped = False)]
+
+# every element of osds
+osd_fields = [Field(None, ceph_osd, scoped = False),
+              Field(('up',), ceph_osd_up, scoped = False),
+              Field(('up',), ceph_osd_down, convert = complement, scoped = False),
+              Field(('in',), ceph_osd_in, scoped = False),
+              Field(('in',), ceph_osd_out, convert = complement, scoped = False)]
+
 class CephOsdDump(Ceph):
     log = Logger()
     subcommand = ['osd', 'dump']
+    epoch_cache = True
+
+    def __init__(self, fsid, options, backend = None, workers = None):
+        Ceph.__init__(self, fsid, options, backend, workers)
+        self.extractPool = compile_fields(pool_fields, 'pool', self.wants, fsid, 'pools')
+        self.extractOsd = compile_fields(osd_fields, 'osd', self.wants, fsid, 'osds')
 
-    def processData(self, result):
-        data, timestamp = result
+    def mapEpoch(self, data):
+        return data['epoch']
 
+    def processData(self, data, snapshot):
         for pool in data['pools']:
-            Sample('ceph_pool',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['pool'])),
-                    Label('name', pool['pool_name'])],
-                   1,
-                   timestamp)
-            Sample('ceph_pool_size',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['pool'])),
-                    Label('name', pool['pool_name'])],
-                   pool['size'],
-                   timestamp)
-            Sample('ceph_pool_min_size',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['pool'])),
-                    Label('name', pool['pool_name'])],
-                   pool['min_size'],
-                   timestamp)
-            Sample('ceph_pool_pg_num',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['pool'])),
-                    Label('name', pool['pool_name'])],
-                   pool['pg_num'],
-                   timestamp)
-            Sample('ceph_pool_pgp_num',
-                   [Label('fsid', self.fsid),
-                    Label('pool', '{:d}'.format(pool['pool'])),
-                    Label('name', pool['pool_name'])],
-                   pool['pg_placement_num'],
-                   timestamp)
+            self.extractPool(pool,
+                             (('pool', '{:d}'.format(pool['pool'])),
+                              ('name', pool['pool_name'])),
+                             snapshot)
 
         for osd in data['osds']:
-            Sample('ceph_osd',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   1,
-                   timestamp)
-            Sample('ceph_osd_up',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   osd['up'],
-                   timestamp)
-            Sample('ceph_osd_down',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   1 - osd['up'],
-                   timestamp)
-            Sample('ceph_osd_in',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   osd['in'],
-                   timestamp)
-            Sample('ceph_osd_out',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   1 - osd['in'],
-                   timestamp)
+            self.extractOsd(osd, (('osd', '{:d}'.format(osd['osd'])),), snapshot)
@@ -18,24 +18,28 @@
 # along with ceph_exporter.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-import arrow
-import re
-from dateutil.tz import tzlocal
-
 from twisted.logger import Logger
 
-from ...prometheus import Sample
-from ...prometheus import Label
+from ...prometheus import committed
 
 from .. import Ceph
+from ..mapping import compile_fields
+from ..mapping import Field
+from ..timestamps import ceph_timestamp
 
 from ..metrics.ceph_bytes_recovered import ceph_bytes_recovered
 from ..metrics.ceph_keys_recovered import ceph_keys_recovered
 from ..metrics.ceph_objects import ceph_objects
 from ..metrics.ceph_objects_recovered import ceph_objects_recovered
-from ..metrics.ceph_osd import ceph_osd
 from ..metrics.ceph_osd_latency_seconds import ceph_osd_latency_seconds
 from ..metrics.ceph_osd_number_snap_trimming import ceph_osd_number_snap_trimming
+from ..metrics.ceph_osd_pg_bytes_recovered import ceph_osd_pg_bytes_recovered
+from ..metrics.ceph_osd_pg_keys_recovered import ceph_osd_pg_keys_recovered
+from ..metrics.ceph_osd_pg_objects_recovered import ceph_osd_pg_objects_recovered
+from ..metrics.ceph_osd_pg_read_bytes import ceph_osd_pg_read_bytes
+from ..metrics.ceph_osd_pg_read_ops import ceph_osd_pg_read_ops
+from ..metrics.ceph_osd_pg_write_bytes import ceph_osd_pg_write_bytes
+from ..metrics.ceph_osd_pg_write_ops import ceph_osd_pg_write_ops
 from ..metrics.ceph_osd_snap_trim_queue_length import ceph_osd_snap_trim_queue_length
 from ..metrics.ceph_pg import ceph_pg
 from ..metrics.ceph_pg_state import ceph_pg_state
@@ -46,215 +50,359 @@ from ..metrics.ceph_storage_bytes import ceph_storage_bytes
 from ..metrics.ceph_write_bytes import ceph_write_bytes
 from ..metrics.ceph_write_ops import ceph_write_ops
 
-pgid_re = re.compile(r'\A([a-f0-9]+)\.([a-f0-9]+)\Z', re.IGNORECASE)
+# the acting set of an erasure coded PG has this in place of an OSD
+# for every shard that currently has no OSD
+crush_item_none = 0x7fffffff
+
+hex_digits = frozenset('0123456789abcdefABCDEF')
 
 def pgid_to_pool(value):
-    match = pgid_re.match(value)
-    if match:
-        return match.group(1)
+    pool, separator, seed = value.partition('.')
+    if separator and pool and seed and hex_digits.issuperset(pool) and hex_digits.issuperset(seed):
+        return pool
     return None
 
+# the stat_sum keys exported as types of ceph_objects for PGs, and in
+# addition to those for pools and the cluster
+pg_object_types = [('num_objects', 'objects'),
+                   ('num_object_clones', 'clones'),
+                   ('num_object_copies', 'copies'),
+                   ('num_objects_missing_on_primary', 'missing_on_primary'),
+                   ('num_objects_degraded', 'degraded'),
+                   ('num_objects_misplaced', 'misplaced'),
+                   ('num_objects_unfound', 'unfound'),
+                   ('num_objects_dirty', 'dirty')]
+
+object_types = pg_object_types + [('num_objects_missing', 'missing'),
+                                  ('num_flush', 'flush'),
+                                  ('num_evict', 'evict'),
+                                  ('num_promote', 'promote')]
+
+recovered = [('num_objects_recovered', ceph_objects_recovered),
+             ('num_bytes_recovered', ceph_bytes_recovered),
+             ('num_keys_recovered', ceph_keys_recovered)]
+
+client_io = [('num_read', ceph_read_ops, 1),
+             ('num_read_kb', ceph_read_bytes, 1024),
+             ('num_write', ceph_write_ops, 1),
+             ('num_write_kb', ceph_write_bytes, 1024)]
+
+# the counters of a PG move with it when it is remapped, so their sums
+# per OSD go down as well as up and are exported as gauges of their own
+osd_recovered = [('num_objects_recovered', ceph_osd_pg_objects_recovered),
+                 ('num_bytes_recovered', ceph_osd_pg_bytes_recovered),
+                 ('num_keys_recovered', ceph_osd_pg_keys_recovered)]
+
+osd_client_io = [('num_read', ceph_osd_pg_read_ops, 1),
+                 ('num_read_kb', ceph_osd_pg_read_bytes, 1024),
+                 ('num_write', ceph_osd_pg_write_ops, 1),
+                 ('num_write_kb', ceph_osd_pg_write_bytes, 1024)]
+
+# the keys of the PG timestamps and the event label of each
+pg_timestamps = [('last_fresh', 'last_fresh'),
+                 ('last_change', 'last_change'),
+                 ('last_active', 'last_active'),
+                 ('last_peered', 'last_peered'),
+                 ('last_clean', 'last_clean'),
+                 ('last_became_active', 'last_became_active'),
+                 ('last_became_peered', 'last_became_peered'),
+                 ('last_unstale', 'last_unstale'),
+                 ('last_undegraded', 'last_undegraded'),
+                 ('last_fullsized', 'last_fullsized'),
+                 ('last_scrub_stamp', 'last_scrub'),
+                 ('last_deep_scrub_stamp', 'last_deep_scrub'),
+                 ('last_clean_scrub_stamp', 'last_clean_scrub')]
+
+def stat_sum_objects(types):
+    return [Field(('stat_sum', key), ceph_objects, (('type', stat),)) for key, stat in types]
+
+def stat_sum_client_io():
+    return [Field(('stat_sum', key), metric, scale = scale) for key, metric, scale in client_io]
+
+# pg_stats_sum
+cluster_fields = (stat_sum_objects(object_types) +
+                  stat_sum_client_io())
+
+# every element of pool_stats, which already holds the sums of the
+# stats of the PGs of each pool
+pool_fields = (stat_sum_objects(object_types) +
+               [Field(('stat_sum', key), metric) for key, metric in recovered] +
+               stat_sum_client_io())
+
+# every element of osd_stats
+osd_fields = [Field(('kb_avail',), ceph_storage_bytes, (('type', 'available'),), scale = 1024),
+              Field(('kb_used',), ceph_storage_bytes, (('type', 'used'),), scale = 1024),
+              Field(('snap_trim_queue_len',), ceph_osd_snap_trim_queue_length, scoped = False),
+              Field(('num_snap_trimming',), ceph_osd_number_snap_trimming, scoped = False),
+              Field(('fs_perf_stat', 'apply_latency_ms'), ceph_osd_latency_seconds, (('type', 'apply'),), divisor = 1000.0, scoped = False),
+              Field(('fs_perf_stat', 'commit_latency_ms'), ceph_osd_latency_seconds, (('type', 'commit'),), divisor = 1000.0, scoped = False)]
+
+# every element of pg_stats
+pg_fields = ([Field(None, ceph_pg, scoped = False),
+              Field(('stat_sum', 'num_bytes'), ceph_storage_bytes, (('type', 'used'),))] +
+             stat_sum_objects(pg_object_types) +
+             stat_sum_client_io() +
+             [Field(('stat_sum', key), metric) for key, metric in recovered] +
+             [Field((key,), ceph_pg_timestamp, (('event', event),), convert = ceph_timestamp, optional = True, scoped = False)
+              for key, event in pg_timestamps])
+
 class CephPgDump(Ceph):
+    """Poll the full pg dump.
+
+    With --pg-dump-mode=tiered the states of the PGs come from the much
+    smaller output of pg dump pgs_brief instead, see CephPgDumpBrief,
+    and the full dump, which is then only needed for the stats, is
+    polled full_interval_factor times less often by default."""
+
     log = Logger()
     subcommand = ['pg', 'dump']
+    streamed = {'osd_stats': 'processOsd',
+                'pg_stats': 'processPg'}
+
+    full_interval_factor = 10
+
+    # per PG stats that are summed into OSD scope series, as (stat_sum
+    # key, metric, extra labels, scale, whether the series has a scope
+    # label); a PG counts towards every OSD in its acting set
+    rollups = ([(key, ceph_objects, (('type', stat),), 1, True) for key, stat in pg_object_types] +
+               [(key, metric, (), 1, False) for key, metric in osd_recovered])
+
+    # client I/O is served by the primary, so it is only counted towards
+    # the acting primary of each PG
+    primary_rollups = [(key, metric, (), scale, False) for key, metric, scale in osd_client_io]
+
+    def __init__(self, fsid, options, backend = None, workers = None):
+        Ceph.__init__(self, fsid, options, backend, workers)
+        if options is None:
+            self.pg_state_mode = 'all'
+            self.tiered = False
+        else:
+            self.pg_state_mode = options.pg_state_mode
+            self.tiered = options.pg_dump_mode == 'tiered'
+        # pgid -> (state, ceph_pg_state slot, snapshot) as of the last
+        # poll that included the PG
+        self.pg_states = {}
+        self.extractCluster = compile_fields(cluster_fields, 'cluster', self.wants, fsid, 'pg_stats_sum')
+        self.extractPool = compile_fields(pool_fields, 'pool', self.wants, fsid, 'pool_stats')
+        self.extractOsd = compile_fields(osd_fields, 'osd', self.wants, fsid, 'osd_stats')
+        # the PGs themselves come from pgs_brief when tiered
+        self.extractPg = compile_fields([field for field in pg_fields if not (self.tiered and field.metric is ceph_pg)],
+                                        'pg', self.wants, fsid, 'pg_stats')
+        self.osd_rollups = [rollup for rollup in self.rollups if self.wants(rollup[1], 'osd')]
+        self.osd_primary_rollups = [rollup for rollup in self.primary_rollups if self.wants(rollup[1], 'osd')]
+        # osd -> sums of osd_rollups followed by osd_primary_rollups
+        # over the PGs seen so far by the poll that is in progress
+        self.osd_sums = {}
+        self.osd_sums_snapshot = None
 
-    def processData(self, result):
-        data, timestamp = result
-
-        for key, stat in [('num_objects', 'objects'),
-                          ('num_object_clones', 'clones'),
-                          ('num_object_copies', 'copies'),
-                          ('num_objects_missing_on_primary', 'missing_on_primary'),
-                          ('num_objects_missing', 'missing'),
-                          ('num_objects_degraded', 'degraded'),
-                          ('num_objects_misplaced', 'misplaced'),
-                          ('num_objects_unfound', 'unfound'),
-                          ('num_objects_dirty', 'dirty'),
-                          ('num_flush', 'flush'),
-                          ('num_evict', 'evict'),
-                          ('num_promote', 'promote')]:
-
-            Sample('ceph_objects',
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'cluster'),
-                    Label('type', stat)],
-                   data['pg_stats_sum']['stat_sum'][key],
-                   timestamp)
-
-        for direction in ['read', 'write']:
-            Sample('ceph_{}_ops'.format(direction),
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'cluster')],
-                   data['pg_stats_sum']['stat_sum']['num_{}'.format(direction)],
-                   timestamp)
-
-            Sample('ceph_{}_bytes'.format(direction),
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'cluster')],
-                   data['pg_stats_sum']['stat_sum']['num_{}_kb'.format(direction)] * 1024,
-                   timestamp)
+    def defaultInterval(self, options):
+        if options.pg_dump_mode == 'tiered':
+            return options.interval * self.full_interval_factor
+        return options.interval
+
+    def processData(self, data, snapshot):
+        self.extractCluster(data['pg_stats_sum'], (), snapshot)
 
         for osd in data['osd_stats']:
-            Sample('ceph_osd',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   1,
-                   timestamp)
-            for key, stat in [('kb_avail', 'available'),
-                              ('kb_used', 'used')]:
-                Sample('ceph_storage_bytes',
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'osd'),
-                        Label('osd', '{:d}'.format(osd['osd'])),
-                        Label('type', stat)],
-                       osd[key] * 1024,
-                       timestamp)
-            Sample('ceph_osd_snap_trim_queue_length',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   osd['snap_trim_queue_len'],
-                   timestamp)
-            Sample('ceph_osd_number_snap_trimming',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd']))],
-                   osd['num_snap_trimming'],
-                   timestamp)
-            Sample('ceph_osd_latency_seconds',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd'])),
-                    Label('type', 'apply')],
-                   osd['fs_perf_stat']['apply_latency_ms'] / 1000.0,
-                   timestamp)
-            Sample('ceph_osd_latency_seconds',
-                   [Label('fsid', self.fsid),
-                    Label('osd', '{:d}'.format(osd['osd'])),
-                    Label('type', 'commit')],
-                   osd['fs_perf_stat']['commit_latency_ms'] / 1000.0,
-                   timestamp)
+            self.processOsd(osd, snapshot)
 
         for pg in data['pg_stats']:
-            Sample('ceph_pg',
-                   [Label('fsid', self.fsid),
-                    Label('pool', pgid_to_pool(pg['pgid'])),
-                    Label('pgid', pg['pgid'])],
-                   1,
-                   timestamp)
-
-            Sample('ceph_storage_bytes',
-                   [Label('fsid', self.fsid),
-                    Label('scope', 'pg'),
-                    Label('pool', pgid_to_pool(pg['pgid'])),
-                    Label('pgid', pg['pgid']),
-                    Label('type', 'used')],
-                   pg['stat_sum']['num_bytes'],
-                   timestamp)
-
-            for key, stat in [('num_objects', 'objects'),
-                              ('num_object_clones', 'clones'),
-                              ('num_object_copies', 'copies'),
-                              ('num_objects_missing_on_primary', 'missing_on_primary'),
-                              ('num_objects_degraded', 'degraded'),
-                              ('num_objects_misplaced', 'misplaced'),
-                              ('num_objects_unfound', 'unfound'),
-                              ('num_objects_dirty', 'dirty')]:
-
-                Sample('ceph_objects',
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'pg'),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid']),
-                        Label('type', stat)],
-                       pg['stat_sum'][key],
-                       timestamp)
-
-            for direction in ['read', 'write']:
-                Sample('ceph_{}_ops'.format(direction),
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'pg'),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid'])],
-                       pg['stat_sum']['num_{}'.format(direction)],
-                       timestamp)
-
-                Sample('ceph_{}_bytes'.format(direction),
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'pg'),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid'])],
-                       pg['stat_sum']['num_{}_kb'.format(direction)] * 1024,
-                       timestamp)
-
-            for stat in ['objects', 'bytes', 'keys']:
-                Sample('ceph_{}_recovered'.format(stat),
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'pg'),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid'])],
-                       pg['stat_sum']['num_{}_recovered'.format(stat)],
-                       timestamp)
-
-            for key, stat in [('last_fresh', 'last_fresh'),
-                              ('last_change', 'last_change'),
-                              ('last_active', 'last_active'),
-                              ('last_peered', 'last_peered'),
-                              ('last_clean', 'last_clean'),
-                              ('last_became_active', 'last_became_active'),
-                              ('last_became_peered', 'last_became_peered'),
-                              ('last_unstale', 'last_unstale'),
-                              ('last_undegraded', 'last_undegraded'),
-                              ('last_fullsized', 'last_fullsized'),
-                              ('last_scrub_stamp', 'last_scrub'),
-                              ('last_deep_scrub_stamp', 'last_deep_scrub'),
-                              ('last_clean_scrub_stamp', 'last_clean_scrub')]:
-                if key in pg:
-                    value = arrow.get(pg[key]).replace(tzinfo = tzlocal()).float_timestamp
-                    Sample('ceph_pg_timestamp',
-                           [Label('fsid', self.fsid),
-                            Label('pool', pgid_to_pool(pg['pgid'])),
-                            Label('pgid', pg['pgid']),
-                            Label('event', stat)],
-                           value,
-                           timestamp)
+            self.processPg(pg, snapshot)
+
+        # forget PGs that were not part of this poll
+        self.pg_states = dict([(pgid, pg_state) for pgid, pg_state in self.pg_states.items() if pg_state[2] is snapshot])
+
+        self.processOsdRollups(snapshot)
+
+        for pool in data['pool_stats']:
+            self.extractPool(pool, (('pool', '{:d}'.format(pool['poolid'])),), snapshot)
+
+    def processOsdRollups(self, snapshot):
+        fsid = ('fsid', self.fsid)
+        rollups = self.osd_rollups + self.osd_primary_rollups
+
+        for osd, sums in sorted(self.osdSums(snapshot).items()):
+            osd = ('osd', '{:d}'.format(osd))
+            scoped = (fsid, ('scope', 'osd'), osd)
+            unscoped = (fsid, osd)
 
+            for index, (key, metric, labels, scale, scope) in enumerate(rollups):
+                snapshot.set(metric,
+                             (scoped if scope else unscoped) + labels,
+                             sums[index] * scale)
+
+        self.osd_sums = {}
+        self.osd_sums_snapshot = None
+
+    def osdSums(self, snapshot):
+        """Return the per OSD sums of the poll that *snapshot* belongs to."""
+        if self.osd_sums_snapshot is not snapshot:
+            self.osd_sums = {}
+            self.osd_sums_snapshot = snapshot
+        return self.osd_sums
+
+    def addToOsdSums(self, pg, snapshot):
+        stat_sum = pg['stat_sum']
+        osd_sums = self.osdSums(snapshot)
+        width = len(self.osd_rollups) + len(self.osd_primary_rollups)
+
+        if self.osd_rollups:
+            values = [stat_sum[rollup[0]] for rollup in self.osd_rollups]
+            for osd in pg['acting']:
+                if osd == crush_item_none:
+                    continue
+                try:
+                    sums = osd_sums[osd]
+                except KeyError:
+                    sums = osd_sums[osd] = [0] * width
+                for index, value in enumerate(values):
+                    sums[index] += value
+
+        if self.osd_primary_rollups:
+            osd = pg['acting_primary']
+            if osd < 0 or osd == crush_item_none:
+                return
+            try:
+                sums = osd_sums[osd]
+            except KeyError:
+                sums = osd_sums[osd] = [0] * width
+            offset = len(self.osd_rollups)
+            for index, rollup in enumerate(self.osd_primary_rollups):
+                sums[offset + index] += stat_sum[rollup[0]]
+
+    def processOsd(self, osd, snapshot):
+        # ceph_osd is left to osd dump, which also lists the OSDs that
+        # don't report stats
+        self.extractOsd(osd, (('osd', '{:d}'.format(osd['osd'])),), snapshot)
+
+    def processPg(self, pg, snapshot):
+        fsid = ('fsid', self.fsid)
+        pool = ('pool', pgid_to_pool(pg['pgid']))
+        pgid = ('pgid', pg['pgid'])
+        labels = (fsid, pool, pgid)
+
+        if self.osd_rollups or self.osd_primary_rollups:
+            self.addToOsdSums(pg, snapshot)
+
+        self.extractPg(pg, (pool, pgid), snapshot)
+
+        if not self.tiered:
+            self.processPgState(pg, labels, snapshot)
+
+    def processPgState(self, pg, labels, snapshot):
+        if not self.wants(ceph_pg_state, 'pg'):
+            return
+
+        if self.pg_state_mode == 'current':
+            # only export the state the PG is in; the slot of the
+            # series is reused for as long as the state is unchanged and
+            # the snapshot that has it is still exported, and as every
+            # series is 1 the rendered label text of those slots is
+            # joined as it is, so only the PGs whose state changed are
+            # rendered again, see Metric.renderText()
+            state = pg['state']
+            previous = self.pg_states.get(pg['pgid'])
+            if previous is not None and previous[0] == state and previous[2] in committed:
+                slot = previous[1]
+            else:
+                if state not in self.states:
+                    self.log.debug('Unknown state "{state:}"', state = state)
+                slot = ceph_pg_state.slot(labels + (('state', state),))
+            self.pg_states[pg['pgid']] = (state, slot, snapshot)
+            snapshot.setSlot(ceph_pg_state, slot, 1)
+        else:
             for state in self.states:
                 if pg['state'] == state:
                     value = 1
                 else:
                     value = 0
-                Sample('ceph_pg_state',
-                       [Label('fsid', self.fsid),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid']),
-                        Label('state', state)],
-                       value,
-                       timestamp)
+                snapshot.set(ceph_pg_state,
+                             labels + (('state', state),),
+                             value)
             if pg['state'] not in self.states:
                 self.log.debug('Unknown state "{state:}"', state = pg['state'])
-                Sample('ceph_pg_state',
-                       [Label('fsid', self.fsid),
-                        Label('pool', pgid_to_pool(pg['pgid'])),
-                        Label('pgid', pg['pgid']),
-                        Label('state', pg['state'])],
-                       1,
-                       timestamp)
+                snapshot.set(ceph_pg_state,
+                             labels + (('state', pg['state']),),
+                             1)
 
-        for pool in data['pool_stats']:
-            for key, stat in [('num_objects', 'objects'),
-                              ('num_object_clones', 'clones'),
-                              ('num_object_copies', 'copies'),
-                              ('num_objects_missing_on_primary', 'missing_on_primary'),
-                              ('num_objects_missing', 'missing'),
-                              ('num_objects_degraded', 'degraded'),
-                              ('num_objects_misplaced', 'misplaced'),
-                              ('num_objects_unfound', 'unfound'),
-                              ('num_objects_dirty', 'dirty'),
-                              ('num_flush', 'flush'),
-                              ('num_evict', 'evict'),
-                              ('num_promote', 'promote')]:
-                Sample('ceph_objects',
-                       [Label('fsid', self.fsid),
-                        Label('scope', 'pool'),
-                        Label('pool', '{:d}'.format(pool['poolid'])),
-                        Label('type', stat)],
-                       pool['stat_sum'][key],
-                       timestamp)
+class CephPgDumpBrief(CephPgDump):
+    """Poll the states of the PGs from pg dump pgs_brief in tiered mode.
+
+    The output holds only the state, up and acting sets of each PG, so
+    it is cheap to produce and to parse and is polled at the normal
+    interval.  This command exports ceph_pg and ceph_pg_state, the full
+    pg dump everything else, and both use the same labels for a PG, so
+    the series of a PG carry on whichever tier last saw it.
+
+    When PGs were added or removed or a PG changed state the next full
+    pg dump is brought forward, but not to less than early_fraction of
+    its current delay, which grows while it backs off, after its last
+    run.  Scrubs start and finish all
+    the time on a large cluster, so a PG that only started or stopped
+    scrubbing does not count as a change."""
+
+    log = Logger()
+    subcommand = ['pg', 'dump', 'pgs_brief']
+    mon_command = {'prefix': 'pg dump', 'dumpcontents': ['pgs_brief']}
+    streamed = {}
+
+    # the flags of a PG state that are left out when looking for changes
+    scrub_flags = frozenset(['scrubbing', 'deep'])
+
+    early_fraction = 0.25
+
+    def __init__(self, fsid, options, backend = None, workers = None, full = None):
+        CephPgDump.__init__(self, fsid, options, backend, workers)
+        self.full = full
+        if options is not None:
+            self.early_fraction = options.pg_dump_early_after
+        # pgid -> state without scrub_flags as of the last poll
+        self.brief_states = {}
+        # whether there is a change that the full dump has not seen yet,
+        # and the last start of the full dump when it was found
+        self.changed = False
+        self.changed_since = None
+
+    def significantState(self, state):
+        if 'scrubbing' not in state:
+            return state
+        return '+'.join([flag for flag in state.split('+') if flag not in self.scrub_flags])
+
+    def defaultInterval(self, options):
+        return options.interval
+
+    def processData(self, data, snapshot):
+        # newer releases wrap the list
+        if isinstance(data, dict):
+            data = data['pg_stats']
+
+        fsid = ('fsid', self.fsid)
+        want_pg = self.wants(ceph_pg, 'pg')
+        states = {}
+
+        for pg in data:
+            labels = (fsid,
+                      ('pool', pgid_to_pool(pg['pgid'])),
+                      ('pgid', pg['pgid']))
+            if want_pg:
+                snapshot.set(ceph_pg, labels, 1)
+            self.processPgState(pg, labels, snapshot)
+            states[pg['pgid']] = self.significantState(pg['state'])
+
+        self.pg_states = dict([(pgid, pg_state) for pgid, pg_state in self.pg_states.items() if pg_state[2] is snapshot])
+
+        if states != self.brief_states and not self.changed and self.full is not None:
+            self.changed = True
+            self.changed_since = self.full.last_start
+        self.brief_states = states
+
+    def commitSnapshot(self, snapshot, stats = None):
+        CephPgDump.commitSnapshot(self, snapshot, stats)
+        if snapshot is None or not self.changed:
+            return
+        if self.full.last_start != self.changed_since:
+            # the full dump has run since the change anyway
+            self.changed = False
+        elif self.full.runEarly(self.early_fraction):
+            self.log.debug('PG states changed, running "ceph pg dump" early')
+            self.changed = False
@@ -20,9 +20,6 @@
 
 from twisted.logger import Logger
 
-from ...prometheus import Sample
-from ...prometheus import Label
-
 from .. import Ceph
 from ..metrics.ceph_epoch import ceph_epoch
 from ..metrics.ceph_mon_count import ceph_mon_count
@@ -30,27 +27,32 @@ from ..metrics.ceph_mon_quorum import ceph_mon_quorum
 
 class CephQuorumStatus(Ceph):
     log = Logger()
-    # quorum_status returns same info as mds dump plus election epoch
+    # the monitor map, which mon dump would return as well, plus the
+    # quorum and the election epoch
     subcommand = ['quorum_status']
+    epoch_cache = True
+
+    def mapEpoch(self, data):
+        # the quorum only changes with an election
+        return (data['monmap']['epoch'], data['election_epoch'])
 
-    def processData(self, result):
-        data, timestamp = result
+    def processData(self, data, snapshot):
+        fsid = ('fsid', self.fsid)
 
-        Sample('ceph_mon_count',
-               [Label('fsid', self.fsid)],
-               len(data['monmap']['mons']),
-               timestamp)
-        Sample('ceph_mon_quorum',
-               [Label('fsid', self.fsid)],
-               len(data['quorum']),
-               timestamp)
-        Sample('ceph_epoch',
-               [Label('fsid', self.fsid),
-                Label('type', 'mon')],
-               data['monmap']['epoch'],
-               timestamp)
-        Sample('ceph_epoch',
-               [Label('fsid', self.fsid),
-                Label('type', 'mon_election')],
-               data['election_epoch'],
-               timestamp)
+        if self.wants(ceph_mon_count, 'cluster'):
+            snapshot.set(ceph_mon_count,
+                         (fsid,),
+                         len(data['monmap']['mons']))
+        if self.wants(ceph_mon_quorum, 'cluster'):
+            snapshot.set(ceph_mon_quorum,
+                         (fsid,),
+                         len(data['quorum']))
+        if self.wants(ceph_epoch, 'cluster'):
+            snapshot.set(ceph_epoch,
+                         (fsid,
+                          ('type', 'mon')),
+                         data['monmap']['epoch'])
+            snapshot.set(ceph_epoch,
+                         (fsid,
+                          ('type', 'mon_election')),
+                         data['election_epoch'])
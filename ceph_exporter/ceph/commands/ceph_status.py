@@ -20,9 +20,6 @@
 
 from twisted.logger import Logger
 
-from ...prometheus import Sample
-from ...prometheus import Label
-
 from .. import Ceph
 
 from ..metrics.ceph_pg_states import ceph_pg_states
@@ -32,27 +29,26 @@ class CephStatus(Ceph):
     log = Logger()
     subcommand = ['status']
 
-    def processData(self, result):
-        data, timestamp = result
-
-        states = self.states.copy()
-        for pgs_by_state in data['pgmap']['pgs_by_state']:
-            if pgs_by_state['state_name'] not in states:
-                self.log.debug('Unknown state "{state:}"', state = pgs_by_state['state_name'])
-            states.discard(pgs_by_state['state_name'])
-            Sample('ceph_pg_states',
-                   [Label('fsid', self.fsid),
-                    Label('state', pgs_by_state['state_name'])],
-                   pgs_by_state['count'],
-                   timestamp)
-        for state in states:
-            Sample('ceph_pg_states',
-                   [Label('fsid', self.fsid),
-                    Label('state', state)],
-                   0,
-                   timestamp)
-
-        Sample('ceph_pgmap_version',
-               [Label('fsid', self.fsid)],
-               data['pgmap']['version'],
-               timestamp)
+    def processData(self, data, snapshot):
+        fsid = ('fsid', self.fsid)
+
+        if self.wants(ceph_pg_states, 'cluster'):
+            states = self.states.copy()
+            for pgs_by_state in data['pgmap']['pgs_by_state']:
+                if pgs_by_state['state_name'] not in states:
+                    self.log.debug('Unknown state "{state:}"', state = pgs_by_state['state_name'])
+                states.discard(pgs_by_state['state_name'])
+                snapshot.set(ceph_pg_states,
+                             (fsid,
+                              ('state', pgs_by_state['state_name'])),
+                             pgs_by_state['count'])
+            for state in states:
+                snapshot.set(ceph_pg_states,
+                             (fsid,
+                              ('state', state)),
+                             0)
+
+        if self.wants(ceph_pgmap_version, 'cluster'):
+            snapshot.set(ceph_pgmap_version,
+                         (fsid,),
+                         data['pgmap']['version'])
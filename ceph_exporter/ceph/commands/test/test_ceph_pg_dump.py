@@ -18,6 +18,7 @@
 # along with ceph_exporter.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import argparse
 import arrow
 import inspect
 import json
@@ -27,37 +28,314 @@ import uuid
 from twisted.trial.unittest import TestCase
 
 from ....prometheus import metrics
-from ....prometheus import Label
+from ....prometheus import Snapshot
 from ..ceph_pg_dump import pgid_to_pool
 from ..ceph_pg_dump import CephPgDump
+from ..ceph_pg_dump import CephPgDumpBrief
 
 class PgidToPoolTest(TestCase):
     def test_pgid_to_pool(self):
         result = pgid_to_pool('8.4c')
         self.assertEqual(result, '8')
 
-class CephPgDumpHammer1Test(TestCase):
+    def test_large_pool(self):
+        self.assertEqual(pgid_to_pool('123.1f0'), '123')
+
+    def test_invalid(self):
+        self.assertIsNone(pgid_to_pool('8'))
+        self.assertIsNone(pgid_to_pool('8.'))
+        self.assertIsNone(pgid_to_pool('.4c'))
+        self.assertIsNone(pgid_to_pool('8.4g'))
+
+def makeOptions(**overrides):
+    """Return the options of a pg dump poller as parsed from an otherwise
+    empty command line, with *overrides* set."""
+    options = argparse.Namespace(pg_state_mode = 'all',
+                                 pg_dump_mode = 'full',
+                                 pg_dump_early_after = 0.25,
+                                 interval = 30.0,
+                                 command_interval = [],
+                                 timeout = None,
+                                 stale_after = 3.0,
+                                 include = [],
+                                 exclude = [])
+    for name, value in overrides.items():
+        setattr(options, name, value)
+    return options
+
+class CephPgDumpTestCase(TestCase):
+    """Loads the output of a Hammer pg dump into self.data."""
+
     def setUp(self):
         self.fsid = '{}'.format(uuid.uuid4())
         self.timestamp = arrow.now()
         bytes_data = pkg_resources.resource_string(inspect.getmodule(self).__name__, 'data/ceph_pg_dump_hammer_1.json')
         string_data = bytes_data.decode('utf-8')
         self.data = json.loads(string_data)
-        self.ceph_pg_dump = CephPgDump(self.fsid, None)
-        self.ceph_pg_dump.processData((self.data, self.timestamp))
 
     def tearDown(self):
         for metric in metrics.values():
-            metric.samples = []
+            metric.clear()
         del self.fsid
         del self.timestamp
         del self.data
-        del self.ceph_pg_dump
+
+class CephPgDumpHammer1Test(CephPgDumpTestCase):
+    def setUp(self):
+        CephPgDumpTestCase.setUp(self)
+        self.ceph_pg_dump = CephPgDump(self.fsid, None)
+        snapshot = Snapshot(self.timestamp)
+        self.ceph_pg_dump.processData(self.data, snapshot)
+        snapshot.commit()
 
     def test_fsids(self):
         for metric in metrics.values():
-            for sample in metric.samples:
-                self.assertIn(Label('fsid', self.fsid), sample.labels)
+            if metric.name.startswith('ceph_exporter_'):
+                continue
+            for labels in metric.series():
+                self.assertIn(('fsid', self.fsid), labels)
 
     def test_ceph_objects_1(self):
         self.assertIn('ceph_objects', metrics)
+
+class CephPgDumpCurrentStateTest(CephPgDumpTestCase):
+    def setUp(self):
+        CephPgDumpTestCase.setUp(self)
+        self.ceph_pg_dump = CephPgDump(self.fsid, makeOptions(pg_state_mode = 'current'))
+
+    def poll(self, previous = None):
+        snapshot = Snapshot(self.timestamp)
+        self.ceph_pg_dump.processData(self.data, snapshot)
+        snapshot.commit(previous)
+        return snapshot
+
+    def test_one_state_per_pg(self):
+        self.poll()
+        series = metrics['ceph_pg_state'].series()
+        self.assertEqual(len(series), len(self.data['pg_stats']))
+        for labels in series:
+            self.assertEqual(metrics['ceph_pg_state'].get(labels), 1)
+
+    def test_state_transition(self):
+        snapshot = self.poll()
+        pg = self.data['pg_stats'][0]
+        pg['state'] = 'active+clean+scrubbing'
+        self.poll(snapshot)
+        labels = (('fsid', self.fsid),
+                  ('pool', pgid_to_pool(pg['pgid'])),
+                  ('pgid', pg['pgid']),
+                  ('state', 'active+clean+scrubbing'))
+        self.assertEqual(metrics['ceph_pg_state'].get(labels), 1)
+        self.assertEqual(len(metrics['ceph_pg_state'].series()), len(self.data['pg_stats']))
+
+    def test_only_changed_rendered(self):
+        ceph_pg_state = metrics['ceph_pg_state']
+        snapshot = self.poll()
+        interned = len(ceph_pg_state.keys)
+        pg = self.data['pg_stats'][0]
+        pg['state'] = 'active+clean+scrubbing'
+        snapshot = self.poll(snapshot)
+        # only the PG that changed state has a new series to render
+        self.assertEqual(len(ceph_pg_state.keys), interned + 1)
+        lines = snapshot.fragment(ceph_pg_state, 'text').decode('utf-8').splitlines()
+        self.assertEqual(len(lines), len(self.data['pg_stats']))
+        self.assertIn('ceph_pg_state{{fsid="{}",pool="{}",pgid="{}",state="active+clean+scrubbing"}} 1 {:d}'.format(
+            self.fsid, pgid_to_pool(pg['pgid']), pg['pgid'], snapshot.timestamp), lines)
+
+class CephPgDumpFilterTest(CephPgDumpTestCase):
+    def setUp(self):
+        CephPgDumpTestCase.setUp(self)
+        options = makeOptions(include = [('ceph_pg_state', 'pg')],
+                              exclude = [('*', 'pg'), ('ceph_osd_latency_seconds', '*')])
+        self.ceph_pg_dump = CephPgDump(self.fsid, options)
+        self.snapshot = Snapshot(self.timestamp)
+        self.ceph_pg_dump.processData(self.data, self.snapshot)
+        self.snapshot.commit()
+
+    def test_pg_scope_excluded(self):
+        for name in ['ceph_pg', 'ceph_pg_timestamp', 'ceph_read_ops', 'ceph_objects_recovered']:
+            for labels in metrics[name].series():
+                self.assertNotIn('pgid', dict(labels))
+
+    def test_not_staged(self):
+        slots, values = self.snapshot.series[metrics['ceph_objects']]
+        for slot in slots:
+            self.assertNotIn(('scope', 'pg'), metrics['ceph_objects'].keys[slot])
+        self.assertNotIn(metrics['ceph_pg_timestamp'], self.snapshot.series)
+
+    def test_include(self):
+        self.assertTrue(metrics['ceph_pg_state'].series())
+
+    def test_other_scopes_kept(self):
+        scopes = set([dict(labels)['scope'] for labels in metrics['ceph_objects'].series()])
+        self.assertEqual(scopes, set(['cluster', 'pool', 'osd']))
+        self.assertTrue(metrics['ceph_osd_snap_trim_queue_length'].series())
+
+    def test_family_excluded(self):
+        self.assertEqual(metrics['ceph_osd_latency_seconds'].series(), [])
+
+class CephPgDumpRollupTest(CephPgDumpTestCase):
+    def setUp(self):
+        CephPgDumpTestCase.setUp(self)
+        self.ceph_pg_dump = CephPgDump(self.fsid, None)
+
+    def poll(self):
+        snapshot = Snapshot(self.timestamp)
+        self.ceph_pg_dump.processData(self.data, snapshot)
+        snapshot.commit()
+
+    def osd(self, osd):
+        return (('fsid', self.fsid), ('scope', 'osd'), ('osd', '{:d}'.format(osd)))
+
+    def assertOsdObjects(self, pgs):
+        for osd in set([osd for pg in pgs for osd in pg['acting']]):
+            expected = sum([pg['stat_sum']['num_objects'] for pg in pgs if osd in pg['acting']])
+            self.assertEqual(metrics['ceph_objects'].get(self.osd(osd) + (('type', 'objects'),)), expected)
+
+    def test_osd_objects(self):
+        self.poll()
+        self.assertOsdObjects(self.data['pg_stats'])
+
+    def test_osd_primary_io(self):
+        self.poll()
+        for osd in set([pg['acting_primary'] for pg in self.data['pg_stats']]):
+            pgs = [pg for pg in self.data['pg_stats'] if pg['acting_primary'] == osd]
+            labels = (('fsid', self.fsid), ('osd', '{:d}'.format(osd)))
+            self.assertEqual(metrics['ceph_osd_pg_read_ops'].get(labels),
+                             sum([pg['stat_sum']['num_read'] for pg in pgs]))
+            self.assertEqual(metrics['ceph_osd_pg_write_bytes'].get(labels),
+                             sum([pg['stat_sum']['num_write_kb'] for pg in pgs]) * 1024)
+        self.assertNotIn('osd', set([dict(labels).get('scope') for labels in metrics['ceph_read_ops'].series()]))
+
+    def test_pg_moved(self):
+        self.poll()
+        pg = max(self.data['pg_stats'], key = lambda pg: pg['stat_sum']['num_read'])
+        before = pg['acting_primary']
+        after = [osd for osd in set([pg['acting_primary'] for pg in self.data['pg_stats']]) if osd not in pg['acting']][0]
+        labels = (('fsid', self.fsid), ('osd', '{:d}'.format(before)))
+        reads = metrics['ceph_osd_pg_read_ops'].get(labels)
+        pg['acting'] = [after] + [osd for osd in pg['acting'] if osd != before]
+        pg['acting_primary'] = after
+        self.poll()
+        # the sum of the old primary drops, which is why it is a gauge
+        self.assertEqual(metrics['ceph_osd_pg_read_ops'].get(labels), reads - pg['stat_sum']['num_read'])
+        self.assertEqual(metrics['ceph_osd_pg_read_ops'].type, 'gauge')
+        self.assertEqual(metrics['ceph_osd_pg_objects_recovered'].type, 'gauge')
+        self.assertAlmostEqual(sum([metrics['ceph_osd_pg_read_ops'].get(labels) for labels in metrics['ceph_osd_pg_read_ops'].series()]),
+                               sum([pg['stat_sum']['num_read'] for pg in self.data['pg_stats']]))
+
+    def test_pool(self):
+        self.poll()
+        for pool in self.data['pool_stats']:
+            labels = (('fsid', self.fsid), ('scope', 'pool'), ('pool', '{:d}'.format(pool['poolid'])))
+            pgs = [pg for pg in self.data['pg_stats'] if pgid_to_pool(pg['pgid']) == '{:d}'.format(pool['poolid'])]
+            self.assertEqual(metrics['ceph_read_ops'].get(labels),
+                             sum([pg['stat_sum']['num_read'] for pg in pgs]))
+            self.assertEqual(metrics['ceph_objects_recovered'].get(labels),
+                             sum([pg['stat_sum']['num_objects_recovered'] for pg in pgs]))
+
+    def test_streamed(self):
+        pgs = self.data['pg_stats']
+        snapshot = Snapshot(self.timestamp)
+        for pg in pgs:
+            self.ceph_pg_dump.processPg(pg, snapshot)
+        self.data['pg_stats'] = []
+        self.ceph_pg_dump.processData(self.data, snapshot)
+        snapshot.commit()
+        self.assertOsdObjects(pgs)
+
+    def test_missing_shard(self):
+        pg = self.data['pg_stats'][0]
+        pg['acting'] = pg['acting'] + [0x7fffffff]
+        self.poll()
+        self.assertIsNone(metrics['ceph_objects'].get(self.osd(0x7fffffff) + (('type', 'objects'),)))
+
+class FakeFull(object):
+    def __init__(self):
+        self.early = []
+        self.last_start = None
+        self.refuse = False
+
+    def runEarly(self, fraction):
+        self.early.append(fraction)
+        if self.refuse:
+            return False
+        self.last_start = len(self.early)
+        return True
+
+class CephPgDumpTieredTest(CephPgDumpTestCase):
+    def setUp(self):
+        CephPgDumpTestCase.setUp(self)
+        self.brief = [dict([(key, pg[key]) for key in ['pgid', 'state', 'up', 'acting', 'up_primary', 'acting_primary']])
+                      for pg in self.data['pg_stats']]
+        options = makeOptions(pg_state_mode = 'current', pg_dump_mode = 'tiered')
+        self.full = FakeFull()
+        self.ceph_pg_dump = CephPgDump(self.fsid, options)
+        self.ceph_pg_dump_brief = CephPgDumpBrief(self.fsid, options, full = self.full)
+
+    def poll(self, command, data):
+        snapshot = Snapshot(self.timestamp)
+        command.processData(data, snapshot)
+        command.commitSnapshot(snapshot)
+        return snapshot
+
+    def test_intervals(self):
+        self.assertEqual(self.ceph_pg_dump.interval, 300.0)
+        self.assertEqual(self.ceph_pg_dump_brief.interval, 30.0)
+
+    def test_full_without_states(self):
+        snapshot = self.poll(self.ceph_pg_dump, self.data)
+        self.assertNotIn(metrics['ceph_pg_state'], snapshot.series)
+        self.assertNotIn(metrics['ceph_pg'], snapshot.series)
+        self.assertIn(metrics['ceph_pg_timestamp'], snapshot.series)
+
+    def test_brief_states(self):
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(len(metrics['ceph_pg_state'].series()), len(self.brief))
+        self.assertEqual(len(metrics['ceph_pg'].series()), len(self.brief))
+        self.assertEqual(metrics['ceph_objects'].series(), [])
+
+    def test_wrapped(self):
+        self.poll(self.ceph_pg_dump_brief, {'pg_ready': True, 'pg_stats': self.brief})
+        self.assertEqual(len(metrics['ceph_pg'].series()), len(self.brief))
+
+    def test_continuous(self):
+        # the series of a PG carry the same labels from either tier
+        self.poll(self.ceph_pg_dump, self.data)
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        pgids = set([dict(labels)['pgid'] for labels in metrics['ceph_pg'].series()])
+        self.assertEqual(pgids, set([dict(labels)['pgid'] for labels in metrics['ceph_storage_bytes'].series()
+                                     if dict(labels).get('scope') == 'pg']))
+
+    def test_run_early_on_change(self):
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(self.full.early, [0.25])
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(self.full.early, [0.25])
+        self.brief[0]['state'] = 'active+clean+inconsistent'
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(self.full.early, [0.25, 0.25])
+        self.poll(self.ceph_pg_dump_brief, self.brief[1:])
+        self.assertEqual(len(self.full.early), 3)
+
+    def test_scrub_churn(self):
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        for i in range(10):
+            for j, pg in enumerate(self.brief[:20]):
+                pg['state'] = ['active+clean', 'active+clean+scrubbing', 'active+clean+scrubbing+deep'][(i + j) % 3]
+            self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(len(self.full.early), 1)
+        self.brief[0]['state'] = 'active+clean+scrubbing+deep+inconsistent'
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(len(self.full.early), 2)
+
+    def test_change_pending(self):
+        self.full.refuse = True
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(len(self.full.early), 2)
+        # the full dump ran on its own in the meantime
+        self.full.last_start = 600.0
+        self.poll(self.ceph_pg_dump_brief, self.brief)
+        self.assertEqual(len(self.full.early), 2)
+        self.assertFalse(self.ceph_pg_dump_brief.changed)
@@ -0,0 +1,58 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from fnmatch import fnmatchcase
+
+# the scope of a series is the value of its scope label, or for
+# families without one the kind of object that the series describes
+scopes = ['cluster', 'pool', 'osd', 'pg']
+
+class SeriesFilter(object):
+    """Decide which series the command handlers export.
+
+    Rules are (family, scope) pairs of shell style patterns.  A series
+    is exported unless its family and scope match an exclude rule,
+    and include rules make exceptions to the exclude rules, so e.g.
+    excluding "*:pg" and including "ceph_pg_state:pg" keeps only the
+    PG state series at PG scope.
+
+    The answer for each family and scope is remembered, so checking a
+    series costs a dictionary lookup."""
+
+    def __init__(self, include = (), exclude = ()):
+        self.include = list(include)
+        self.exclude = list(exclude)
+        self.cache = {}
+
+    def match(self, rules, name, scope):
+        for family, rule_scope in rules:
+            if fnmatchcase(name, family) and fnmatchcase(scope, rule_scope):
+                return True
+        return False
+
+    def wants(self, metric, scope):
+        key = (metric.name, scope)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        result = not self.match(self.exclude, metric.name, scope) or self.match(self.include, metric.name, scope)
+        self.cache[key] = result
+        return result
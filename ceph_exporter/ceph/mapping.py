@@ -0,0 +1,116 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+class Field(object):
+    """One value of the JSON output of a command, mapped to a series.
+
+    *path* is the sequence of keys that lead from the JSON object handed
+    to the extractor to the value, or None for a series that is always
+    1.  The value is passed through *convert*, if given, multiplied by
+    *scale* and divided by *divisor*.  *labels* are the labels that
+    follow the labels of the object, e.g. (('type', 'used'),).  Scoped
+    series get a scope label after the fsid.  An *optional* value may be
+    missing from the object, in which case no series is set."""
+
+    def __init__(self, path, metric, labels = (), scale = 1, divisor = 1, convert = None, optional = False, scoped = True):
+        self.path = path
+        self.metric = metric
+        self.labels = labels
+        self.scale = scale
+        self.divisor = divisor
+        self.convert = convert
+        self.optional = optional
+        self.scoped = scoped
+
+def compile_fields(fields, scope, wants, fsid, name = 'fields'):
+    """Compile the fields of one kind of JSON object into a function.
+
+    The function, extract(obj, labels, snapshot), sets the series of all
+    fields for which wants(metric, scope) is true from *obj*, with the
+    label sets made of the fsid, the scope if the field is scoped,
+    *labels*, which identify the object, e.g. (('osd', '3'),), and the
+    labels of the field.  The filter is applied here, once, and the
+    body of the function is generated as straight line code, so there
+    is no per field loop, lookup of the path or check of the filter
+    left when it runs."""
+    fields = [field for field in fields if wants(field.metric, scope)]
+
+    namespace = {'plain_prefix': (('fsid', fsid),),
+                 'scoped_prefix': (('fsid', fsid), ('scope', scope))}
+    body = []
+    prefixes = set()
+    parents = {(): 'obj'}
+
+    for index, field in enumerate(fields):
+        prefix = 'scoped' if field.scoped else 'plain'
+        prefixes.add(prefix)
+
+        metric = 'metric_{:d}'.format(index)
+        namespace[metric] = field.metric
+
+        labels = prefix
+        if field.labels:
+            labels = 'labels_{:d}'.format(index)
+            namespace[labels] = field.labels
+            labels = '{} + {}'.format(prefix, labels)
+
+        if field.path is None:
+            body.append('set({}, {}, 1)'.format(metric, labels))
+            continue
+
+        # look up each object on the way to a value only once
+        parent = 'obj'
+        for depth in range(1, len(field.path)):
+            path = tuple(field.path[:depth])
+            if path not in parents:
+                parents[path] = 'obj_{:d}'.format(len(parents))
+                body.append('{} = {}[{!r}]'.format(parents[path], parent, field.path[depth - 1]))
+            parent = parents[path]
+
+        key = field.path[-1]
+        value = '{}[{!r}]'.format(parent, key)
+        if field.convert is not None:
+            convert = 'convert_{:d}'.format(index)
+            namespace[convert] = field.convert
+            value = '{}({})'.format(convert, value)
+        if field.scale != 1:
+            value = '{} * {!r}'.format(value, field.scale)
+        if field.divisor != 1:
+            value = '{} / {!r}'.format(value, field.divisor)
+
+        line = 'set({}, {}, {})'.format(metric, labels, value)
+        if field.optional:
+            body.append('if {!r} in {}:'.format(key, parent))
+            line = '    ' + line
+        body.append(line)
+
+    head = ['def extract(obj, labels, snapshot):']
+    if body:
+        head.append('set = snapshot.set')
+        for prefix in sorted(prefixes):
+            head.append('{0:} = {0:}_prefix + labels'.format(prefix))
+    else:
+        head.append('pass')
+
+    source = '\n    '.join(head + body) + '\n'
+    exec(compile(source, '<{} {}>'.format(name, scope), 'exec'), namespace)
+    extract = namespace['extract']
+    extract.source = source
+    return extract
@@ -0,0 +1,32 @@
+# -*- mode: python, coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from ...prometheus import Metric
+
+__all__ = ['ceph_osd_pg_read_bytes']
+
+# ceph pg dump --format json
+# sum of ['pg_stats'][n]['stat_sum']['num_read_kb'] * 1024 over the PGs whose acting primary is the OSD => ceph_osd_pg_read_bytes{fsid="$fsid",osd="$osd"}
+#
+# the counters of a PG move with it, so the sum drops whenever PGs are
+# remapped or change primary and rate() would read every drop as a
+# counter reset
+
+ceph_osd_pg_read_bytes = Metric('ceph_osd_pg_read_bytes', 'Total bytes read of the PGs whose acting primary is the OSD, drops when PGs move so it is not a counter', 'gauge')
@@ -0,0 +1,275 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import argparse
+import arrow
+import datetime
+import uuid
+
+from twisted.internet.defer import Deferred
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from ... import ceph
+from ...prometheus import metrics
+from ...prometheus import Snapshot
+from ..backends import RunStats
+from ..commands.ceph_mds_dump import CephMdsDump
+from ..commands.ceph_quorum_status import CephQuorumStatus
+from ..timestamps import ceph_timestamp
+
+class PendingBackend(object):
+    def __init__(self):
+        self.runs = []
+        self.cancelled = 0
+
+    def cancel(self, d):
+        self.cancelled += 1
+
+    def run(self, subcommand, streamed = None, decode = True, stats = None, mon_command = None):
+        d = Deferred(self.cancel)
+        self.runs.append(d)
+        return d
+
+    def finish(self, election_epoch = 4, timestamp = None):
+        data = {'monmap': {'mons': [{}, {}, {}], 'epoch': 1},
+                'quorum': [0, 1, 2],
+                'election_epoch': election_epoch}
+        if timestamp is None:
+            timestamp = arrow.now()
+        self.runs[-1].callback((data, timestamp, datetime.timedelta(0)))
+
+class SchedulingTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(ceph, 'reactor', self.clock)
+        self.backend = PendingBackend()
+        self.fsid = '{}'.format(uuid.uuid4())
+        self.options = argparse.Namespace(interval = 10.0,
+                                          command_interval = [],
+                                          timeout = 0,
+                                          stale_after = 3.0,
+                                          start_jitter = 0.0,
+                                          include = [],
+                                          exclude = [])
+        self.command = CephQuorumStatus(self.fsid, self.options, self.backend)
+        self.labels = (('fsid', self.fsid), ('command', 'ceph quorum_status'))
+
+    def tearDown(self):
+        for metric in metrics.values():
+            metric.clear()
+
+    def test_single_flight(self):
+        self.command.getData()
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.backend.runs), 1)
+        self.assertEqual(metrics['ceph_command_skipped'].get(self.labels), 1)
+
+    def test_backoff(self):
+        self.command.getData()
+        self.clock.advance(6.0)
+        self.backend.finish()
+        self.assertEqual(self.command.delay, 20.0)
+        self.assertEqual(metrics['ceph_command_interval'].get(self.labels), 20.0)
+
+    def test_backoff_reschedules(self):
+        self.command.start()
+        self.clock.advance(0.0)
+        self.clock.advance(9.5)
+        self.backend.finish()
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.backend.runs), 1)
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.backend.runs), 2)
+        self.assertEqual(self.command.last_start, 20.0)
+        self.backend.finish()
+        self.assertEqual(self.command.delay, 10.0)
+        self.clock.advance(10.0)
+        self.assertEqual(len(self.backend.runs), 3)
+        self.assertEqual(self.command.last_start, 30.0)
+
+    def test_backoff_after_skip(self):
+        self.command.start()
+        self.clock.advance(0.0)
+        self.clock.advance(10.0)
+        self.clock.advance(10.0)
+        self.clock.advance(5.0)
+        self.assertEqual(metrics['ceph_command_skipped'].get(self.labels), 2)
+        self.backend.finish()
+        self.assertEqual(self.command.delay, 20.0)
+        self.clock.advance(4.5)
+        self.assertEqual(len(self.backend.runs), 1)
+        self.clock.advance(0.5)
+        self.assertEqual(len(self.backend.runs), 2)
+        self.assertEqual(self.command.last_start, 30.0)
+
+    def test_backoff_limit(self):
+        for i in range(10):
+            self.command.getData()
+            self.clock.advance(6.0)
+            self.backend.finish()
+        self.assertEqual(self.command.delay, 80.0)
+
+    def test_recover(self):
+        self.command.delay = 40.0
+        self.command.getData()
+        self.backend.finish()
+        self.assertEqual(self.command.delay, 20.0)
+
+    def test_timeout(self):
+        self.command.timeout = 5.0
+        self.command.getData()
+        self.clock.advance(5.0)
+        self.assertEqual(self.backend.cancelled, 1)
+        self.assertFalse(self.command.running)
+        self.assertEqual(metrics['ceph_command_timeouts'].get(self.labels), 1)
+
+    def test_phases(self):
+        self.command.getData()
+        self.backend.finish()
+        count, total = metrics['ceph_exporter_command_phase_seconds'].get(self.labels + (('phase', 'process_data'),))
+        self.assertEqual(count, 1)
+        self.assertIsNone(metrics['ceph_exporter_command_phase_seconds'].get(self.labels + (('phase', 'spawn'),)))
+        self.assertEqual(metrics['ceph_exporter_command_samples'].get(self.labels), self.command.snapshot.samples())
+
+    def test_run_stats(self):
+        stats = RunStats()
+        stats.spawn = 0.01
+        stats.decode = 0.5
+        stats.streamed = 0.25
+        stats.process = 0.125
+        stats.read_bytes = 100
+        snapshot = Snapshot()
+        self.command.recordStats(snapshot, stats)
+        self.command.recordStats(snapshot, stats)
+        phases = metrics['ceph_exporter_command_phase_seconds']
+        self.assertEqual(phases.get(self.labels + (('phase', 'decode'),)), (2, 0.5))
+        self.assertEqual(phases.get(self.labels + (('phase', 'process_data'),)), (2, 0.75))
+        self.assertIsNone(phases.get(self.labels + (('phase', 'wait'),)))
+        self.assertEqual(metrics['ceph_exporter_command_read_bytes'].get(self.labels), 200)
+
+    def test_subscribe(self):
+        seen = []
+        def extractor(command, data, snapshot):
+            seen.append((command, data['election_epoch']))
+            snapshot.set(metrics['ceph_epoch'], (('fsid', command.fsid), ('type', 'test')), 1)
+        self.command.subscribe(extractor)
+        self.command.getData()
+        self.backend.finish()
+        self.assertEqual(seen, [(self.command, 4)])
+        self.assertEqual(metrics['ceph_epoch'].get((('fsid', self.fsid), ('type', 'test'))), 1)
+        self.assertIn(metrics['ceph_epoch'], self.command.snapshot.series)
+
+    def test_run_early(self):
+        self.command.start()
+        self.clock.advance(0.0)
+        self.backend.finish()
+        self.assertFalse(self.command.runEarly(0.5))
+        self.clock.advance(5.0)
+        self.assertTrue(self.command.runEarly(0.5))
+        self.assertEqual(len(self.backend.runs), 2)
+        self.assertTrue(self.command.running)
+        self.assertFalse(self.command.runEarly(0.5))
+        # the run brought forward replaces the scheduled one
+        self.assertEqual([call.getTime() for call in self.clock.getDelayedCalls()], [15.0])
+
+    def test_run_early_backed_off(self):
+        self.command.start()
+        self.clock.advance(0.0)
+        self.clock.advance(6.0)
+        self.backend.finish()
+        self.assertEqual(self.command.delay, 20.0)
+        self.clock.advance(3.0)
+        # half the interval has passed but not half the delay
+        self.assertFalse(self.command.runEarly(0.5))
+        self.clock.advance(1.0)
+        self.assertTrue(self.command.runEarly(0.5))
+        self.assertEqual(len(self.backend.runs), 2)
+        self.assertEqual(self.command.last_start, 10.0)
+
+    def test_epoch_cache_withdrawn(self):
+        processed = []
+        process_data = self.command.processData
+        self.patch(self.command, 'processData', lambda data, snapshot: processed.append(data) or process_data(data, snapshot))
+
+        self.command.getData()
+        self.backend.finish(timestamp = arrow.get(1000))
+        self.command.snapshot.withdraw()
+        self.clock.advance(10.0)
+        self.backend.finish(timestamp = arrow.get(1010))
+        self.assertEqual(len(processed), 2)
+        self.assertEqual(metrics['ceph_mon_quorum'].get((('fsid', self.fsid),)), 3)
+
+    def test_epoch_cache(self):
+        processed = []
+        process_data = self.command.processData
+        self.patch(self.command, 'processData', lambda data, snapshot: processed.append(data) or process_data(data, snapshot))
+        quorum = metrics['ceph_mon_quorum']
+        cache = metrics['ceph_exporter_command_epoch_cache']
+
+        self.command.getData()
+        self.backend.finish(timestamp = arrow.get(1000))
+        self.clock.advance(10.0)
+        self.backend.finish(timestamp = arrow.get(1010))
+        self.assertEqual(len(processed), 1)
+        self.assertEqual(quorum.get((('fsid', self.fsid),)), 3)
+        self.assertEqual(quorum.timestamps[quorum.slot((('fsid', self.fsid),))], 1010000)
+        self.assertEqual(cache.get(self.labels + (('result', 'hit'),)), 1)
+        self.assertEqual(cache.get(self.labels + (('result', 'miss'),)), 1)
+
+        self.clock.advance(10.0)
+        self.backend.finish(election_epoch = 5)
+        self.assertEqual(len(processed), 2)
+        self.assertEqual(cache.get(self.labels + (('result', 'miss'),)), 2)
+
+    def test_no_epoch_cache_status(self):
+        self.assertEqual(metrics['ceph_exporter_command_epoch_cache'].series(), [])
+        self.command.commitStatus()
+        self.assertEqual(len(metrics['ceph_exporter_command_epoch_cache'].series()), 2)
+
+class EpochCacheTest(TestCase):
+    def setUp(self):
+        self.fsid = '{}'.format(uuid.uuid4())
+        self.command = CephMdsDump(self.fsid, None)
+        self.data = {'epoch': 7,
+                     'info': {'gid_1': {'gid': 1, 'rank': 0, 'name': 'a', 'state': 'up:active'},
+                              'gid_2': {'gid': 2, 'rank': 1, 'name': 'b', 'state': 'up:replay',
+                                        'laggy_since': '2016-10-26 15:36:32.500000'}}}
+
+    def tearDown(self):
+        for metric in metrics.values():
+            metric.clear()
+
+    def poll(self, timestamp):
+        snapshot = self.command.buildSnapshot((self.data, arrow.get(timestamp), datetime.timedelta(0)))
+        self.command.commitSnapshot(snapshot)
+        return snapshot
+
+    def test_laggy_since_refreshed(self):
+        first = self.poll(1000)
+        self.assertEqual(metrics['ceph_mds_laggy_since'].get((('fsid', self.fsid), ('gid', '1'), ('rank', '0'), ('name', 'a'))), 1000.0)
+        second = self.poll(1010)
+        laggy_since = metrics['ceph_mds_laggy_since']
+        active = (('fsid', self.fsid), ('gid', '1'), ('rank', '0'), ('name', 'a'))
+        replay = (('fsid', self.fsid), ('gid', '2'), ('rank', '1'), ('name', 'b'))
+        self.assertEqual(laggy_since.get(active), 1010.0)
+        self.assertEqual(laggy_since.get(replay), ceph_timestamp('2016-10-26 15:36:32.500000'))
+        self.assertEqual(first.samples(), second.samples())
+        self.assertEqual(self.command.epoch, 7)
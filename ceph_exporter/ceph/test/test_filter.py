@@ -0,0 +1,55 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+from ..filter import SeriesFilter
+from ..metrics.ceph_objects import ceph_objects
+from ..metrics.ceph_pg_state import ceph_pg_state
+
+class SeriesFilterTest(TestCase):
+    def test_default(self):
+        series_filter = SeriesFilter()
+        self.assertTrue(series_filter.wants(ceph_objects, 'pg'))
+
+    def test_exclude_scope(self):
+        series_filter = SeriesFilter(exclude = [('ceph_objects', 'pg')])
+        self.assertFalse(series_filter.wants(ceph_objects, 'pg'))
+        self.assertTrue(series_filter.wants(ceph_objects, 'pool'))
+
+    def test_exclude_family(self):
+        series_filter = SeriesFilter(exclude = [('ceph_pg_*', '*')])
+        self.assertFalse(series_filter.wants(ceph_pg_state, 'pg'))
+        self.assertTrue(series_filter.wants(ceph_objects, 'pg'))
+
+    def test_include_overrides_exclude(self):
+        series_filter = SeriesFilter(include = [('ceph_pg_state', 'pg')],
+                                     exclude = [('*', 'pg')])
+        self.assertTrue(series_filter.wants(ceph_pg_state, 'pg'))
+        self.assertFalse(series_filter.wants(ceph_objects, 'pg'))
+
+    def test_include_alone(self):
+        series_filter = SeriesFilter(include = [('ceph_pg_state', 'pg')])
+        self.assertTrue(series_filter.wants(ceph_objects, 'pg'))
+
+    def test_cached(self):
+        series_filter = SeriesFilter(exclude = [('ceph_objects', 'pg')])
+        series_filter.wants(ceph_objects, 'pg')
+        self.assertEqual(series_filter.cache, {('ceph_objects', 'pg'): False})
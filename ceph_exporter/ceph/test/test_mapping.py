@@ -0,0 +1,88 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+from ...prometheus import metrics
+from ...prometheus import Metric
+from ...prometheus import Snapshot
+from ..filter import SeriesFilter
+from ..mapping import compile_fields
+from ..mapping import Field
+
+class CompileFieldsTest(TestCase):
+    def setUp(self):
+        self.metric = Metric('test_mapping', None, 'gauge')
+        self.other = Metric('test_mapping_other', None, 'gauge')
+        self.fields = [Field(None, self.metric, scoped = False),
+                       Field(('stats', 'kb'), self.metric, (('type', 'bytes'),), scale = 1024),
+                       Field(('stats', 'ms'), self.metric, (('type', 'seconds'),), divisor = 1000.0),
+                       Field(('up',), self.other, convert = lambda value: 1 - value, scoped = False),
+                       Field(('stamp',), self.other, (('event', 'stamp'),), optional = True)]
+        self.wants = SeriesFilter().wants
+
+    def tearDown(self):
+        del metrics['test_mapping']
+        del metrics['test_mapping_other']
+
+    def extract(self, extract, obj):
+        snapshot = Snapshot()
+        extract(obj, (('osd', '3'),), snapshot)
+        values = {}
+        for metric, (slots, samples) in snapshot.series.items():
+            for slot, value in zip(slots, samples):
+                values[metric.keys[slot]] = value
+        return values
+
+    def test_extract(self):
+        extract = compile_fields(self.fields, 'osd', self.wants, 'f')
+        values = self.extract(extract, {'stats': {'kb': 2, 'ms': 7}, 'up': 1, 'stamp': 5})
+        self.assertEqual(values,
+                         {(('fsid', 'f'), ('osd', '3')): 0,
+                          (('fsid', 'f'), ('scope', 'osd'), ('osd', '3'), ('type', 'bytes')): 2048,
+                          (('fsid', 'f'), ('scope', 'osd'), ('osd', '3'), ('type', 'seconds')): 7 / 1000.0,
+                          (('fsid', 'f'), ('scope', 'osd'), ('osd', '3'), ('event', 'stamp')): 5})
+
+    def test_constant(self):
+        extract = compile_fields(self.fields[:1], 'osd', self.wants, 'f')
+        self.assertEqual(self.extract(extract, {}), {(('fsid', 'f'), ('osd', '3')): 1})
+
+    def test_optional(self):
+        extract = compile_fields(self.fields[4:], 'osd', self.wants, 'f')
+        self.assertEqual(self.extract(extract, {}), {})
+
+    def test_missing(self):
+        extract = compile_fields(self.fields[1:2], 'osd', self.wants, 'f')
+        self.assertRaises(KeyError, extract, {'stats': {}}, (), Snapshot())
+
+    def test_shared_parent(self):
+        extract = compile_fields(self.fields[1:3], 'osd', self.wants, 'f')
+        self.assertEqual(extract.source.count("obj['stats']"), 1)
+
+    def test_filtered(self):
+        wants = SeriesFilter(exclude = [('test_mapping_other', 'osd')]).wants
+        extract = compile_fields(self.fields, 'osd', wants, 'f')
+        self.assertNotIn('convert', extract.source)
+        values = self.extract(extract, {'stats': {'kb': 2, 'ms': 7}, 'up': 1})
+        self.assertEqual(len(values), 3)
+
+    def test_nothing_wanted(self):
+        extract = compile_fields(self.fields, 'osd', SeriesFilter(exclude = [('test_*', '*')]).wants, 'f')
+        self.assertEqual(self.extract(extract, {}), {})
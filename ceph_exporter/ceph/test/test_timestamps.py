@@ -0,0 +1,57 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+import arrow
+from dateutil.tz import tzlocal
+
+from .. import timestamps
+from ..timestamps import ceph_timestamp
+
+class CephTimestampTest(TestCase):
+    def setUp(self):
+        self.patch(timestamps, 'cache', {})
+
+    def expected(self, value):
+        return arrow.get(value).replace(tzinfo = tzlocal()).float_timestamp
+
+    def test_same_as_arrow(self):
+        for value in ['2016-10-26 20:53:13.095067',
+                      '2016-09-30 00:02:01.286622',
+                      '2016-03-13 03:00:00.000000',
+                      '2016-11-06 01:30:00.500000',
+                      '2016-12-31 23:59:59.999999']:
+            self.assertEqual(ceph_timestamp(value), self.expected(value))
+
+    def test_other_format(self):
+        value = '2016-10-26T20:53:13'
+        self.assertEqual(ceph_timestamp(value), self.expected(value))
+
+    def test_cached(self):
+        ceph_timestamp('2016-10-26 20:53:13.095067')
+        self.assertIn('2016-10-26 20:53:13.095067', timestamps.cache)
+
+    def test_cache_bounded(self):
+        self.patch(timestamps, 'cache_size', 2)
+        ceph_timestamp('2016-10-26 20:53:13.000001')
+        ceph_timestamp('2016-10-26 20:53:13.000002')
+        ceph_timestamp('2016-10-26 20:53:13.000003')
+        self.assertEqual(list(timestamps.cache.keys()), ['2016-10-26 20:53:13.000003'])
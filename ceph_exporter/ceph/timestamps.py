@@ -0,0 +1,67 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import arrow
+import functools
+import time
+from dateutil.tz import tzlocal
+
+local = tzlocal()
+
+# timestamp string -> seconds since the epoch; every PG of a pg dump
+# carries a dozen timestamps, most of which are the same as another
+# timestamp of the same or another PG
+cache = {}
+cache_size = 65536
+
+@functools.lru_cache(maxsize = 1024)
+def local_hour(year, month, day, hour):
+    """Return the seconds since the epoch at the start of an hour of
+    local time."""
+    return int(time.mktime((year, month, day, hour, 0, 0, 0, 0, -1)))
+
+def parse(value):
+    # Ceph prints times as local time without an offset, e.g.
+    # "2016-10-26 20:53:13.095067"
+    if len(value) == 26 and value[4] == '-' and value[7] == '-' and value[10] == ' ' and value[19] == '.':
+        try:
+            seconds = (local_hour(int(value[0:4]), int(value[5:7]), int(value[8:10]), int(value[11:13])) +
+                       int(value[14:16]) * 60 +
+                       int(value[17:19]))
+            return (seconds * 1000000 + int(value[20:26])) / 10 ** 6
+        except ValueError:
+            pass
+    return arrow.get(value).replace(tzinfo = local).float_timestamp
+
+def ceph_timestamp(value):
+    """Convert a timestamp from the output of a Ceph command to seconds
+    since the epoch.
+
+    The common format is parsed by hand instead of with arrow, and the
+    results are cached."""
+    try:
+        return cache[value]
+    except KeyError:
+        pass
+    result = parse(value)
+    if len(cache) >= cache_size:
+        cache.clear()
+    cache[value] = result
+    return result
@@ -0,0 +1,282 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import codecs
+import json
+import re
+
+whitespace_re = re.compile(r'[ \t\n\r]*')
+
+# everything that can appear in a JSON value outside of its brackets:
+# numbers, literals, separators and complete strings
+plain_re = re.compile(r'(?:[ \t\n\r0-9+\-.eEtrufalsn,:]+|"[^"\\]*(?:\\.[^"\\]*)*")*')
+
+# the rest of a string up to its closing quote or the next escape
+string_re = re.compile(r'[^"\\]*')
+
+delimiters = frozenset(',:]} \t\n\r')
+
+scalar_re = re.compile(r'[^,:\]} \t\n\r]*')
+
+closers_of = {'[': ']', '{': '}'}
+
+value_starts = frozenset('{["-0123456789tfn')
+
+decoder = json.JSONDecoder()
+
+def trailingComma(buffer, end):
+    """Return whether the last character before *end* in *buffer* that
+    is not whitespace is a comma."""
+    end -= 1
+    while end >= 0 and buffer[end] in ' \t\n\r':
+        end -= 1
+    return end >= 0 and buffer[end] == ','
+
+class JsonObjectStream(object):
+    """Incrementally parse a JSON document whose top level is an object.
+
+    *streamed* maps member names to callables.  Each element of the
+    array held by such a member is decoded and passed to the callable
+    as soon as it has been received in full, and is not kept.  All
+    other members are collected and returned by finish(), where the
+    streamed members are present as empty lists.
+
+    Feed the raw output with feed() as it arrives and call finish()
+    once there is no more."""
+
+    def __init__(self, streamed):
+        self.streamed = streamed
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'start'
+        self.key = None
+        self.result = {}
+        # while a value that did not arrive in one piece is received: how
+        # far it has been scanned, the closing brackets it still needs,
+        # whether the scan is inside a string and the text of the value
+        # that has already been moved out of the buffer
+        self.scan = None
+        self.closers = []
+        self.in_string = False
+        self.parts = []
+
+    def feed(self, data, final = False):
+        text = self.decoder.decode(data, final)
+        if self.scan is None:
+            self.buffer = self.buffer[self.pos:] + text
+        else:
+            # set aside what has been scanned of the value rather than
+            # copying all of it again with every chunk
+            self.parts.append(self.buffer[self.pos:self.scan])
+            self.buffer = self.buffer[self.scan:] + text
+            self.scan = 0
+        self.pos = 0
+        while self.step():
+            pass
+
+    def finish(self):
+        self.feed(b'', True)
+        if self.state != 'done' or self.skip() < len(self.buffer):
+            raise ValueError('truncated or invalid JSON at state {}'.format(self.state))
+        return self.result
+
+    def skip(self):
+        self.pos = whitespace_re.match(self.buffer, self.pos).end()
+        return self.pos
+
+    def decode(self):
+        """Decode the value that starts at the current position, if all of
+        it has been received.
+
+        A value is only taken to be complete once it is followed by a
+        delimiter, otherwise a number split across two chunks would be
+        decoded short.  A value that is not complete in the buffer is
+        scanned as it arrives, see scanValue(), and only decoded once it
+        has been closed, so that it is neither decoded nor copied again
+        with every chunk."""
+        if self.scan is None:
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                pass
+            else:
+                if end < len(self.buffer) and self.buffer[end] in delimiters:
+                    self.pos = end
+                    return True, value
+
+            if self.buffer[self.pos] not in value_starts:
+                raise ValueError('invalid JSON value at state {}: {!r}'.format(self.state, self.buffer[self.pos:self.pos + 20]))
+            if self.buffer[self.pos] not in '["{':
+                # a number or a literal is only incomplete as long as
+                # nothing has been received after it
+                if scalar_re.match(self.buffer, self.pos).end() < len(self.buffer):
+                    raise ValueError('invalid JSON value at state {}: {!r}'.format(self.state, self.buffer[self.pos:self.pos + 20]))
+                return False, None
+            if self.buffer[self.pos] == '"':
+                self.closers = []
+                self.in_string = True
+            else:
+                self.closers = [closers_of[self.buffer[self.pos]]]
+                self.in_string = False
+            self.scan = self.pos + 1
+
+        end = self.scanValue()
+        if end is None:
+            return False, None
+
+        text = self.buffer[self.pos:end]
+        if self.parts:
+            text = ''.join(self.parts) + text
+            self.parts = []
+        self.scan = None
+        self.pos = end
+        return True, decoder.decode(text)
+
+    def scanValue(self):
+        """Scan the value that starts at the current position from where
+        the last scan stopped, and return the position right after it, or
+        None if it has not been received in full yet.
+
+        Nesting and strings are tracked so that the end of the value is
+        found without decoding it, and brackets that don't match, commas
+        that are followed by a closing bracket or characters that can't
+        appear in JSON are rejected right away."""
+        buffer = self.buffer
+        closers = self.closers
+        i = self.scan
+
+        while i < len(buffer):
+            if self.in_string:
+                i = string_re.match(buffer, i).end()
+                if i >= len(buffer):
+                    break
+                if buffer[i] == '\\':
+                    if i + 1 >= len(buffer):
+                        break
+                    i += 2
+                    continue
+                i += 1
+                self.in_string = False
+                if not closers:
+                    return i
+                continue
+
+            i = plain_re.match(buffer, i).end()
+            if i >= len(buffer):
+                break
+            char = buffer[i]
+            if char == '"':
+                self.in_string = True
+            elif char in closers_of:
+                closers.append(closers_of[char])
+            elif char == closers[-1]:
+                if trailingComma(buffer, i):
+                    raise ValueError('unexpected {!r} after a comma in JSON value at state {}'.format(char, self.state))
+                closers.pop()
+                if not closers:
+                    return i + 1
+            else:
+                raise ValueError('unexpected {!r} in JSON value at state {}'.format(char, self.state))
+            i += 1
+
+        self.scan = i
+        return None
+
+    def expect(self, char):
+        if self.buffer[self.pos] != char:
+            raise ValueError('expected {!r} at state {} but found {!r}'.format(char, self.state, self.buffer[self.pos]))
+        self.pos += 1
+
+    def step(self):
+        if self.state == 'done':
+            return False
+
+        if self.scan is None:
+            if self.skip() >= len(self.buffer):
+                return False
+            char = self.buffer[self.pos]
+        else:
+            # the buffer starts in the middle of a value, so there is
+            # nothing to skip and no delimiter to look at
+            char = None
+
+        if self.state == 'start':
+            self.expect('{')
+            self.state = 'first_key'
+
+        elif self.state in ('first_key', 'key'):
+            if char == '}':
+                if self.state == 'key':
+                    raise ValueError('unexpected {!r} after a comma at state {}'.format(char, self.state))
+                self.pos += 1
+                self.state = 'done'
+                return False
+            complete, self.key = self.decode()
+            if not complete:
+                return False
+            self.state = 'colon'
+
+        elif self.state == 'colon':
+            self.expect(':')
+            self.state = 'value'
+
+        elif self.state == 'value':
+            if char == '[' and self.key in self.streamed:
+                self.pos += 1
+                self.result[self.key] = []
+                self.state = 'first_element'
+            else:
+                complete, value = self.decode()
+                if not complete:
+                    return False
+                self.result[self.key] = value
+                self.state = 'member'
+
+        elif self.state == 'member':
+            if char == '}':
+                self.pos += 1
+                self.state = 'done'
+                return False
+            self.expect(',')
+            self.state = 'key'
+
+        elif self.state in ('first_element', 'element'):
+            if char == ']':
+                if self.state == 'element':
+                    raise ValueError('unexpected {!r} after a comma at state {}'.format(char, self.state))
+                self.pos += 1
+                self.state = 'member'
+                return True
+            complete, value = self.decode()
+            if not complete:
+                return False
+            self.streamed[self.key](value)
+            self.state = 'separator'
+
+        elif self.state == 'separator':
+            if char == ']':
+                self.pos += 1
+                self.state = 'member'
+            else:
+                self.expect(',')
+                self.state = 'element'
+
+        return True
@@ -23,38 +23,167 @@ import configparser
 import argparse
 
 from twisted.internet import reactor
+from twisted.internet.defer import DeferredSemaphore
 from twisted.logger import globalLogBeginner
 from twisted.logger import textFileLogObserver
 from twisted.logger import Logger
 
+from .monitor import LoopMonitor
 from .prometheus import MetricManager
 from .server import Server
+from .worker import WorkerPool
+from .ceph.backends import LimitedBackend
+from .ceph.backends.fixture import FixtureBackend
+from .ceph.backends.librados import RadosBackend
+from .ceph.backends.process import ProcessBackend
+from .ceph.filter import scopes
 from .ceph.commands.ceph_df import CephDf
 from .ceph.commands.ceph_mds_dump import CephMdsDump
 from .ceph.commands.ceph_osd_dump import CephOsdDump
 from .ceph.commands.ceph_pg_dump import CephPgDump
+from .ceph.commands.ceph_pg_dump import CephPgDumpBrief
 from .ceph.commands.ceph_quorum_status import CephQuorumStatus
 from .ceph.commands.ceph_status import CephStatus
 
-class Main(object):
+backends = {'process': ProcessBackend,
+            'rados': RadosBackend,
+            'fixture': FixtureBackend}
+
+def command_interval(value):
+    command, separator, seconds = value.rpartition('=')
+    if not separator or not command.strip():
+        raise argparse.ArgumentTypeError('expected COMMAND=SECONDS, e.g. "pg dump=120"')
+    try:
+        seconds = float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError('"{}" is not a number of seconds'.format(seconds))
+    if seconds <= 0:
+        raise argparse.ArgumentTypeError('the interval must be positive')
+    return ' '.join(command.split()), seconds
+
+def series_rule(value):
+    family, separator, scope = value.partition(':')
+    family = family.strip()
+    scope = scope.strip() if separator else '*'
+    if not family or not scope:
+        raise argparse.ArgumentTypeError('expected FAMILY[:SCOPE], e.g. "ceph_pg_timestamp:pg"')
+    if not any(c in scope for c in '*?[') and scope not in scopes:
+        raise argparse.ArgumentTypeError('unknown scope "{}", expected one of {}'.format(scope, ', '.join(scopes)))
+    return family, scope
+
+def read_fsid(path):
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise ValueError('can not read the Ceph config file {}'.format(path))
+    return config['global']['fsid']
+
+def cluster_options(options):
+    """Return the name and options of every cluster to poll.
+
+    Without `--clusters` that is the one cluster given by the command
+    line.  Otherwise every section of the clusters file is a cluster,
+    and its `config`, `keyring`, `name` and `fixtures` settings replace
+    the ones given on the command line."""
+    if options.clusters is None:
+        return [('ceph', options)]
+
+    config = configparser.ConfigParser()
+    if not config.read(options.clusters):
+        raise ValueError('can not read the clusters file {}'.format(options.clusters))
+
+    clusters = []
+    for section in config.sections():
+        cluster = argparse.Namespace(**vars(options))
+        for key in ['config', 'keyring', 'name', 'fixtures']:
+            if key in config[section]:
+                setattr(cluster, key, config[section][key])
+        clusters.append((section, cluster))
+
+    if not clusters:
+        raise ValueError('the clusters file {} lists no clusters'.format(options.clusters))
+
+    return clusters
+
+class Cluster(object):
+    """The backend and the command pollers of one Ceph cluster.
+
+    Every command is polled once per interval by a single poller,
+    whatever number of metric families are read from its output; more
+    can be added with subscribe()."""
+
     log = Logger()
 
-    def __init__(self, options):
+    commands = [CephDf,
+                CephMdsDump,
+                CephOsdDump,
+                CephPgDump,
+                CephQuorumStatus,
+                CephStatus]
+
+    def __init__(self, name, options, workers = None, semaphore = None):
+        self.name = name
         self.options = options
+        self.workers = workers
+        self.semaphore = semaphore
+        self.fsid = read_fsid(self.options.config)
+
+        self.backend = backends[self.options.backend](self.options)
+        if self.semaphore is not None:
+            self.backend = LimitedBackend(self.backend, self.semaphore)
+
+        self.pollers = {}
+        for command in self.commands:
+            poller = command(self.fsid, self.options, self.backend, self.workers)
+            self.pollers[' '.join(poller.subcommand)] = poller
+
+        if self.options.pg_dump_mode == 'tiered':
+            poller = CephPgDumpBrief(self.fsid, self.options, self.backend, self.workers, self.pollers['pg dump'])
+            self.pollers[' '.join(poller.subcommand)] = poller
 
-        config = configparser.ConfigParser()
-        config.read(self.options.config)
+        # the timeout of a command defaults to its interval, so the
+        # backend only learns the longest one once the pollers exist
+        self.backend.setTimeout(max([poller.timeout for poller in self.pollers.values()]))
 
-        self.fsid = config['global']['fsid']
+    def subscribe(self, command, extractor):
+        """Hand the output of every run of *command*, e.g. "osd dump", to
+        *extractor* as well, see Ceph.subscribe()."""
+        try:
+            poller = self.pollers[command]
+        except KeyError:
+            raise ValueError('"{}" is not polled, expected one of {}'.format(command, ', '.join(sorted(self.pollers))))
+        poller.subscribe(extractor)
 
+    def start(self, offset = 0.0):
+        self.log.info('polling cluster {name:} ({fsid:})', name = self.name, fsid = self.fsid)
+        for poller in self.pollers.values():
+            poller.start(offset)
+
+class Main(object):
+    log = Logger()
+
+    def __init__(self, options):
+        self.options = options
+
+        self.clusters = []
         self.server = None
-        self.ceph_df = None
-        self.ceph_mds_dump = None
-        self.ceph_osd_dump = None
-        self.ceph_pg_dump = None
-        self.ceph_quorum_status = None
-        self.ceph_status = None
+        self.workers = None
+        self.semaphore = None
         self.metric_manager = None
+        self.loop_monitor = None
+
+        if self.options.workers > 0:
+            self.workers = WorkerPool(self.options.workers)
+
+        if self.options.max_running > 0:
+            self.semaphore = DeferredSemaphore(self.options.max_running)
+
+        fsids = {}
+        for name, options in cluster_options(self.options):
+            cluster = Cluster(name, options, self.workers, self.semaphore)
+            if cluster.fsid in fsids:
+                raise ValueError('clusters {} and {} have the same fsid {}'.format(fsids[cluster.fsid], name, cluster.fsid))
+            fsids[cluster.fsid] = name
+            self.clusters.append(cluster)
 
         reactor.callWhenRunning(self.start)
 
@@ -62,27 +191,20 @@ class Main(object):
         self.server = Server(self.options)
         self.server.start()
 
-        self.ceph_df = CephDf(self.fsid, self.options)
-        self.ceph_df.start()
-
-        self.ceph_mds_dump = CephMdsDump(self.fsid, self.options)
-        self.ceph_mds_dump.start()
-
-        self.ceph_osd_dump = CephOsdDump(self.fsid, self.options)
-        self.ceph_osd_dump.start()
-
-        self.ceph_pg_dump = CephPgDump(self.fsid, self.options)
-        self.ceph_pg_dump.start()
-
-        self.ceph_quorum_status = CephQuorumStatus(self.fsid, self.options)
-        self.ceph_quorum_status.start()
+        if self.workers is not None:
+            self.workers.start()
 
-        self.ceph_status = CephStatus(self.fsid, self.options)
-        self.ceph_status.start()
+        # spread the clusters over the interval so that their commands
+        # don't all run at the same time
+        for index, cluster in enumerate(self.clusters):
+            cluster.start(self.options.interval * index / len(self.clusters))
 
         self.metric_manager = MetricManager()
         self.metric_manager.start()
 
+        self.loop_monitor = LoopMonitor(self.options.stall_threshold)
+        self.loop_monitor.start()
+
 def main():
     parser = argparse.ArgumentParser()
 
@@ -98,9 +220,85 @@ def main():
     parser.add_argument('--endpoint',
                         default='tcp:9192',
                         help="Twisted server endpoint specifier, default is `tcp:9192`")
+    parser.add_argument('--interval',
+                        default=30.0,
+                        type=float,
+                        help="Seconds between two runs of each Ceph command, default is `30`")
+    parser.add_argument('--command-interval',
+                        default=[],
+                        action='append',
+                        type=command_interval,
+                        metavar='COMMAND=SECONDS',
+                        help="Seconds between two runs of one Ceph command, overriding `--interval`, e.g. `--command-interval 'pg dump=120'`, may be given more than once")
+    parser.add_argument('--timeout',
+                        default=None,
+                        type=float,
+                        help="Seconds after which a Ceph command that has not finished is killed, `0` disables the timeout, default is the interval of the command")
+    parser.add_argument('--stale-after',
+                        default=3.0,
+                        type=float,
+                        help="Stop exporting the metrics of a Ceph command once it has not reported for this many of its intervals, default is `3`")
+    parser.add_argument('--start-jitter',
+                        default=5.0,
+                        type=float,
+                        help="Delay the first run of each Ceph command by a random time of up to this many seconds, default is `5`")
+    parser.add_argument('--workers',
+                        default=0,
+                        type=int,
+                        help="Number of threads used to decode command output, build metrics and render them off the reactor thread; the output is then read in full before it is decoded instead of being streamed, default is `0` which does that work on the reactor thread")
     parser.add_argument('--executable',
                         default='/usr/bin/ceph',
                         help="Path to the Ceph command line client executable, default is `/usr/bin/ceph`")
+    parser.add_argument('--backend',
+                        default='process',
+                        choices=sorted(backends.keys()),
+                        help="How to run Ceph commands: spawn the command line client for every poll (`process`), keep one librados session open (`rados`) or replay saved JSON output (`fixture`), default is `process`")
+    parser.add_argument('--fixtures',
+                        default='.',
+                        help="Directory holding the JSON output replayed by the `fixture` backend, e.g. `ceph_pg_dump.json`, default is the current directory")
+    parser.add_argument('--pg-state-mode',
+                        default='all',
+                        choices=['all', 'current'],
+                        help="Export a 0/1 `ceph_pg_state` series for every known state of each PG (`all`) or only the state each PG is currently in (`current`), default is `all`")
+    parser.add_argument('--pg-dump-mode',
+                        default='full',
+                        choices=['full', 'tiered'],
+                        help="Poll the states of the PGs with the full `pg dump` (`full`), or with the much smaller `pg dump pgs_brief` at the interval and the full `pg dump` only for the stats, ten times less often unless set with `--command-interval` and early when PG states change (`tiered`), default is `full`")
+    parser.add_argument('--pg-dump-early-after',
+                        default=0.25,
+                        type=float,
+                        metavar='FRACTION',
+                        help="In `tiered` mode bring the full `pg dump` forward when PGs are added or removed or change state other than starting or finishing a scrub, but only once this fraction of its current interval, which grows while it backs off, has passed since its last run, `1` disables running it early, default is `0.25`")
+    parser.add_argument('--exclude',
+                        default=[],
+                        action='append',
+                        type=series_rule,
+                        metavar='FAMILY[:SCOPE]',
+                        help="Do not export the series of the metric families matching the FAMILY pattern, optionally only at SCOPE (`cluster`, `pool`, `osd` or `pg`), e.g. `--exclude 'ceph_*:pg'`, may be given more than once")
+    parser.add_argument('--include',
+                        default=[],
+                        action='append',
+                        type=series_rule,
+                        metavar='FAMILY[:SCOPE]',
+                        help="Export the series matching FAMILY[:SCOPE] even if they match an `--exclude` rule, e.g. `--include ceph_pg_state:pg`, may be given more than once")
+
+    parser.add_argument('--stall-threshold',
+                        default=1.0,
+                        type=float,
+                        help="Log what the reactor was running when it was blocked for longer than this many seconds, `0` disables this, default is `1`")
+
+    parser.add_argument('--debug-token-file',
+                        default=None,
+                        help="File holding a secret token; when given `/debug/profile` and `/debug/memory` are served to requests that send it as `Authorization: Bearer TOKEN`, default is to not serve them")
+
+    parser.add_argument('--clusters',
+                        default=None,
+                        metavar='FILE',
+                        help="Poll every cluster listed in this INI file, one section per cluster with optional `config`, `keyring`, `name` and `fixtures` settings that replace the command line options, default is to poll the one cluster given by the command line")
+    parser.add_argument('--max-running',
+                        default=0,
+                        type=int,
+                        help="Run at most this many Ceph commands at the same time across all clusters, `0` means no limit, default is `0`")
 
     options = parser.parse_args()
 
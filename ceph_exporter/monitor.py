@@ -0,0 +1,119 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import sys
+import threading
+import time
+import traceback
+
+from twisted.internet import reactor
+from twisted.logger import Logger
+
+from .prometheus import Histogram
+from .prometheus import Metric
+
+ceph_exporter_reactor_lag_seconds = Histogram('ceph_exporter_reactor_lag_seconds')
+ceph_exporter_reactor_stalls = Metric('ceph_exporter_reactor_stalls', None, 'counter')
+
+class LoopMonitor(object):
+    """Measure how late the reactor runs a periodic tick and find out
+    what it was doing when it is late by a lot.
+
+    Every tick observes its delay in ceph_exporter_reactor_lag_seconds.
+    A watchdog thread checks that the ticks keep coming; once the
+    reactor has been blocked for longer than *threshold* seconds the
+    watchdog takes one sample of the stack of the reactor thread.  The
+    stack is logged from the reactor when it gets to the next tick, at
+    most once every stack_interval seconds, and every stall is counted
+    in ceph_exporter_reactor_stalls.  A threshold of 0 disables the
+    watchdog."""
+
+    log = Logger()
+
+    # seconds between two ticks
+    interval = 0.5
+
+    # seconds between two logged stacks, further stalls within that
+    # time are only counted
+    stack_interval = 60.0
+
+    def __init__(self, threshold = 1.0):
+        self.threshold = threshold
+        self.thread_id = None
+        self.call = None
+        self.last_tick = None
+        self.stalled = False
+        self.stack = None
+        self.stalls = 0
+        self.last_stack = None
+        self.stopping = threading.Event()
+        self.watchdog = None
+
+    def start(self):
+        # start() runs on the reactor thread
+        self.thread_id = threading.get_ident()
+        self.last_tick = time.monotonic()
+        self.schedule()
+        if self.threshold > 0:
+            self.watchdog = threading.Thread(target = self.watch, name = 'ceph_exporter_loop_monitor')
+            self.watchdog.daemon = True
+            self.watchdog.start()
+            reactor.addSystemEventTrigger('before', 'shutdown', self.stop)
+
+    def stop(self):
+        self.stopping.set()
+        if self.call is not None and self.call.active():
+            self.call.cancel()
+
+    def schedule(self):
+        self.call = reactor.callLater(self.interval, self.tick, reactor.seconds() + self.interval)
+
+    def tick(self, expected):
+        lag = max(0.0, reactor.seconds() - expected)
+        ceph_exporter_reactor_lag_seconds.observe((), lag)
+        self.last_tick = time.monotonic()
+
+        if self.stalled:
+            self.stalled = False
+            self.stalls += 1
+            ceph_exporter_reactor_stalls.set((), self.stalls, int(time.time() * 1000))
+            stack, self.stack = self.stack, None
+            if stack is not None and (self.last_stack is None or self.last_tick - self.last_stack >= self.stack_interval):
+                self.last_stack = self.last_tick
+                self.log.warn('the reactor was blocked for {lag:.3f}s, it was running:\n{stack:}',
+                              lag = lag + self.interval,
+                              stack = stack)
+
+        self.schedule()
+
+    def watch(self):
+        while not self.stopping.wait(self.threshold / 4):
+            self.check(time.monotonic())
+
+    def check(self, now):
+        """Sample the stack of the reactor thread if the reactor has not
+        ticked for longer than the threshold.  Runs on the watchdog
+        thread."""
+        if self.stalled or now - self.last_tick <= self.interval + self.threshold:
+            return
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is not None:
+            self.stack = ''.join(traceback.format_stack(frame))
+        self.stalled = True
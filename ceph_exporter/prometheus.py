@@ -18,17 +18,89 @@
 # along with ceph_exporter.  If not, see
 # <http://www.gnu.org/licenses/>.
 
-import arrow
+import bisect
 import datetime
+import gzip
+import itertools
+import math
+import operator
+import threading
+import time
+import weakref
+
+from array import array
 
 from twisted.internet import reactor
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from twisted.logger import Logger
 
+from . import protobuf
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 metrics = {}
 
+# snapshots whose series are currently exported
+committed = set()
+
+# snapshots that have not been committed yet, see Metric.reclaim()
+pending = weakref.WeakSet()
+pending_lock = threading.Lock()
+
+# numbers the snapshots in the order they were made and the slots in
+# the order they were last seen unused
+serials = itertools.count()
+
 def escape(value):
     return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
 
+def millis(timestamp):
+    return int(round(timestamp.float_timestamp * 1000))
+
+def fmt_labels(labels):
+    if not labels:
+        return ''
+    return '{{{:s}}}'.format(','.join(['{}="{}"'.format(name, escape(value)) for name, value in labels]))
+
+def fmt_value(value):
+    if math.isnan(value):
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    if value.is_integer() and abs(value) < 2 ** 53:
+        return '{:d}'.format(int(value))
+    return repr(value)
+
+def constant(values):
+    """Return the value that every one of *values* has, or None if they
+    differ or there are none."""
+    if values and values.count(values[0]) == len(values):
+        return values[0]
+    return None
+
+def pick(items, slots):
+    """Return the items of the list *items* at *slots*, looked up in C."""
+    if len(slots) == 1:
+        return (items[slots[0]],)
+    return operator.itemgetter(*slots)(items)
+
+def fmt_seconds(timestamp):
+    """Format a timestamp in milliseconds as seconds for OpenMetrics."""
+    seconds, milliseconds = divmod(timestamp, 1000)
+    if milliseconds:
+        return '{:d}.{:03d}'.format(seconds, milliseconds)
+    return '{:d}'.format(seconds)
+
+# the size of the varint of a timestamp in milliseconds from 1971 to 2109
+protobuf_timestamp_size = 6
+
+def escape_help(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
 class Label(object):
     def __init__(self, name, value):
         self.name = name
@@ -50,6 +122,11 @@ class Label(object):
         return NotImplemented
 
 class Sample(object):
+    """Write a single value straight into the named metric.
+
+    Kept for compatibility, the command handlers write through a
+    Snapshot instead so that no per-point objects are created."""
+
     log = Logger()
 
     def __init__(self, name, labels, value, timestamp):
@@ -62,19 +139,43 @@ class Sample(object):
             return
         metrics[name].addSample(self)
 
+    def key(self):
+        return tuple([(label.name, label.value) for label in self.labels])
+
     def fmt(self):
         result = ''
         if self.labels:
             result += '{{{:s}}}'.format(','.join(map(lambda l: l.fmt(), self.labels)))
         result += ' {}'.format(self.value)
         if self.timestamp is not None:
-            result += ' {:d}'.format(int(round(self.timestamp.float_timestamp * 1000)))
+            result += ' {:d}'.format(millis(self.timestamp))
         return result
 
-    def isExpired(self, now):
-        return (now - self.timestamp) < datetime.timedelta(seconds = 500)
+    def isExpired(self, now, ttl = datetime.timedelta(seconds = 500)):
+        return (now - self.timestamp) > ttl
 
 class Metric(object):
+    """A metric family and the series that belong to it.
+
+    Every distinct label set is interned the first time it is seen and
+    given a slot.  The rendered label text is kept for the slot, and
+    the current value and timestamp of each series live in typed
+    arrays indexed by slot, so writing a new value for a known series
+    does not allocate anything.  The values of committed snapshots are
+    only copied into those arrays once they are read, see refresh().
+
+    Each slot also counts the sources whose last committed snapshot
+    contains it; a series stops being exported once no source reports
+    it any more.
+
+    The series a snapshot commits are rendered by the snapshot, see
+    Snapshot.prepare(), and the family is made up of those fragments
+    in the order of their sources.  Only a family with series that
+    several sources report, or that were written with set(), is
+    rendered from the stored values.  Either way the family can be
+    rendered in any of the exposition formats named in
+    Exposition.formats, each of which is cached separately."""
+
     log = Logger()
 
     def __init__(self, name, help = None, type = None):
@@ -83,36 +184,834 @@ class Metric(object):
         self.name = name
         self.help = help
         self.type = type
-        self.samples = []
+
+        self.index = {}
+        self.keys = []
+        self.labels = []
+        self.encoded = []
+        self.values = array('d')
+        self.timestamps = array('q')
+        self.present = bytearray()
+        self.owners = array('l')
+        # the number of slots owned by more than one source
+        self.shared = 0
+        # whether any series was written with set() rather than committed
+        self.direct = False
+        # the snapshots whose fragments make up the family, in order,
+        # and whether the columns are missing some of their values
+        self.sources = {}
+        self.stale = False
+        # slot -> serial of when it was last seen unused, for the slots
+        # that are neither owned nor present
+        self.unused = {}
+        # slots that can be given to new series
+        self.free = []
+        self.rendered = {}
+        self.lock = threading.Lock()
 
         metrics[self.name] = self
 
-    def expireSamples(self, now):
-        self.samples = [sample for sample in self.samples if sample.isExpired(now)]
+    def slot(self, labels):
+        """Return the slot for the series identified by *labels*, a tuple
+        of (name, value) pairs, interning it if it is new.
+
+        Snapshots may be built on worker threads, so new series are
+        added under a lock, and the slot only becomes visible to
+        render() and other lookups once all of its columns exist.
+        Slots that reclaim() freed are used before new ones.  A slot
+        that is not in use is marked as seen now, so that it is not
+        reclaimed while the snapshot asking for it may still commit it."""
+        slot = self.index.get(labels)
+        if slot is not None and slot not in self.unused:
+            return slot
+        with self.lock:
+            slot = self.index.get(labels)
+            if slot is not None:
+                if slot in self.unused:
+                    self.unused[slot] = next(serials)
+                return slot
+            text = self.name + fmt_labels(labels)
+            if self.free:
+                slot = self.free.pop()
+                self.values[slot] = 0.0
+                self.timestamps[slot] = 0
+                self.keys[slot] = labels
+                self.labels[slot] = text
+                if slot < len(self.encoded):
+                    self.encoded[slot] = self.encodePrefix(labels)
+            else:
+                slot = len(self.labels)
+                self.values.append(0.0)
+                self.timestamps.append(0)
+                self.present.append(0)
+                self.owners.append(0)
+                self.keys.append(labels)
+                self.labels.append(text)
+            self.unused[slot] = next(serials)
+            self.index[labels] = slot
+        return slot
+
+    def reclaim(self, oldest):
+        """Free the slots that have not been used since before the snapshot
+        numbered *oldest*, the oldest one that has not been committed
+        yet, or None if there is none.
+
+        A snapshot may stage a slot long before it is committed, and it
+        may copy the slots of an earlier snapshot of its source as long
+        as that is still committed, so a slot that became unused is
+        only freed once every snapshot that may still refer to it has
+        been committed or dropped.  The label set of a freed slot is
+        forgotten and the slot is handed to the next new series, so the
+        columns of a family only grow with the number of series it has
+        at once, not with the number of series it ever had."""
+        with self.lock:
+            for slot, seen in list(self.unused.items()):
+                if oldest is not None and seen > oldest:
+                    continue
+                if self.owners[slot] or self.present[slot]:
+                    del self.unused[slot]
+                    continue
+                del self.unused[slot]
+                del self.index[self.keys[slot]]
+                self.keys[slot] = None
+                self.labels[slot] = None
+                if slot < len(self.encoded):
+                    self.encoded[slot] = None
+                self.free.append(slot)
+
+    def set(self, labels, value, timestamp):
+        slot = self.slot(labels)
+        self.values[slot] = value
+        self.timestamps[slot] = timestamp
+        self.present[slot] = 1
+        self.unused.pop(slot, None)
+        self.direct = True
+        self.rendered = {}
+
+    def store(self, slots, values, timestamp):
+        for slot, value in zip(slots, values):
+            self.values[slot] = value
+            self.timestamps[slot] = timestamp
+
+    def refresh(self):
+        """Write the values of the committed sources into the columns,
+        the most recently committed source last so that its values win
+        where several sources report the same series.
+
+        A family made up of fragments does not need the columns, so
+        this is only done on the reactor thread once they are read, by
+        get() and when the family is rendered from the stored values."""
+        if not self.stale:
+            return
+        for source in sorted(self.sources, key = lambda source: source.sequence):
+            slots, values = source.series[self]
+            self.store(slots, values, source.timestamp)
+        self.stale = False
+
+    def own(self, slots):
+        owners = self.owners
+        present = self.present
+        unused = self.unused
+        for slot in slots:
+            owners[slot] += 1
+            if owners[slot] == 2:
+                self.shared += 1
+            present[slot] = 1
+            unused.pop(slot, None)
+        self.rendered = {}
+
+    def disown(self, slots):
+        for slot in slots:
+            self.owners[slot] -= 1
+            if self.owners[slot] == 1:
+                self.shared -= 1
+            if self.owners[slot] <= 0:
+                self.owners[slot] = 0
+                self.present[slot] = 0
+                self.unused[slot] = next(serials)
+                self.rendered = {}
+
+    def replace(self, previous, snapshot):
+        """Put the fragments of *snapshot* where those of *previous* were,
+        or drop them if *snapshot* is None, keeping the order of the
+        other sources."""
+        if previous is not None and previous in self.sources:
+            self.sources = dict([(source if source is not previous else snapshot, None)
+                                 for source in self.sources
+                                 if source is not previous or snapshot is not None])
+        elif snapshot is not None:
+            self.sources[snapshot] = None
+        self.stale = True
+        self.rendered = {}
+
+    def series(self):
+        """Return the label sets of all series that currently have a value."""
+        keys = self.keys
+        return [keys[slot] for slot in range(len(keys)) if self.present[slot]]
+
+    def count(self):
+        """Return the number of series that currently have a value."""
+        return self.present.count(1)
+
+    def get(self, labels):
+        slot = self.index.get(labels)
+        if slot is None or not self.present[slot]:
+            return None
+        self.refresh()
+        return self.values[slot]
+
+    def clear(self):
+        self.present = bytearray(len(self.labels))
+        self.owners = array('l', [0]) * len(self.labels)
+        self.shared = 0
+        self.direct = False
+        self.sources = {}
+        self.stale = False
+        self.unused = dict.fromkeys([slot for slot in range(len(self.keys)) if self.keys[slot] is not None], next(serials))
+        self.rendered = {}
+
+    def reset(self):
+        """Forget every series, including the interned label sets."""
+        with self.lock:
+            self.index = {}
+            self.keys = []
+            self.labels = []
+            self.encoded = []
+            self.values = array('d')
+            self.timestamps = array('q')
+            self.present = bytearray()
+            self.owners = array('l')
+            self.shared = 0
+            self.direct = False
+            self.sources = {}
+            self.stale = False
+            self.unused = {}
+            self.free = []
+            self.rendered = {}
+
+    def invalidate(self):
+        """Drop the cached renderings so that the next render() starts
+        from scratch."""
+        self.rendered = {}
+
+    def render(self, format = 'text'):
+        """Return the exposition of this metric in *format* as bytes.
+
+        The result is cached and only rebuilt after the values of the
+        metric have changed.  As long as every series belongs to exactly
+        one source the family is put together from the fragments that
+        the snapshots of the sources rendered when they were prepared,
+        otherwise the series are rendered from the stored values."""
+        try:
+            return self.rendered[format]
+        except KeyError:
+            pass
+        if format not in Exposition.formats:
+            raise ValueError('unsupported format "{}"'.format(format))
+        if self.direct or self.shared:
+            series = self.renderPresent(format)
+        else:
+            series = b''.join([source.fragment(self, format) for source in self.sources])
+        rendered = self.renderHeader(format) + series
+        if format == 'protobuf':
+            rendered = protobuf.delimited(rendered)
+        self.rendered[format] = rendered
+        return rendered
+
+    def renderHeader(self, format):
+        if format == 'protobuf':
+            result = protobuf.field_string(protobuf.FAMILY_NAME, self.name)
+            if self.help is not None:
+                result += protobuf.field_string(protobuf.FAMILY_HELP, self.help)
+            return result + protobuf.field_varint(protobuf.FAMILY_TYPE,
+                                                  protobuf.metric_types.get(self.type, protobuf.metric_types['untyped']))
+        family = self.name
+        help = self.help
+        type = self.type
+        if format == 'openmetrics':
+            # OpenMetrics calls a counter family by the name of its
+            # samples without the _total suffix and untyped metrics
+            # unknown
+            if type == 'counter' and family.endswith('_total'):
+                family = family[:-len('_total')]
+            if help is not None:
+                help = escape_help(help)
+            if type == 'untyped':
+                type = 'unknown'
+        result = []
+        if help is not None:
+            result.append('# HELP {} {}\n'.format(family, help))
+        if type is not None:
+            result.append('# TYPE {} {}\n'.format(family, type))
+        return ''.join(result).encode('utf-8')
+
+    def renderPresent(self, format):
+        """Render every series that currently has a value from the stored
+        values, a run of series with the same timestamp at a time."""
+        self.refresh()
+        present = self.present
+        values = self.values
+        result = []
+        slots = [slot for slot in range(len(present)) if present[slot]]
+        for timestamp, run in itertools.groupby(slots, self.timestamps.__getitem__):
+            run = list(run)
+            result.append(self.renderSeries(format, run, [values[slot] for slot in run], timestamp))
+        return b''.join(result)
+
+    def renderSeries(self, format, slots, values, timestamp):
+        """Render the series in *slots* with *values*, all at *timestamp*,
+        in *format*, without the header of the family.
+
+        This is called from worker threads by Snapshot.prepare() and
+        only reads the interned label sets of the slots."""
+        if format == 'text':
+            return self.renderText(slots, values, timestamp)
+        if format == 'openmetrics':
+            return self.renderOpenMetrics(slots, values, timestamp)
+        if format == 'protobuf':
+            return self.renderProtobuf(slots, values, timestamp)
+        raise ValueError('unsupported format "{}"'.format(format))
+
+    def renderText(self, slots, values, timestamp):
+        """When every series has the same value, as every series of a 0/1
+        family that only exports the 1s does, the lines are joined from
+        the label text kept per slot without touching each of them, so
+        only the series that are new to the family cost anything."""
+        labels = self.labels
+        suffix = ' {:d}\n'.format(timestamp)
+        value = constant(values)
+        if value is not None:
+            suffix = ' ' + fmt_value(value) + suffix
+            return (suffix.join(pick(labels, slots)) + suffix).encode('utf-8')
+        return ''.join([labels[slot] + ' ' + fmt_value(value) + suffix
+                        for slot, value in zip(slots, values)]).encode('utf-8')
+
+    def renderOpenMetrics(self, slots, values, timestamp):
+        """OpenMetrics differs from the text format in that counter
+        samples carry a _total suffix, and timestamps are in seconds."""
+        labels = self.labels
+        suffix = ' {}\n'.format(fmt_seconds(timestamp))
+        if self.type != 'counter' or self.name.endswith('_total'):
+            value = constant(values)
+            if value is not None:
+                suffix = ' ' + fmt_value(value) + suffix
+                return (suffix.join(pick(labels, slots)) + suffix).encode('utf-8')
+            return ''.join([labels[slot] + ' ' + fmt_value(value) + suffix
+                            for slot, value in zip(slots, values)]).encode('utf-8')
+        name = self.name + '_total'
+        prefix = len(self.name)
+        return ''.join([name + labels[slot][prefix:] + ' ' + fmt_value(value) + suffix
+                        for slot, value in zip(slots, values)]).encode('utf-8')
+
+    def renderProtobuf(self, slots, values, timestamp):
+        """Render the series as the Metric fields of an
+        io.prometheus.client.MetricFamily.
+
+        Everything of the Metric message of a series up to its value,
+        including its encoded label pairs, is kept per slot alongside the
+        rendered text labels so that it is only built once.  That
+        assumes a timestamp that takes protobuf_timestamp_size bytes,
+        as every timestamp in milliseconds from 1971 to 2109 does, and
+        series with any other timestamp are encoded in full."""
+        metric_key, value_header, timestamp_key, fixed = self.protobufParts()
+        varint = protobuf.varint
+        pack = protobuf.double.pack
+        encoded = timestamp_key + varint(timestamp)
+        result = []
+        if len(encoded) != len(timestamp_key) + protobuf_timestamp_size:
+            keys = self.keys
+            for slot, value in zip(slots, values):
+                labels = protobuf.label_pairs(keys[slot])
+                result.extend((metric_key, varint(len(labels) + fixed + len(encoded) - len(timestamp_key)),
+                               labels, value_header, pack(value), encoded))
+            return b''.join(result)
+        prefixes = self.encoded
+        if len(prefixes) < len(self.keys):
+            # the fragments of several snapshots may be rendered at once
+            with self.lock:
+                keys = self.keys
+                for slot in range(len(prefixes), len(keys)):
+                    if keys[slot] is None:
+                        # freed, see slot()
+                        prefixes.append(None)
+                        continue
+                    labels = protobuf.label_pairs(keys[slot])
+                    prefixes.append(metric_key + varint(len(labels) + fixed + protobuf_timestamp_size) + labels + value_header)
+        value = constant(values)
+        if value is not None:
+            # see renderText()
+            suffix = pack(value) + encoded
+            return suffix.join(pick(prefixes, slots)) + suffix
+        for slot, value in zip(slots, values):
+            result.extend((prefixes[slot], pack(value), encoded))
+        return b''.join(result)
+
+    def protobufParts(self):
+        """Return the key of a Metric field, everything of a Metric
+        message between its label pairs and its value, the key of its
+        timestamp and the length of a Metric message apart from its
+        label pairs and the varint of its timestamp."""
+        metric_key = protobuf.key(protobuf.FAMILY_METRIC, protobuf.LENGTH_DELIMITED)
+        value_header = (protobuf.key(protobuf.value_fields.get(self.type, protobuf.METRIC_UNTYPED), protobuf.LENGTH_DELIMITED) +
+                        protobuf.varint(1 + protobuf.double.size) +
+                        protobuf.key(protobuf.VALUE, protobuf.FIXED64))
+        timestamp_key = protobuf.key(protobuf.METRIC_TIMESTAMP_MS, protobuf.VARINT)
+        fixed = len(value_header) + protobuf.double.size + len(timestamp_key)
+        return metric_key, value_header, timestamp_key, fixed
+
+    def encodePrefix(self, labels):
+        metric_key, value_header, timestamp_key, fixed = self.protobufParts()
+        encoded = protobuf.label_pairs(labels)
+        return metric_key + protobuf.varint(len(encoded) + fixed + protobuf_timestamp_size) + encoded + value_header
 
     def fmt(self):
-        result = ''
-        if self.help is not None:
-            result += '# HELP {} {}\n'.format(self.name, self.help)
-        if self.type is not None:
-            result += '# TYPE {} {}\n'.format(self.name, self.type)
-        for sample in sorted(self.samples, key = lambda s: int(round(s.timestamp.float_timestamp * 1000))):
-            result += '{}{}\n'.format(self.name, sample.fmt())
-        # prometheus doesn't seem to like it if you repeat yourself
-        self.samples = []
-        return result
+        return self.render().decode('utf-8')
 
     def addSample(self, sample):
-        self.samples.append(sample)
+        self.set(sample.key(), sample.value, millis(sample.timestamp))
+        exposition.update()
+
+class Histogram(object):
+    """A histogram family for the exporter's measurements of itself.
+
+    Observations are counted into the buckets of the series named by
+    their labels as they are made, rather than staged in a Snapshot,
+    and the series are exported without timestamps.  observe() is
+    meant to be called from the reactor thread only."""
+
+    # from a millisecond to a few minutes
+    buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0)
+
+    def __init__(self, name, help = None, buckets = None):
+        global metrics
+
+        self.name = name
+        self.help = help
+        self.type = 'histogram'
+        if buckets is not None:
+            self.buckets = tuple(sorted(buckets))
+
+        # labels -> [per bucket counts, the last one for +Inf; sum]
+        self.observations = {}
+        self.rendered = {}
+
+        metrics[self.name] = self
+
+    def observe(self, labels, value):
+        try:
+            counts, total = self.observations[labels]
+        except KeyError:
+            counts = [0] * (len(self.buckets) + 1)
+            total = 0.0
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.observations[labels] = [counts, total + value]
+        self.rendered = {}
+
+    def series(self):
+        return list(self.observations.keys())
+
+    def count(self):
+        return len(self.observations)
+
+    def get(self, labels):
+        """Return the number and the sum of the observations of a series."""
+        try:
+            counts, total = self.observations[labels]
+        except KeyError:
+            return None
+        return sum(counts), total
+
+    def clear(self):
+        self.observations = {}
+        self.rendered = {}
+
+    def reset(self):
+        self.clear()
+
+    def reclaim(self, oldest):
+        pass
+
+    def invalidate(self):
+        self.rendered = {}
+
+    def render(self, format = 'text'):
+        try:
+            return self.rendered[format]
+        except KeyError:
+            pass
+        if format == 'text':
+            rendered = self.renderText(self.help)
+        elif format == 'openmetrics':
+            rendered = self.renderText(None if self.help is None else escape_help(self.help))
+        elif format == 'protobuf':
+            rendered = self.renderProtobuf()
+        else:
+            raise ValueError('unsupported format "{}"'.format(format))
+        self.rendered[format] = rendered
+        return rendered
+
+    def renderText(self, help):
+        result = []
+        if help is not None:
+            result.append('# HELP {} {}\n'.format(self.name, help))
+        result.append('# TYPE {} histogram\n'.format(self.name))
+        bounds = [repr(float(bound)) for bound in self.buckets] + ['+Inf']
+        for labels, (counts, total) in self.observations.items():
+            prefix = ''.join(['{}="{}",'.format(name, escape(value)) for name, value in labels])
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                result.append('{}_bucket{{{}le="{}"}} {:d}\n'.format(self.name, prefix, bound, cumulative))
+            result.append('{}_sum{} {}\n'.format(self.name, fmt_labels(labels), fmt_value(total)))
+            result.append('{}_count{} {:d}\n'.format(self.name, fmt_labels(labels), cumulative))
+        return ''.join(result).encode('utf-8')
+
+    def renderProtobuf(self):
+        result = [protobuf.field_string(protobuf.FAMILY_NAME, self.name)]
+        if self.help is not None:
+            result.append(protobuf.field_string(protobuf.FAMILY_HELP, self.help))
+        result.append(protobuf.field_varint(protobuf.FAMILY_TYPE, protobuf.metric_types['histogram']))
+        for labels, (counts, total) in self.observations.items():
+            buckets = []
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                buckets.append(protobuf.field_bytes(protobuf.HISTOGRAM_BUCKET,
+                                                    protobuf.field_varint(protobuf.BUCKET_CUMULATIVE_COUNT, cumulative) +
+                                                    protobuf.field_double(protobuf.BUCKET_UPPER_BOUND, bound)))
+            histogram = (protobuf.field_varint(protobuf.HISTOGRAM_SAMPLE_COUNT, sum(counts)) +
+                         protobuf.field_double(protobuf.HISTOGRAM_SAMPLE_SUM, total) +
+                         b''.join(buckets))
+            result.append(protobuf.field_bytes(protobuf.FAMILY_METRIC,
+                                               protobuf.label_pairs(labels) +
+                                               protobuf.field_bytes(protobuf.METRIC_HISTOGRAM, histogram)))
+        return protobuf.delimited(b''.join(result))
+
+    def fmt(self):
+        return self.render().decode('utf-8')
+
+class Snapshot(object):
+    """The values produced by one poll of a command.
+
+    Values are staged per metric as (slot, value) pairs in typed arrays
+    and share the single timestamp of the poll, which may be filled in
+    once the poll has finished.  Nothing is visible to scrapes until
+    commit() is called."""
+
+    def __init__(self, timestamp = None):
+        self.timestamp = None
+        if timestamp is not None:
+            self.timestamp = millis(timestamp)
+        self.series = {}
+        self.owned = None
+        self.fragments = None
+        self.expires = None
+        # when the snapshot was made and when it was committed
+        self.serial = next(serials)
+        self.sequence = None
+        with pending_lock:
+            pending.add(self)
+
+    def set(self, metric, labels, value):
+        try:
+            slots, values = self.series[metric]
+        except KeyError:
+            slots, values = self.series[metric] = (array('l'), array('d'))
+        slots.append(metric.slot(labels))
+        values.append(value)
+
+    def reuse(self, previous, skip = ()):
+        """Stage the values of *previous* for every metric that has no
+        values in this snapshot yet, except for the metrics in *skip*."""
+        for metric, (slots, values) in previous.series.items():
+            if metric in self.series or metric in skip:
+                continue
+            self.series[metric] = (array('l', slots), array('d', values))
+
+    def samples(self):
+        """Return the number of values staged in this snapshot."""
+        return sum(len(values) for slots, values in self.series.values())
+
+    def setSlot(self, metric, slot, value):
+        """Like set() but for a series whose slot is already known."""
+        try:
+            slots, values = self.series[metric]
+        except KeyError:
+            slots, values = self.series[metric] = (array('l'), array('d'))
+        slots.append(slot)
+        values.append(value)
+
+    def prepare(self, formats = ('text',)):
+        """Do the part of commit() that only reads the shared state of the
+        metrics, which may be done on a worker thread.
+
+        The set of slots of each metric is worked out, with the last
+        value of a series that was staged more than once winning, and
+        the series are rendered in each of *formats* as a fragment of
+        their family.  Nothing is written to the metrics, so nothing a
+        scrape sees changes until commit().  Nothing may be staged once
+        this has been called."""
+        formats = frozenset(formats)
+        self.owned = {}
+        self.fragments = {}
+        for metric, (slots, values) in list(self.series.items()):
+            owned = frozenset(slots)
+            if len(owned) != len(slots):
+                latest = dict(zip(slots, values))
+                slots = array('l', latest.keys())
+                values = array('d', latest.values())
+                self.series[metric] = (slots, values)
+            self.owned[metric] = owned
+            self.fragments[metric] = dict([(format, metric.renderSeries(format, slots, values, self.timestamp))
+                                           for format in formats])
+
+    def fragment(self, metric, format):
+        """Return the series of *metric* in this snapshot rendered in
+        *format*, rendering them now if prepare() did not."""
+        fragments = self.fragments[metric]
+        try:
+            return fragments[format]
+        except KeyError:
+            pass
+        slots, values = self.series[metric]
+        fragment = fragments[format] = metric.renderSeries(format, slots, values, self.timestamp)
+        return fragment
+
+    def commit(self, previous = None, ttl = None):
+        """Make the values of this snapshot visible to scrapes.
+
+        *previous* is the last snapshot committed by the same source.
+        Series that it contained but this snapshot does not are
+        dropped, so every poll replaces the set of series it owns.
+
+        If the snapshot has not been prepared yet that is done first.
+        What is left only touches the series that appeared or
+        disappeared since *previous* and swaps the fragments of the
+        families, so it is cheap whatever the size of the snapshot.
+
+        If *ttl* is given and the source has not committed a newer
+        snapshot within that many seconds, the MetricManager withdraws
+        the series of this one."""
+        if self.fragments is None:
+            self.prepare(exposition.wanted)
+        with pending_lock:
+            pending.discard(self)
+        self.sequence = next(serials)
+
+        if previous is None:
+            previous_owned = {}
+        else:
+            previous_owned = previous.owned
+
+        for metric, owned in self.owned.items():
+            metric.own(owned - previous_owned.get(metric, frozenset()))
+            metric.replace(previous, self)
+
+        for metric, slots in previous_owned.items():
+            metric.disown(slots - self.owned.get(metric, frozenset()))
+            if metric not in self.owned:
+                metric.replace(previous, None)
+
+        committed.discard(previous)
+        committed.add(self)
+        if ttl is not None:
+            self.expires = reactor.seconds() + ttl
+
+        exposition.update()
+
+    def withdraw(self):
+        """Stop exporting the series of this snapshot."""
+        for metric, slots in self.owned.items():
+            metric.disown(slots)
+            metric.replace(self, None)
+        self.owned = {}
+        committed.discard(self)
+
+class Exposition(object):
+    """The complete /metrics body, rendered once whenever the stored
+    values change rather than on every scrape.
+
+    The body is replaced by rebinding a single attribute, so a scrape
+    always sees either the previous or the new rendering in full.
+    Only the families that changed are rendered again, mostly from the
+    fragments of prepared snapshots.  Every update renders the text
+    format and each other format that a
+    scrape has asked for, so that a scrape never renders anything
+    itself; scrapes are answered in the text format until the format
+    they prefer has been rendered by the next update.  Compressed
+    copies of the formats that scrapes asked to have compressed are
+    made on a thread after every update, see compress()."""
+
+    log = Logger()
+
+    # in order of preference when a client accepts several equally
+    formats = ['protobuf', 'openmetrics', 'text']
+
+    encodings = ['gzip']
+    if zstandard is not None:
+        encodings.insert(0, 'zstd')
+
+    def __init__(self):
+        self.body = b''
+        self.generation = 0
+        self.bodies = {}
+        self.wanted = set(['text'])
+        self.wanted_encodings = set()
+        # (format, encoding) -> (generation, compressed body) of the last
+        # compression that finished
+        self.compressed = {}
+        # (format, encoding) -> whether the body being compressed is
+        # already out of date, while it is being compressed
+        self.compressing = {}
+
+    def want(self, format, encoding = None):
+        """Render *format*, and compress it with *encoding* if that is
+        not None, with every update from now on."""
+        self.wanted.add(format)
+        if encoding is not None:
+            self.wanted_encodings.add((format, encoding))
+
+    def available(self):
+        """Return the formats that a scrape can be answered in right now."""
+        return [format for format in self.formats if format in self.bodies]
+
+    def update(self):
+        now = int(time.time() * 1000)
+        for metric_name, metric in list(metrics.items()):
+            if metric is not ceph_exporter_series:
+                ceph_exporter_series.set((('family', metric_name),), metric.count(), now)
+        bodies = {}
+        for format in self.formats:
+            if format in self.wanted:
+                start = time.perf_counter()
+                bodies[format] = self.join(format)
+                ceph_exporter_render_seconds.observe((('format', format),), time.perf_counter() - start)
+        self.generation += 1
+        self.bodies = bodies
+        self.body = bodies['text']
+        for format, encoding in sorted(self.wanted_encodings):
+            if format in bodies:
+                self.compress(format, encoding)
+
+    def join(self, format):
+        global metrics
+        body = b''.join([metrics[metric_name].render(format) for metric_name in sorted(metrics.keys())])
+        if format == 'openmetrics':
+            body += b'# EOF\n'
+        return body
+
+    def render(self, format = 'text'):
+        """Return the body in *format*, one of Exposition.formats, rendering
+        it now if no update has rendered it yet."""
+        try:
+            return self.bodies[format]
+        except KeyError:
+            pass
+        if format not in self.formats:
+            raise ValueError('unsupported format "{}"'.format(format))
+        start = time.perf_counter()
+        body = self.bodies[format] = self.join(format)
+        ceph_exporter_render_seconds.observe((('format', format),), time.perf_counter() - start)
+        return body
+
+    def compress(self, format, encoding):
+        """Compress the current body in *format* with *encoding* on a
+        thread.
+
+        zlib and zstd release the GIL while they compress, so this does
+        not hold up the reactor.  While a compression is running further
+        updates only mark it as out of date, and a new one is started
+        for the body of the latest update once it has finished."""
+        key = (format, encoding)
+        if key in self.compressing:
+            self.compressing[key] = True
+            return
+        self.compressing[key] = False
+        generation = self.generation
+        finished = deferToThread(compress, self.render(format), encoding)
+        finished.addCallback(self.storeCompressed, key, generation)
+        finished.addErrback(lambda failure: self.log.failure('compressing /metrics failed', failure = failure))
+        finished.addBoth(self.compressionDone, key)
+
+    def storeCompressed(self, body, key, generation):
+        previous = self.compressed.get(key)
+        if previous is None or previous[0] < generation:
+            self.compressed[key] = (generation, body)
+
+    def compressionDone(self, result, key):
+        if self.compressing.pop(key):
+            self.compress(*key)
+
+    def precompressed(self, format, encoding):
+        """Return the most recent compressed body in *format* for a scrape,
+        which may be that of the update before the last one while the
+        last is still being compressed, or None if there is none yet."""
+        try:
+            generation, body = self.compressed[format, encoding]
+        except KeyError:
+            return None
+        return body
+
+    def encode(self, encoding, format = 'text'):
+        """Return the current body in *format* compressed with *encoding*,
+        one of Exposition.encodings, compressing it now if needed."""
+        try:
+            generation, body = self.compressed[format, encoding]
+        except KeyError:
+            generation = None
+        if generation == self.generation:
+            return body
+        body = compress(self.render(format), encoding)
+        self.compressed[format, encoding] = (self.generation, body)
+        return body
+
+def compress(body, encoding):
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel = 6)
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level = 3).compress(body)
+    raise ValueError('unsupported encoding "{}"'.format(encoding))
+
+exposition = Exposition()
+
+# the exporter's measurements of itself
+ceph_exporter_render_seconds = Histogram('ceph_exporter_render_seconds')
+ceph_exporter_series = Metric('ceph_exporter_series', None, 'gauge')
 
 class MetricManager(object):
+    """Drops the series of sources that have stopped reporting.
+
+    Every sweep only looks at the committed snapshots, not at the
+    individual series, and only touches the series of snapshots that
+    have expired.  It then frees the slots of the series that nothing
+    exports any more, see Metric.reclaim()."""
+
+    log = Logger()
+
+    interval = 10.0
+
     def __init__(self):
-        pass
+        self.loop = None
 
     def start(self):
-        reactor.callLater(30.0, self.expireSamples)
+        self.loop = LoopingCall(self.expireSamples)
+        self.loop.clock = reactor
+        self.loop.start(self.interval, now = False)
 
     def expireSamples(self):
-        now = arrow.now()
-        for metric in metrics.values():
-            metric.expireSamples(now)
+        now = reactor.seconds()
+        expired = [snapshot for snapshot in committed if snapshot.expires is not None and snapshot.expires < now]
+        for snapshot in expired:
+            self.log.debug('withdrawing {n:d} stale metrics', n = len(snapshot.owned))
+            snapshot.withdraw()
+        if expired:
+            exposition.update()
+        self.reclaimSlots()
+
+    def reclaimSlots(self):
+        with pending_lock:
+            uncommitted = [snapshot.serial for snapshot in pending]
+        oldest = min(uncommitted) if uncommitted else None
+        for metric in list(metrics.values()):
+            metric.reclaim(oldest)
@@ -0,0 +1,108 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+"""Just enough of the protocol buffer wire format to write the
+io.prometheus.client.MetricFamily messages of the Prometheus
+delimited protobuf exposition format, without depending on a
+protobuf runtime."""
+
+import struct
+
+# io.prometheus.client.MetricType
+metric_types = {'counter': 0,
+                'gauge': 1,
+                'summary': 2,
+                'untyped': 3,
+                'histogram': 4}
+
+# field numbers of io.prometheus.client.MetricFamily
+FAMILY_NAME = 1
+FAMILY_HELP = 2
+FAMILY_TYPE = 3
+FAMILY_METRIC = 4
+
+# field numbers of io.prometheus.client.Metric
+METRIC_LABEL = 1
+METRIC_GAUGE = 2
+METRIC_COUNTER = 3
+METRIC_UNTYPED = 5
+METRIC_TIMESTAMP_MS = 6
+METRIC_HISTOGRAM = 7
+
+# field numbers of io.prometheus.client.Histogram
+HISTOGRAM_SAMPLE_COUNT = 1
+HISTOGRAM_SAMPLE_SUM = 2
+HISTOGRAM_BUCKET = 3
+
+# field numbers of io.prometheus.client.Bucket
+BUCKET_CUMULATIVE_COUNT = 1
+BUCKET_UPPER_BOUND = 2
+
+# field numbers of io.prometheus.client.LabelPair
+LABEL_NAME = 1
+LABEL_VALUE = 2
+
+# the value field of Gauge, Counter and Untyped
+VALUE = 1
+
+value_fields = {'counter': METRIC_COUNTER,
+                'gauge': METRIC_GAUGE}
+
+# wire types
+VARINT = 0
+FIXED64 = 1
+LENGTH_DELIMITED = 2
+
+double = struct.Struct('<d')
+
+def varint(value):
+    if value < 0:
+        value &= 0xffffffffffffffff
+    result = bytearray()
+    while value > 0x7f:
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+def key(number, wire_type):
+    return varint((number << 3) | wire_type)
+
+def field_varint(number, value):
+    return key(number, VARINT) + varint(value)
+
+def field_double(number, value):
+    return key(number, FIXED64) + double.pack(value)
+
+def field_bytes(number, data):
+    return key(number, LENGTH_DELIMITED) + varint(len(data)) + data
+
+def field_string(number, value):
+    return field_bytes(number, value.encode('utf-8'))
+
+def label_pairs(labels):
+    """Encode a tuple of (name, value) pairs as repeated LabelPair
+    fields of a Metric."""
+    return b''.join([field_bytes(METRIC_LABEL,
+                                 field_string(LABEL_NAME, name) + field_string(LABEL_VALUE, value))
+                     for name, value in labels])
+
+def delimited(message):
+    return varint(len(message)) + message
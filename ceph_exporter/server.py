@@ -18,13 +18,127 @@
 # along with ceph_exporter.  If not, see
 # <http://www.gnu.org/licenses/>.
 
+import cProfile
+import hmac
+import io
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+
 from twisted.internet import reactor
 from twisted.logger import Logger
+from twisted.web.server import NOT_DONE_YET
 from twisted.web.server import Site
 from twisted.web.resource import Resource
 from twisted.internet import endpoints
 
-from .prometheus import metrics
+from .prometheus import exposition
+from .prometheus import Histogram
+
+ceph_exporter_scrape_seconds = Histogram('ceph_exporter_scrape_seconds')
+
+content_types = {'text': 'text/plain; charset=utf-8; version=0.0.4',
+                 'openmetrics': 'application/openmetrics-text; version=1.0.0; charset=utf-8',
+                 'protobuf': 'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'}
+
+def accepted_types(header):
+    """Parse an Accept header into a list of (media type, parameters,
+    quality value) tuples."""
+    result = []
+    if not header:
+        return result
+    for item in header.decode('latin-1').split(','):
+        parts = item.strip().split(';')
+        media_type = parts[0].strip().lower()
+        if not media_type:
+            continue
+        parameters = {}
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition('=')
+            name = name.strip().lower()
+            value = value.strip().strip('"')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+            else:
+                parameters[name] = value
+        result.append((media_type, parameters, quality))
+    return result
+
+def media_format(media_type, parameters):
+    """Return which of Exposition.formats a media type asks for, or
+    None if it is not one that we can produce."""
+    if media_type == 'application/vnd.google.protobuf':
+        if parameters.get('proto') == 'io.prometheus.client.MetricFamily' and parameters.get('encoding') == 'delimited':
+            return 'protobuf'
+        return None
+    if media_type == 'application/openmetrics-text':
+        if parameters.get('version', '1.0.0') in ('0.0.1', '1.0.0'):
+            return 'openmetrics'
+        return None
+    if media_type in ('text/plain', 'text/*', '*/*'):
+        if parameters.get('version', '0.0.4') == '0.0.4':
+            return 'text'
+    return None
+
+def choose_format(header, formats = None):
+    """Pick the exposition format the client prefers out of *formats*,
+    all of Exposition.formats by default.  Ties go to the earlier entry
+    of Exposition.formats, and the text format is used if the client
+    does not accept any of them."""
+    if formats is None:
+        formats = exposition.formats
+    best = 'text'
+    best_quality = 0.0
+    for media_type, parameters, quality in accepted_types(header):
+        format = media_format(media_type, parameters)
+        if format is None or format not in formats or quality <= 0.0:
+            continue
+        if quality > best_quality or (quality == best_quality and
+                                      exposition.formats.index(format) < exposition.formats.index(best)):
+            best = format
+            best_quality = quality
+    return best
+
+def accepted_encodings(header):
+    """Parse an Accept-Encoding header into a dict of content coding to
+    quality value."""
+    result = {}
+    if not header:
+        return result
+    for item in header.decode('latin-1').split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for parameter in parts[1:]:
+            name, _, value = parameter.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[coding] = quality
+    return result
+
+def choose_encoding(header):
+    """Pick the best compression from Exposition.encodings the client
+    accepts, or None for an uncompressed body."""
+    accepted = accepted_encodings(header)
+    best = None
+    best_quality = 0.0
+    for encoding in exposition.encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best = encoding
+            best_quality = quality
+    return best
 
 class MetricsPage(Resource):
     log = Logger()
@@ -33,15 +147,252 @@ class MetricsPage(Resource):
     def __init__(self):
         Resource.__init__(self)
 
+    def scraped(self, result, format, start):
+        ceph_exporter_scrape_seconds.observe((('format', format),), time.perf_counter() - start)
+
     def render_GET(self, request):
-        global metrics
-        request.setHeader(b'Content-Type', 'text/plain; charset=utf-8; version=0.0.4')
-        results = []
-        metric_names = sorted(metrics.keys())
-        for metric_name in metric_names:
-            results.append(metrics[metric_name].fmt())
-        result = ''.join(results).encode('utf-8')
-        return result
+        start = time.perf_counter()
+        # a scrape is answered with what the last update rendered and
+        # compressed, and what it would have preferred is rendered and
+        # compressed by the updates from now on
+        accept = request.getHeader(b'Accept')
+        encoding = choose_encoding(request.getHeader(b'Accept-Encoding'))
+        exposition.want(choose_format(accept), encoding)
+        format = choose_format(accept, exposition.available())
+        # only scrapes whose response was sent in full are observed
+        finished = request.notifyFinish()
+        finished.addCallback(self.scraped, format, start)
+        finished.addErrback(lambda failure: None)
+        request.setHeader(b'Content-Type', content_types[format])
+        request.setHeader(b'Vary', b'Accept, Accept-Encoding')
+        body = None
+        if encoding is not None:
+            body = exposition.precompressed(format, encoding)
+        if body is None:
+            return exposition.render(format)
+        request.setHeader(b'Content-Encoding', encoding.encode('ascii'))
+        return body
+
+def authorized(request, token):
+    """Check the bearer token of *request*, and if it is missing or wrong
+    set up a 401 response."""
+    header = request.getHeader(b'Authorization') or b''
+    scheme, separator, credentials = header.partition(b' ')
+    if scheme.lower() == b'bearer' and hmac.compare_digest(credentials.strip(), token):
+        return True
+    request.setResponseCode(401)
+    request.setHeader(b'WWW-Authenticate', b'Bearer realm="ceph_exporter"')
+    return False
+
+def argument(request, name, default, convert = int):
+    """Return the query argument *name* of *request* converted with
+    *convert*, or *default* if it is not given.  Raises ValueError if it
+    can't be converted."""
+    values = request.args.get(name.encode('ascii'))
+    if not values:
+        return default
+    return convert(values[0].decode('ascii'))
+
+def bad_request(request, message):
+    request.setResponseCode(400)
+    request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+    return '{}\n'.format(message).encode('utf-8')
+
+class Sampler(object):
+    """Sample the stack of one thread from another thread at a fixed
+    rate and count how often each stack was seen.
+
+    collapsed() returns the counts in the collapsed stack format that
+    flame graph tools read: one line per stack, the frames from the
+    outermost to the innermost separated by semicolons, followed by the
+    number of samples."""
+
+    interval = 0.005
+
+    def __init__(self, thread_id):
+        self.thread_id = thread_id
+        self.counts = {}
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self.run, name = 'ceph_exporter_sampler')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append('{}:{}'.format(code.co_filename, code.co_name))
+            frame = frame.f_back
+        if stack:
+            key = ';'.join(reversed(stack))
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def collapsed(self):
+        return ''.join(['{} {:d}\n'.format(stack, count) for stack, count in sorted(self.counts.items())])
+
+class ProfilePage(Resource):
+    """Profile the reactor thread for ?seconds=N seconds.
+
+    With ?mode=cprofile (the default) the result is the pstats report
+    of the ?limit=N functions with the highest cumulative time.  With
+    ?mode=sample the stack of the reactor thread is sampled instead,
+    which costs much less than cProfile, and the result is in collapsed
+    stack format.  Threads other than the reactor's, such as the
+    workers, are not profiled.  Only one profile runs at a time."""
+
+    log = Logger()
+    isLeaf = True
+
+    max_seconds = 300.0
+
+    def __init__(self, token):
+        Resource.__init__(self)
+        self.token = token
+        self.running = False
+
+    def render_GET(self, request):
+        if not authorized(request, self.token):
+            return b''
+
+        try:
+            seconds = argument(request, 'seconds', 10.0, float)
+            limit = argument(request, 'limit', 50)
+        except ValueError:
+            return bad_request(request, 'seconds and limit must be numbers')
+        if not 0 < seconds <= self.max_seconds:
+            return bad_request(request, 'seconds must be between 0 and {:g}'.format(self.max_seconds))
+        mode = argument(request, 'mode', 'cprofile', str)
+        if mode not in ('cprofile', 'sample'):
+            return bad_request(request, 'mode must be cprofile or sample')
+
+        if self.running:
+            request.setResponseCode(409)
+            request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+            return b'a profile is already running\n'
+        self.running = True
+
+        self.log.info('profiling the reactor for {seconds:g}s ({mode:})', seconds = seconds, mode = mode)
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            profiler.enable()
+        else:
+            profiler = Sampler(threading.get_ident())
+            profiler.start()
+
+        call = reactor.callLater(seconds, self.finish, request, profiler, limit)
+        request.notifyFinish().addErrback(self.abort, call, profiler)
+        return NOT_DONE_YET
+
+    def stop(self, profiler):
+        self.running = False
+        if isinstance(profiler, Sampler):
+            profiler.stop()
+        else:
+            profiler.disable()
+
+    def abort(self, failure, call, profiler):
+        # the client went away before the profile was finished
+        if call.active():
+            call.cancel()
+            self.stop(profiler)
+
+    def finish(self, request, profiler, limit):
+        self.stop(profiler)
+        request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+        if isinstance(profiler, Sampler):
+            request.write(profiler.collapsed().encode('utf-8'))
+        else:
+            output = io.StringIO()
+            stats = pstats.Stats(profiler, stream = output)
+            stats.sort_stats('cumulative').print_stats(limit)
+            request.write(output.getvalue().encode('utf-8'))
+        request.finish()
+
+class MemoryPage(Resource):
+    """Report the ?limit=N source lines that allocated the most memory
+    that is still in use, as traced by tracemalloc.
+
+    If tracemalloc is already tracing, e.g. because the exporter was
+    started with PYTHONTRACEMALLOC set, the report covers everything
+    traced so far and is returned at once.  Otherwise tracing is turned
+    on for ?seconds=N seconds and the report covers what was allocated
+    in that time."""
+
+    log = Logger()
+    isLeaf = True
+
+    max_seconds = 300.0
+
+    def __init__(self, token):
+        Resource.__init__(self)
+        self.token = token
+        self.running = False
+
+    def render_GET(self, request):
+        if not authorized(request, self.token):
+            return b''
+
+        try:
+            seconds = argument(request, 'seconds', 10.0, float)
+            limit = argument(request, 'limit', 25)
+        except ValueError:
+            return bad_request(request, 'seconds and limit must be numbers')
+        if not 0 < seconds <= self.max_seconds:
+            return bad_request(request, 'seconds must be between 0 and {:g}'.format(self.max_seconds))
+
+        if tracemalloc.is_tracing() and not self.running:
+            return self.report(request, tracemalloc.take_snapshot(), limit)
+
+        if self.running:
+            request.setResponseCode(409)
+            request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+            return b'memory is already being traced\n'
+        self.running = True
+
+        self.log.info('tracing allocations for {seconds:g}s', seconds = seconds)
+        tracemalloc.start()
+        call = reactor.callLater(seconds, self.finish, request, limit)
+        request.notifyFinish().addErrback(self.abort, call)
+        return NOT_DONE_YET
+
+    def stop(self):
+        self.running = False
+        tracemalloc.stop()
+
+    def abort(self, failure, call):
+        if call.active():
+            call.cancel()
+            self.stop()
+
+    def finish(self, request, limit):
+        snapshot = tracemalloc.take_snapshot()
+        self.stop()
+        request.write(self.report(request, snapshot, limit))
+        request.finish()
+
+    def report(self, request, snapshot, limit):
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__),
+                                           tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                                           tracemalloc.Filter(False, '<unknown>')])
+        statistics = snapshot.statistics('lineno')
+        total = sum(statistic.size for statistic in statistics)
+        lines = ['{:d} bytes in {:d} allocation sites\n'.format(total, len(statistics))]
+        for statistic in statistics[:limit]:
+            lines.append('{}\n'.format(statistic))
+        request.setHeader(b'Content-Type', b'text/plain; charset=utf-8')
+        return ''.join(lines).encode('utf-8')
 
 class RootPage(Resource):
     log = Logger()
@@ -57,6 +408,16 @@ class Server(object):
         self.metrics = MetricsPage()
         self.root = RootPage()
         self.root.putChild(b'metrics', self.metrics)
+        self.debug = None
+        if self.options.debug_token_file is not None:
+            with open(self.options.debug_token_file, 'rb') as f:
+                token = f.read().strip()
+            if not token:
+                raise ValueError('{} is empty'.format(self.options.debug_token_file))
+            self.debug = Resource()
+            self.debug.putChild(b'profile', ProfilePage(token))
+            self.debug.putChild(b'memory', MemoryPage(token))
+            self.root.putChild(b'debug', self.debug)
         self.site = Site(self.root)
         self.site.noisy = False
         self.endpoint = None
@@ -0,0 +1,103 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+from ..jsonstream import JsonObjectStream
+
+class JsonObjectStreamTest(TestCase):
+    document = b'{"version": 12, "ratio": 0.95, "pg_stats": [{"pgid": "1.0"}, {"pgid": "1.1"}], "name": "\xc3\xa9", "empty": []}'
+
+    def parse(self, chunk_size):
+        elements = []
+        stream = JsonObjectStream({'pg_stats': elements.append,
+                                   'empty': elements.append})
+        for i in range(0, len(self.document), chunk_size):
+            stream.feed(self.document[i:i + chunk_size])
+        return stream.finish(), elements
+
+    def test_whole(self):
+        result, elements = self.parse(len(self.document))
+        self.assertEqual(result, {'version': 12, 'ratio': 0.95, 'pg_stats': [], 'name': 'é', 'empty': []})
+        self.assertEqual(elements, [{'pgid': '1.0'}, {'pgid': '1.1'}])
+
+    def test_single_bytes(self):
+        self.assertEqual(self.parse(1), self.parse(len(self.document)))
+
+    def test_element_before_end(self):
+        elements = []
+        stream = JsonObjectStream({'pg_stats': elements.append})
+        stream.feed(b'{"pg_stats": [{"pgid": "1.0"}, {"pg')
+        self.assertEqual(elements, [{'pgid': '1.0'}])
+
+    def test_truncated(self):
+        stream = JsonObjectStream({})
+        stream.feed(b'{"version": 12')
+        self.assertRaises(ValueError, stream.finish)
+
+    def test_invalid(self):
+        stream = JsonObjectStream({})
+        self.assertRaises(ValueError, stream.feed, b'[1, 2]')
+
+    def test_split_value(self):
+        document = b'{"osd_stats": [{"osd": 0, "name": "a \\"b\\" \\\\", "hb_in": [1, [2, 3]]}, {"osd": 1}], "version": 12}'
+        stream = JsonObjectStream({})
+        for i in range(len(document)):
+            stream.feed(document[i:i + 1])
+        self.assertEqual(stream.finish(), {'osd_stats': [{'osd': 0, 'name': 'a "b" \\', 'hb_in': [1, [2, 3]]}, {'osd': 1}], 'version': 12})
+
+    def test_value_not_copied(self):
+        # what has been received of a value that is not complete yet is
+        # set aside instead of being kept in the buffer
+        stream = JsonObjectStream({})
+        stream.feed(b'{"osd_stats": [')
+        for i in range(100):
+            stream.feed(b'{"osd": 0, "name": "a"}, ')
+            self.assertLess(len(stream.buffer), 30)
+        stream.feed(b'{"osd": 0, "name": "a"}]}')
+        self.assertEqual(len(stream.finish()['osd_stats']), 101)
+
+    def test_invalid_value(self):
+        stream = JsonObjectStream({})
+        stream.feed(b'{"osd_stats": [1, 2, ')
+        self.assertRaises(ValueError, stream.feed, b'x')
+
+    def test_mismatched(self):
+        stream = JsonObjectStream({})
+        stream.feed(b'{"osd_stats": [{"osd": 0')
+        self.assertRaises(ValueError, stream.feed, b']')
+
+    def test_invalid_scalar(self):
+        stream = JsonObjectStream({})
+        stream.feed(b'{"version": tru')
+        self.assertRaises(ValueError, stream.feed, b'x, ')
+
+    def test_trailing_comma(self):
+        for document in [b'{"version": 12,}',
+                         b'{"pg_stats": [{"pgid": "1.0"},]}',
+                         b'{"osd_stats": [1, 2 ,\n]}',
+                         b'{"osd_stats": [{"osd": 0,}]}']:
+            stream = JsonObjectStream({'pg_stats': lambda value: None})
+            self.assertRaises(ValueError, stream.feed, document)
+            # also when the comma and the bracket arrive apart
+            stream = JsonObjectStream({'pg_stats': lambda value: None})
+            split = document.rindex(b',') + 1
+            stream.feed(document[:split])
+            self.assertRaises(ValueError, stream.feed, document[split:])
@@ -0,0 +1,181 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+import argparse
+import os
+
+from twisted.internet.defer import DeferredSemaphore
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from .. import ceph
+from ..ceph.backends import LimitedBackend
+from ..ceph.backends.fixture import FixtureBackend
+from ..ceph.commands.ceph_pg_dump import CephPgDump
+from ..ceph.commands.ceph_status import CephStatus
+from ..main import Cluster
+from ..main import cluster_options
+from ..main import command_interval
+from ..main import read_fsid
+from ..main import series_rule
+
+class CommandIntervalTest(TestCase):
+    def test_parse(self):
+        self.assertEqual(command_interval('pg dump=120'), ('pg dump', 120.0))
+
+    def test_whitespace(self):
+        self.assertEqual(command_interval(' pg  dump =7.5'), ('pg dump', 7.5))
+
+    def test_missing_separator(self):
+        self.assertRaises(argparse.ArgumentTypeError, command_interval, 'pg dump')
+
+    def test_not_a_number(self):
+        self.assertRaises(argparse.ArgumentTypeError, command_interval, 'pg dump=soon')
+
+    def test_not_positive(self):
+        self.assertRaises(argparse.ArgumentTypeError, command_interval, 'status=0')
+
+class SeriesRuleTest(TestCase):
+    def test_family(self):
+        self.assertEqual(series_rule('ceph_pg_timestamp'), ('ceph_pg_timestamp', '*'))
+
+    def test_scope(self):
+        self.assertEqual(series_rule('ceph_* : pg'), ('ceph_*', 'pg'))
+
+    def test_scope_pattern(self):
+        self.assertEqual(series_rule('ceph_objects:p*'), ('ceph_objects', 'p*'))
+
+    def test_unknown_scope(self):
+        self.assertRaises(argparse.ArgumentTypeError, series_rule, 'ceph_objects:pgs')
+
+    def test_empty(self):
+        self.assertRaises(argparse.ArgumentTypeError, series_rule, ':pg')
+        self.assertRaises(argparse.ArgumentTypeError, series_rule, 'ceph_objects:')
+
+class IntervalTest(TestCase):
+    def setUp(self):
+        self.options = argparse.Namespace(pg_state_mode = 'all',
+                                          pg_dump_mode = 'full',
+                                          interval = 15.0,
+                                          command_interval = [('pg dump', 120.0)],
+                                          timeout = None,
+                                          stale_after = 3.0,
+                                          include = [],
+                                          exclude = [])
+
+    def test_default(self):
+        self.assertEqual(CephStatus('fsid', None).interval, 30.0)
+
+    def test_global(self):
+        self.assertEqual(CephStatus('fsid', self.options).interval, 15.0)
+
+    def test_command(self):
+        self.assertEqual(CephPgDump('fsid', self.options).interval, 120.0)
+
+class ClustersTest(TestCase):
+    def setUp(self):
+        self.directory = self.mktemp()
+        os.makedirs(self.directory)
+        self.options = argparse.Namespace(clusters = None,
+                                          config = '/etc/ceph/ceph.conf',
+                                          keyring = '/etc/ceph/ceph.client.admin.keyring',
+                                          name = 'client.admin',
+                                          fixtures = '.',
+                                          backend = 'fixture',
+                                          interval = 30.0,
+                                          command_interval = [],
+                                          timeout = None,
+                                          stale_after = 3.0,
+                                          start_jitter = 0.0,
+                                          pg_state_mode = 'all',
+                                          pg_dump_mode = 'full',
+                                          include = [],
+                                          exclude = [])
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(text)
+        return path
+
+    def test_single(self):
+        self.assertEqual(cluster_options(self.options), [('ceph', self.options)])
+
+    def test_clusters(self):
+        self.options.clusters = self.write('clusters.ini',
+                                           '[east]\n'
+                                           'config = /etc/ceph/east.conf\n'
+                                           '[west]\n'
+                                           'config = /etc/ceph/west.conf\n'
+                                           'keyring = /etc/ceph/west.keyring\n')
+        clusters = cluster_options(self.options)
+        self.assertEqual([name for name, options in clusters], ['east', 'west'])
+        east, west = [options for name, options in clusters]
+        self.assertEqual(east.config, '/etc/ceph/east.conf')
+        self.assertEqual(east.keyring, '/etc/ceph/ceph.client.admin.keyring')
+        self.assertEqual(west.keyring, '/etc/ceph/west.keyring')
+        self.assertEqual(self.options.config, '/etc/ceph/ceph.conf')
+
+    def test_no_clusters(self):
+        self.options.clusters = self.write('clusters.ini', '')
+        self.assertRaises(ValueError, cluster_options, self.options)
+
+    def test_missing_clusters(self):
+        self.options.clusters = os.path.join(self.directory, 'missing.ini')
+        self.assertRaises(ValueError, cluster_options, self.options)
+
+    def test_read_fsid(self):
+        path = self.write('ceph.conf', '[global]\nfsid = 1234\n')
+        self.assertEqual(read_fsid(path), '1234')
+        self.assertRaises(ValueError, read_fsid, os.path.join(self.directory, 'missing.conf'))
+
+    def test_start(self):
+        clock = Clock()
+        self.patch(ceph, 'reactor', clock)
+        self.options.config = self.write('ceph.conf', '[global]\nfsid = 1234\n')
+        cluster = Cluster('ceph', self.options, semaphore = DeferredSemaphore(2))
+        self.assertIsInstance(cluster.backend, LimitedBackend)
+        self.assertIsInstance(cluster.backend.backend, FixtureBackend)
+        self.assertEqual(len(cluster.pollers), len(Cluster.commands))
+        self.assertEqual(clock.getDelayedCalls(), [])
+        cluster.start(10.0)
+        self.assertEqual(sorted(call.getTime() for call in clock.getDelayedCalls()), [10.0] * len(Cluster.commands))
+
+    def test_backend_timeout(self):
+        timeouts = []
+        self.patch(FixtureBackend, 'setTimeout', lambda backend, timeout: timeouts.append(timeout))
+        self.options.config = self.write('ceph.conf', '[global]\nfsid = 1234\n')
+        self.options.pg_dump_mode = 'tiered'
+        self.options.pg_dump_early_after = 0.25
+        self.options.command_interval = [('df', 600.0)]
+        Cluster('ceph', self.options, semaphore = DeferredSemaphore(2))
+        self.options.command_interval = []
+        Cluster('ceph', self.options)
+        self.options.timeout = 0
+        Cluster('ceph', self.options)
+        self.assertEqual(timeouts, [600.0, 300.0, 0])
+
+    def test_subscribe(self):
+        self.options.config = self.write('ceph.conf', '[global]\nfsid = 1234\n')
+        cluster = Cluster('ceph', self.options)
+        extractor = lambda command, data, snapshot: None
+        cluster.subscribe('osd dump', extractor)
+        self.assertEqual(cluster.pollers['osd dump'].extractors, [extractor])
+        self.assertRaises(ValueError, cluster.subscribe, 'osd tree', extractor)
@@ -0,0 +1,96 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.internet.task import Clock
+from twisted.trial.unittest import TestCase
+
+from .. import monitor
+from ..monitor import LoopMonitor
+from ..prometheus import metrics
+
+class FakeReactor(Clock):
+    def __init__(self):
+        Clock.__init__(self)
+        self.triggers = []
+
+    def addSystemEventTrigger(self, phase, event, f):
+        self.triggers.append((phase, event, f))
+
+class FakeLog(object):
+    def __init__(self):
+        self.warnings = []
+
+    def warn(self, format, **kwargs):
+        self.warnings.append(kwargs)
+
+class LoopMonitorTest(TestCase):
+    def setUp(self):
+        self.clock = FakeReactor()
+        self.patch(monitor, 'reactor', self.clock)
+        self.monitor = LoopMonitor(threshold = 0)
+        self.monitor.start()
+        self.monitor.log = FakeLog()
+        self.warnings = self.monitor.log.warnings
+
+    def tearDown(self):
+        self.monitor.stop()
+        metrics['ceph_exporter_reactor_lag_seconds'].clear()
+        metrics['ceph_exporter_reactor_stalls'].clear()
+
+    def test_lag(self):
+        self.clock.advance(LoopMonitor.interval)
+        self.clock.advance(LoopMonitor.interval + 0.25)
+        count, total = metrics['ceph_exporter_reactor_lag_seconds'].get(())
+        self.assertEqual(count, 2)
+        self.assertEqual(total, 0.25)
+        self.assertEqual(len(self.clock.getDelayedCalls()), 1)
+
+    def test_no_stall(self):
+        self.monitor.check(self.monitor.last_tick + LoopMonitor.interval)
+        self.assertFalse(self.monitor.stalled)
+        self.assertIsNone(self.monitor.stack)
+
+    def test_stall(self):
+        self.monitor.threshold = 1.0
+        self.monitor.check(self.monitor.last_tick + LoopMonitor.interval + 2.0)
+        self.assertTrue(self.monitor.stalled)
+        self.assertIn('test_stall', self.monitor.stack)
+        self.clock.advance(LoopMonitor.interval)
+        self.assertFalse(self.monitor.stalled)
+        self.assertEqual(metrics['ceph_exporter_reactor_stalls'].get(()), 1)
+        self.assertEqual(len(self.warnings), 1)
+        self.assertIn('test_stall', self.warnings[0]['stack'])
+
+    def test_stack_rate_limited(self):
+        self.monitor.threshold = 1.0
+        for i in range(2):
+            self.monitor.check(self.monitor.last_tick + LoopMonitor.interval + 2.0)
+            self.clock.advance(LoopMonitor.interval)
+        self.assertEqual(metrics['ceph_exporter_reactor_stalls'].get(()), 2)
+        self.assertEqual(len(self.warnings), 1)
+
+    def test_watchdog(self):
+        watched = LoopMonitor(threshold = 0.01)
+        watched.start()
+        self.assertTrue(watched.watchdog.is_alive())
+        self.assertEqual(self.clock.triggers, [('before', 'shutdown', watched.stop)])
+        watched.stop()
+        watched.watchdog.join(1.0)
+        self.assertFalse(watched.watchdog.is_alive())
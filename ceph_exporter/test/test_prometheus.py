@@ -20,8 +20,24 @@
 
 from twisted.trial.unittest import TestCase
 
+import arrow
+import datetime
+import gzip
+import weakref
+
+from twisted.internet.task import Clock
+
+from .. import prometheus
 from ..prometheus import escape
+from ..prometheus import exposition
+from ..prometheus import fmt_value
+from ..prometheus import Histogram
+from ..prometheus import metrics
 from ..prometheus import Label
+from ..prometheus import Metric
+from ..prometheus import MetricManager
+from ..prometheus import Sample
+from ..prometheus import Snapshot
 
 class EscapeTest(TestCase):
     def test_identity(self):
@@ -96,3 +112,488 @@ class LabelTest(TestCase):
 
     def test_in_5(self):
         self.assertNotIn(Label('c', 'd'), [Label('a', 'b'), Label('c', 'b')])
+
+class FmtValueTest(TestCase):
+    def test_integer(self):
+        self.assertEqual(fmt_value(13621968844222.0), '13621968844222')
+
+    def test_float(self):
+        self.assertEqual(fmt_value(0.448), '0.448')
+
+    def test_nan(self):
+        self.assertEqual(fmt_value(float('nan')), 'NaN')
+
+    def test_inf(self):
+        self.assertEqual(fmt_value(float('-inf')), '-Inf')
+
+class MetricTest(TestCase):
+    def setUp(self):
+        self.metric = Metric('test_metric', 'Test metric', 'gauge')
+        self.timestamp = arrow.get(1477515392.5)
+
+    def tearDown(self):
+        del metrics['test_metric']
+
+    def test_slot_interned(self):
+        slot_1 = self.metric.slot((('a', 'b'),))
+        slot_2 = self.metric.slot((('a', 'b'),))
+        slot_3 = self.metric.slot((('a', 'c'),))
+        self.assertEqual(slot_1, slot_2)
+        self.assertNotEqual(slot_1, slot_3)
+
+    def test_snapshot_commit(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        self.assertIsNone(self.metric.get((('a', 'b'),)))
+        snapshot.commit()
+        self.assertEqual(self.metric.get((('a', 'b'),)), 1)
+
+    def test_set_overwrites(self):
+        self.metric.set((('a', 'b'),), 1, 1000)
+        self.metric.set((('a', 'b'),), 2, 2000)
+        self.assertEqual(self.metric.series(), [(('a', 'b'),)])
+        self.assertEqual(self.metric.get((('a', 'b'),)), 2)
+
+    def test_polls_between_scrapes(self):
+        # polls that are not scraped in between leave one sample per
+        # series, the last one, not one per poll
+        previous = None
+        for i in range(20):
+            snapshot = Snapshot(arrow.get(1477515392 + i * 5))
+            snapshot.set(self.metric, (('a', 'b'),), i)
+            snapshot.commit(previous)
+            previous = snapshot
+        self.assertEqual(len(self.metric.keys), 1)
+        self.assertEqual(self.metric.fmt(),
+                         '# HELP test_metric Test metric\n'
+                         '# TYPE test_metric gauge\n'
+                         'test_metric{a="b"} 19 1477515487000\n')
+
+    def test_fmt(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b"'),), 1.5)
+        snapshot.commit()
+        self.assertEqual(self.metric.fmt(),
+                         '# HELP test_metric Test metric\n'
+                         '# TYPE test_metric gauge\n'
+                         'test_metric{a="b\\""} 1.5 1477515392500\n')
+
+    def test_render_openmetrics(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1.5)
+        snapshot.commit()
+        self.assertEqual(self.metric.render('openmetrics'),
+                         b'# HELP test_metric Test metric\n'
+                         b'# TYPE test_metric gauge\n'
+                         b'test_metric{a="b"} 1.5 1477515392.500\n')
+
+    def test_render_openmetrics_counter(self):
+        counter = Metric('test_counter', None, 'counter')
+        self.addCleanup(metrics.pop, 'test_counter')
+        counter.set((('a', 'b'),), 3, 1477515392000)
+        self.assertEqual(counter.render('openmetrics'),
+                         b'# TYPE test_counter counter\n'
+                         b'test_counter_total{a="b"} 3 1477515392\n')
+
+    def test_render_protobuf(self):
+        self.metric.set((('a', 'b'),), 1, 1000)
+        self.assertEqual(self.metric.render('protobuf'),
+                         b'\x34'
+                         b'\x0a\x0btest_metric'
+                         b'\x12\x0bTest metric'
+                         b'\x18\x01'
+                         b'\x22\x16'
+                         b'\x0a\x06\x0a\x01a\x12\x01b'
+                         b'\x12\x09\x09\x00\x00\x00\x00\x00\x00\xf0\x3f'
+                         b'\x30\xe8\x07')
+
+    def test_render_cached_per_format(self):
+        self.metric.set((('a', 'b'),), 1, 1000)
+        text = self.metric.render('text')
+        protobuf = self.metric.render('protobuf')
+        self.assertIs(self.metric.render('text'), text)
+        self.assertIs(self.metric.render('protobuf'), protobuf)
+        self.metric.set((('a', 'b'),), 2, 2000)
+        self.assertIsNot(self.metric.render('protobuf'), protobuf)
+
+    def test_render_unsupported(self):
+        self.assertRaises(ValueError, self.metric.render, 'json')
+
+class ExpositionTest(TestCase):
+    def setUp(self):
+        self.metric = Metric('test_exposition', None, 'gauge')
+        self.timestamp = arrow.get(1477515392.5)
+
+    def tearDown(self):
+        del metrics['test_exposition']
+        exposition.update()
+
+    def test_commit_renders(self):
+        generation = exposition.generation
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        self.assertEqual(exposition.generation, generation + 1)
+        self.assertIn(b'test_exposition{a="b"} 1 1477515392500\n', exposition.body)
+
+    def test_render_cached(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        self.assertIs(self.metric.render(), self.metric.render())
+
+    def test_render_not_destructive(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        body = self.metric.render()
+        exposition.update()
+        self.assertEqual(self.metric.render(), body)
+        self.assertIn(b'test_exposition{a="b"} 1 1477515392500\n', exposition.body)
+
+    def test_gzip(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        compressed = exposition.encode('gzip')
+        self.assertEqual(gzip.decompress(compressed), exposition.body)
+        self.assertIs(exposition.encode('gzip'), compressed)
+
+    def test_gzip_recompressed_after_update(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        compressed = exposition.encode('gzip')
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 2)
+        snapshot.commit()
+        self.assertIsNot(exposition.encode('gzip'), compressed)
+        self.assertIn(b'test_exposition{a="b"} 2 1477515392500\n', gzip.decompress(exposition.encode('gzip')))
+
+    def test_unsupported_encoding(self):
+        self.assertRaises(ValueError, exposition.encode, 'br')
+
+    def test_openmetrics_eof(self):
+        self.assertTrue(exposition.render('openmetrics').endswith(b'# EOF\n'))
+
+    def test_formats_recomputed_after_update(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+        body = exposition.render('openmetrics')
+        self.assertIs(exposition.render('openmetrics'), body)
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('a', 'b'),), 2)
+        snapshot.commit()
+        self.assertIn(b'test_exposition{a="b"} 2 1477515392.500\n', exposition.render('openmetrics'))
+
+    def test_wanted_formats_rendered_at_update(self):
+        wanted = exposition.wanted
+        self.addCleanup(setattr, exposition, 'wanted', wanted)
+        exposition.wanted = set(['text'])
+        exposition.update()
+        self.assertEqual(exposition.available(), ['text'])
+        exposition.want('openmetrics')
+        exposition.update()
+        self.assertEqual(exposition.available(), ['openmetrics', 'text'])
+        self.assertTrue(exposition.bodies['openmetrics'].endswith(b'# EOF\n'))
+
+class HistogramTest(TestCase):
+    def setUp(self):
+        self.histogram = Histogram('test_histogram', 'A test.', buckets = (0.1, 1.0))
+
+    def tearDown(self):
+        del metrics['test_histogram']
+
+    def test_get(self):
+        self.histogram.observe((('a', 'b'),), 0.5)
+        self.histogram.observe((('a', 'b'),), 2.0)
+        self.assertEqual(self.histogram.get((('a', 'b'),)), (2, 2.5))
+        self.assertIsNone(self.histogram.get((('a', 'c'),)))
+
+    def test_render(self):
+        self.histogram.observe((('a', 'b'),), 0.1)
+        self.histogram.observe((('a', 'b'),), 0.5)
+        self.histogram.observe((('a', 'b'),), 2.0)
+        self.assertEqual(self.histogram.render(),
+                         b'# HELP test_histogram A test.\n'
+                         b'# TYPE test_histogram histogram\n'
+                         b'test_histogram_bucket{a="b",le="0.1"} 1\n'
+                         b'test_histogram_bucket{a="b",le="1.0"} 2\n'
+                         b'test_histogram_bucket{a="b",le="+Inf"} 3\n'
+                         b'test_histogram_sum{a="b"} 2.6\n'
+                         b'test_histogram_count{a="b"} 3\n')
+
+    def test_render_no_labels(self):
+        self.histogram.observe((), 0.01)
+        self.assertIn(b'test_histogram_bucket{le="0.1"} 1\n', self.histogram.render('openmetrics'))
+        self.assertIn(b'test_histogram_count 1\n', self.histogram.render('openmetrics'))
+
+    def test_render_protobuf(self):
+        self.histogram.observe((), 0.5)
+        body = self.histogram.render('protobuf')
+        self.assertIn(b'\x18\x04', body)
+        self.assertIn(b'\x3a', body)
+
+    def test_render_invalidated(self):
+        self.histogram.observe((), 0.5)
+        body = self.histogram.render()
+        self.assertIs(self.histogram.render(), body)
+        self.histogram.observe((), 0.5)
+        self.assertIn(b'test_histogram_count 2\n', self.histogram.render())
+
+    def test_exposition(self):
+        self.histogram.observe((), 0.5)
+        exposition.update()
+        self.assertIn(b'test_histogram_count 1\n', exposition.body)
+        self.assertIn(b'ceph_exporter_series{family="test_histogram"} 1 ', exposition.body)
+        count, total = metrics['ceph_exporter_render_seconds'].get((('format', 'text'),))
+        self.assertGreater(count, 0)
+
+class SnapshotTest(TestCase):
+    def setUp(self):
+        self.metric = Metric('test_snapshot', None, 'gauge')
+        self.timestamp = arrow.get(1477515392.5)
+
+    def tearDown(self):
+        del metrics['test_snapshot']
+        exposition.update()
+
+    def commit(self, series, previous = None):
+        snapshot = Snapshot(self.timestamp)
+        for labels in series:
+            snapshot.set(self.metric, labels, 1)
+        snapshot.commit(previous)
+        return snapshot
+
+    def test_replaces_owned_series(self):
+        snapshot = self.commit([(('osd', '0'),), (('osd', '1'),)])
+        self.commit([(('osd', '0'),)], snapshot)
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+
+    def test_shared_series_kept(self):
+        snapshot_1 = self.commit([(('osd', '0'),)])
+        self.commit([(('osd', '0'),)])
+        self.commit([], snapshot_1)
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+
+    def test_fmt_not_destructive(self):
+        self.commit([(('osd', '0'),)])
+        self.assertEqual(self.metric.fmt(), self.metric.fmt())
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+
+    def test_fragments_replaced_in_order(self):
+        snapshot_1 = self.commit([(('osd', '0'),)])
+        self.commit([(('osd', '1'),)])
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('osd', '0'),), 2)
+        snapshot.commit(snapshot_1)
+        self.assertEqual(self.metric.fmt(),
+                         '# TYPE test_snapshot gauge\n'
+                         'test_snapshot{osd="0"} 2 1477515392500\n'
+                         'test_snapshot{osd="1"} 1 1477515392500\n')
+
+    def test_shared_series_rendered_once(self):
+        self.commit([(('osd', '0'),)])
+        self.commit([(('osd', '0'),)])
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\ntest_snapshot{osd="0"} 1 1477515392500\n')
+
+    def test_duplicate_last_wins(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('osd', '0'),), 1)
+        snapshot.set(self.metric, (('osd', '0'),), 2)
+        snapshot.commit()
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\ntest_snapshot{osd="0"} 2 1477515392500\n')
+        self.assertEqual(self.metric.get((('osd', '0'),)), 2)
+
+    def test_prepare_not_visible(self):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('osd', '0'),), 1)
+        snapshot.prepare(['text', 'protobuf'])
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\n')
+        self.assertEqual(self.metric.series(), [])
+        snapshot.commit()
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\ntest_snapshot{osd="0"} 1 1477515392500\n')
+
+    def test_prepare_shared_not_visible(self):
+        snapshot_1 = self.commit([(('osd', '0'),)])
+        self.commit([(('osd', '0'),)])
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('osd', '0'),), 2)
+        snapshot.prepare(['text'])
+        self.metric.invalidate()
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\ntest_snapshot{osd="0"} 1 1477515392500\n')
+        self.assertEqual(self.metric.get((('osd', '0'),)), 1)
+        snapshot.commit(snapshot_1)
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\ntest_snapshot{osd="0"} 2 1477515392500\n')
+        self.assertEqual(self.metric.get((('osd', '0'),)), 2)
+
+    def test_withdraw_drops_fragments(self):
+        snapshot = self.commit([(('osd', '0'),)])
+        snapshot.withdraw()
+        self.assertEqual(self.metric.fmt(), '# TYPE test_snapshot gauge\n')
+
+class SnapshotReuseTest(TestCase):
+    def setUp(self):
+        self.metric = Metric('test_reuse', None, 'gauge')
+        self.other = Metric('test_reuse_other', None, 'gauge')
+
+    def tearDown(self):
+        del metrics['test_reuse']
+        del metrics['test_reuse_other']
+
+    def test_reuse(self):
+        previous = Snapshot(arrow.get(1000))
+        previous.set(self.metric, (('a', 'b'),), 1)
+        previous.set(self.other, (('a', 'b'),), 2)
+        previous.commit()
+        snapshot = Snapshot(arrow.get(1010))
+        snapshot.set(self.other, (('a', 'c'),), 3)
+        snapshot.reuse(previous)
+        snapshot.set(self.metric, (('a', 'd'),), 4)
+        snapshot.commit(previous)
+        self.assertEqual(self.metric.get((('a', 'b'),)), 1)
+        self.assertEqual(self.metric.timestamps[self.metric.slot((('a', 'b'),))], 1010000)
+        self.assertEqual(self.other.series(), [(('a', 'c'),)])
+        self.assertEqual(len(previous.series[self.metric][0]), 1)
+
+    def test_skip(self):
+        previous = Snapshot(arrow.get(1000))
+        previous.set(self.metric, (('a', 'b'),), 1)
+        snapshot = Snapshot(arrow.get(1010))
+        snapshot.reuse(previous, skip = (self.metric,))
+        self.assertEqual(snapshot.series, {})
+
+class SampleTest(TestCase):
+    def test_is_expired(self):
+        now = arrow.now()
+        sample = Sample.__new__(Sample)
+        sample.timestamp = now - datetime.timedelta(seconds = 600)
+        self.assertTrue(sample.isExpired(now))
+
+    def test_is_not_expired(self):
+        now = arrow.now()
+        sample = Sample.__new__(Sample)
+        sample.timestamp = now - datetime.timedelta(seconds = 5)
+        self.assertFalse(sample.isExpired(now))
+
+class MetricManagerTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(prometheus, 'reactor', self.clock)
+        self.metric = Metric('test_manager', None, 'gauge')
+        self.timestamp = arrow.get(1477515392.5)
+        self.manager = MetricManager()
+
+    def tearDown(self):
+        del metrics['test_manager']
+        exposition.update()
+
+    def commit(self, previous = None, ttl = 30.0):
+        snapshot = Snapshot(self.timestamp)
+        snapshot.set(self.metric, (('osd', '0'),), 1)
+        snapshot.commit(previous, ttl)
+        return snapshot
+
+    def test_fresh_kept(self):
+        self.commit()
+        self.clock.advance(20.0)
+        self.manager.expireSamples()
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+
+    def test_stale_dropped(self):
+        snapshot = self.commit()
+        self.clock.advance(31.0)
+        self.manager.expireSamples()
+        self.assertEqual(self.metric.series(), [])
+        self.assertNotIn(snapshot, prometheus.committed)
+
+    def test_no_ttl_kept(self):
+        self.commit(ttl = None)
+        self.clock.advance(3600.0)
+        self.manager.expireSamples()
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+
+    def test_recommit_after_withdraw(self):
+        snapshot = self.commit()
+        self.clock.advance(31.0)
+        self.manager.expireSamples()
+        snapshot = self.commit(snapshot)
+        self.assertEqual(self.metric.series(), [(('osd', '0'),)])
+        self.commit(snapshot)
+        self.assertEqual(self.metric.owners[self.metric.slot((('osd', '0'),))], 1)
+
+    def test_periodic(self):
+        self.manager.start()
+        self.commit()
+        self.clock.advance(MetricManager.interval)
+        self.clock.advance(MetricManager.interval)
+        self.clock.advance(MetricManager.interval)
+        self.clock.advance(MetricManager.interval)
+        self.assertEqual(self.metric.series(), [])
+        self.manager.loop.stop()
+
+class ReclaimTest(TestCase):
+    def setUp(self):
+        # snapshots that other tests left uncommitted would hold on to
+        # every slot
+        self.patch(prometheus, 'pending', weakref.WeakSet())
+        self.metric = Metric('test_reclaim', None, 'gauge')
+        self.timestamp = arrow.get(1477515392.5)
+        self.manager = MetricManager()
+
+    def tearDown(self):
+        del metrics['test_reclaim']
+        exposition.update()
+
+    def commit(self, osds, previous = None):
+        snapshot = Snapshot(self.timestamp)
+        for osd in osds:
+            snapshot.set(self.metric, (('osd', '{:d}'.format(osd)),), osd)
+        snapshot.commit(previous)
+        return snapshot
+
+    def test_bounded(self):
+        snapshot = None
+        for cycle in range(10):
+            snapshot = self.commit(range(cycle * 100, cycle * 100 + 100), snapshot)
+            self.manager.expireSamples()
+        self.assertLessEqual(len(self.metric.keys), 200)
+        self.assertEqual(self.metric.count(), 100)
+        self.assertEqual(sorted(self.metric.series()), sorted([(('osd', '{:d}'.format(osd)),) for osd in range(900, 1000)]))
+
+    def test_reused_slot(self):
+        snapshot = self.commit([0])
+        self.metric.render('protobuf')
+        snapshot = self.commit([1], snapshot)
+        self.manager.reclaimSlots()
+        self.commit([2], snapshot)
+        self.assertEqual(len(self.metric.keys), 2)
+        self.assertIsNone(self.metric.get((('osd', '0'),)))
+        self.assertEqual(self.metric.get((('osd', '2'),)), 2)
+        self.assertEqual(self.metric.fmt(),
+                         '# TYPE test_reclaim gauge\n'
+                         'test_reclaim{osd="2"} 2 1477515392500\n')
+        slot = self.metric.slot((('osd', '2'),))
+        self.assertEqual(self.metric.encoded[slot], self.metric.encodePrefix((('osd', '2'),)))
+
+    def test_uncommitted_snapshot_keeps_slot(self):
+        snapshot = self.commit([0])
+        # built while osd 0 was still exported, committed after it was
+        # dropped
+        late = Snapshot(self.timestamp)
+        late.set(self.metric, (('osd', '0'),), 5)
+        self.commit([1], snapshot)
+        self.manager.reclaimSlots()
+        self.assertIsNotNone(self.metric.index.get((('osd', '0'),)))
+        late.commit()
+        self.assertEqual(self.metric.get((('osd', '0'),)), 5)
+
+    def test_unused_slot_kept_for_new_snapshot(self):
+        snapshot = self.commit([0])
+        self.commit([1], snapshot)
+        late = Snapshot(self.timestamp)
+        late.set(self.metric, (('osd', '0'),), 5)
+        self.manager.reclaimSlots()
+        late.commit()
+        self.assertEqual(self.metric.get((('osd', '0'),)), 5)
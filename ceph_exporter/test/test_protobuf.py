@@ -0,0 +1,58 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import TestCase
+
+from ..protobuf import delimited
+from ..protobuf import field_double
+from ..protobuf import field_string
+from ..protobuf import field_varint
+from ..protobuf import label_pairs
+from ..protobuf import varint
+
+class VarintTest(TestCase):
+    def test_small(self):
+        self.assertEqual(varint(0), b'\x00')
+        self.assertEqual(varint(1), b'\x01')
+        self.assertEqual(varint(127), b'\x7f')
+
+    def test_multibyte(self):
+        self.assertEqual(varint(128), b'\x80\x01')
+        self.assertEqual(varint(300), b'\xac\x02')
+
+    def test_negative(self):
+        self.assertEqual(varint(-1), b'\xff' * 9 + b'\x01')
+
+class FieldTest(TestCase):
+    def test_varint(self):
+        self.assertEqual(field_varint(3, 1), b'\x18\x01')
+
+    def test_double(self):
+        self.assertEqual(field_double(1, 1.0), b'\x09\x00\x00\x00\x00\x00\x00\xf0\x3f')
+
+    def test_string(self):
+        self.assertEqual(field_string(1, 'é'), b'\x0a\x02\xc3\xa9')
+
+    def test_label_pairs(self):
+        self.assertEqual(label_pairs((('a', 'b'), ('c', 'd'))),
+                         b'\x0a\x06\x0a\x01a\x12\x01b\x0a\x06\x0a\x01c\x12\x01d')
+
+    def test_delimited(self):
+        self.assertEqual(delimited(b'x' * 200)[:2], b'\xc8\x01')
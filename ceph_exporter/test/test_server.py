@@ -0,0 +1,308 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.trial.unittest import SkipTest
+from twisted.trial.unittest import TestCase
+
+import arrow
+import gzip
+import threading
+import time
+import tracemalloc
+
+from twisted.internet.defer import Deferred
+from twisted.internet.defer import maybeDeferred
+from twisted.internet.task import Clock
+from twisted.web.server import NOT_DONE_YET
+from twisted.web.test.requesthelper import DummyRequest
+
+from .. import prometheus
+from .. import server
+
+from ..prometheus import exposition
+from ..prometheus import metrics
+from ..prometheus import Metric
+from ..prometheus import Snapshot
+from ..server import accepted_encodings
+from ..server import choose_encoding
+from ..server import choose_format
+from ..server import MemoryPage
+from ..server import MetricsPage
+from ..server import ProfilePage
+from ..server import Sampler
+
+class AcceptedEncodingsTest(TestCase):
+    def test_empty(self):
+        self.assertEqual(accepted_encodings(None), {})
+        self.assertEqual(accepted_encodings(b''), {})
+
+    def test_qualities(self):
+        self.assertEqual(accepted_encodings(b'gzip, deflate;q=0.5, br ; q=0'),
+                         {'gzip': 1.0, 'deflate': 0.5, 'br': 0.0})
+
+    def test_bad_quality(self):
+        self.assertEqual(accepted_encodings(b'gzip;q=x'), {'gzip': 0.0})
+
+class ChooseEncodingTest(TestCase):
+    def test_identity(self):
+        self.assertIsNone(choose_encoding(None))
+        self.assertIsNone(choose_encoding(b'identity'))
+
+    def test_gzip(self):
+        self.assertEqual(choose_encoding(b'deflate, gzip'), 'gzip')
+
+    def test_refused(self):
+        self.assertIsNone(choose_encoding(b'gzip;q=0'))
+        self.assertIsNone(choose_encoding(b'*, gzip;q=0, zstd;q=0'))
+
+    def test_wildcard(self):
+        self.assertEqual(choose_encoding(b'*'), exposition.encodings[0])
+
+class ChooseFormatTest(TestCase):
+    def test_default(self):
+        self.assertEqual(choose_format(None), 'text')
+        self.assertEqual(choose_format(b'application/json'), 'text')
+
+    def test_text(self):
+        self.assertEqual(choose_format(b'text/plain;version=0.0.4'), 'text')
+
+    def test_openmetrics(self):
+        header = (b'application/openmetrics-text;version=1.0.0,application/openmetrics-text;version=0.0.1;q=0.75,'
+                  b'text/plain;version=0.0.4;q=0.5,*/*;q=0.1')
+        self.assertEqual(choose_format(header), 'openmetrics')
+
+    def test_protobuf(self):
+        header = (b'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=delimited;q=0.7,'
+                  b'text/plain;version=0.0.4;q=0.3,*/*;q=0.2')
+        self.assertEqual(choose_format(header), 'protobuf')
+
+    def test_protobuf_text_encoding(self):
+        header = b'application/vnd.google.protobuf;proto=io.prometheus.client.MetricFamily;encoding=text'
+        self.assertEqual(choose_format(header), 'text')
+
+    def test_tie(self):
+        header = b'text/plain, application/openmetrics-text'
+        self.assertEqual(choose_format(header), 'openmetrics')
+
+    def test_refused(self):
+        header = b'application/openmetrics-text;q=0, text/plain;q=0.1'
+        self.assertEqual(choose_format(header), 'text')
+
+    def test_available(self):
+        header = b'application/openmetrics-text;version=1.0.0;q=0.5,text/plain;version=0.0.4;q=0.3'
+        self.assertEqual(choose_format(header, ['text']), 'text')
+        self.assertEqual(choose_format(header, ['openmetrics', 'text']), 'openmetrics')
+
+class MetricsPageTest(TestCase):
+    def setUp(self):
+        self.patch(prometheus, 'deferToThread', maybeDeferred)
+        self.patch(exposition, 'wanted', set(['text']))
+        self.patch(exposition, 'wanted_encodings', set())
+        self.patch(exposition, 'compressed', {})
+        self.metric = Metric('test_metrics_page', 'A test.', 'counter')
+        snapshot = Snapshot(arrow.get(1477515392.5))
+        snapshot.set(self.metric, (('a', 'b'),), 1)
+        snapshot.commit()
+
+    def tearDown(self):
+        del metrics['test_metrics_page']
+        exposition.update()
+
+    def render(self, accept = None, accept_encoding = None):
+        request = DummyRequest([b'metrics'])
+        if accept is not None:
+            request.requestHeaders.setRawHeaders(b'Accept', [accept])
+        if accept_encoding is not None:
+            request.requestHeaders.setRawHeaders(b'Accept-Encoding', [accept_encoding])
+        body = MetricsPage().render_GET(request)
+        return request, body
+
+    def test_plain(self):
+        request, body = self.render()
+        self.assertIn(b'test_metrics_page{a="b"} 1 1477515392500\n', body)
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Type'),
+                         [b'text/plain; charset=utf-8; version=0.0.4'])
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b'Content-Encoding'))
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Vary'), [b'Accept, Accept-Encoding'])
+
+    def test_scrape_observed(self):
+        before = metrics['ceph_exporter_scrape_seconds'].get((('format', 'text'),))
+        request, body = self.render()
+        self.assertEqual(metrics['ceph_exporter_scrape_seconds'].get((('format', 'text'),)), before)
+        request.finish()
+        count, total = metrics['ceph_exporter_scrape_seconds'].get((('format', 'text'),))
+        self.assertEqual(count, 1 if before is None else before[0] + 1)
+
+    def test_gzip(self):
+        # nothing is compressed while answering a scrape
+        request, body = self.render(accept_encoding = b'gzip')
+        self.assertIsNone(request.responseHeaders.getRawHeaders(b'Content-Encoding'))
+        self.assertEqual(body, exposition.body)
+        exposition.update()
+        request, body = self.render(accept_encoding = b'gzip')
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Encoding'), [b'gzip'])
+        self.assertEqual(gzip.decompress(body), exposition.body)
+
+    def test_compressing(self):
+        compressions = []
+        def deferToThread(f, *args):
+            compressions.append(Deferred())
+            return compressions[-1]
+        self.patch(prometheus, 'deferToThread', deferToThread)
+        self.render(accept_encoding = b'gzip')
+        exposition.update()
+        exposition.update()
+        self.assertEqual(len(compressions), 1)
+        # the update that came in while compressing is compressed next
+        compressions[0].callback(b'first')
+        self.assertEqual(len(compressions), 2)
+        request, body = self.render(accept_encoding = b'gzip')
+        self.assertEqual(body, b'first')
+        compressions[1].callback(b'second')
+        request, body = self.render(accept_encoding = b'gzip')
+        self.assertEqual(body, b'second')
+        self.assertEqual(len(compressions), 2)
+
+    def test_openmetrics(self):
+        # until an update has rendered OpenMetrics, the text format is
+        # served to a client that prefers it
+        request, body = self.render(accept = b'application/openmetrics-text; version=1.0.0, text/plain;version=0.0.4;q=0.3')
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Type'),
+                         [b'text/plain; charset=utf-8; version=0.0.4'])
+        exposition.update()
+        request, body = self.render(accept = b'application/openmetrics-text; version=1.0.0, text/plain;version=0.0.4;q=0.3')
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Type'),
+                         [b'application/openmetrics-text; version=1.0.0; charset=utf-8'])
+        self.assertIn(b'# TYPE test_metrics_page counter\n'
+                      b'test_metrics_page_total{a="b"} 1 1477515392.500\n', body)
+        self.assertTrue(body.endswith(b'# EOF\n'))
+
+    def test_protobuf_gzip(self):
+        self.render(accept = b'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited',
+                    accept_encoding = b'gzip')
+        exposition.update()
+        request, body = self.render(accept = b'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited',
+                                    accept_encoding = b'gzip')
+        self.assertEqual(request.responseHeaders.getRawHeaders(b'Content-Type'),
+                         [b'application/vnd.google.protobuf; proto=io.prometheus.client.MetricFamily; encoding=delimited'])
+        self.assertEqual(gzip.decompress(body), exposition.render('protobuf'))
+
+def debug_request(token = b'secret', **args):
+    request = DummyRequest([])
+    if token is not None:
+        request.requestHeaders.setRawHeaders(b'Authorization', [b'Bearer ' + token])
+    request.args = dict((name.encode('ascii'), [value.encode('ascii')]) for name, value in args.items())
+    return request
+
+class ProfilePageTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(server, 'reactor', self.clock)
+        self.page = ProfilePage(b'secret')
+
+    def test_unauthorized(self):
+        for token in [None, b'wrong']:
+            request = debug_request(token)
+            self.assertEqual(self.page.render_GET(request), b'')
+            self.assertEqual(request.responseCode, 401)
+        self.assertFalse(self.page.running)
+
+    def test_bad_seconds(self):
+        for seconds in ['x', '0', '3600']:
+            request = debug_request(seconds = seconds)
+            self.page.render_GET(request)
+            self.assertEqual(request.responseCode, 400)
+
+    def test_cprofile(self):
+        request = debug_request(seconds = '2')
+        self.assertEqual(self.page.render_GET(request), NOT_DONE_YET)
+        self.assertTrue(self.page.running)
+        other = debug_request(seconds = '2')
+        self.page.render_GET(other)
+        self.assertEqual(other.responseCode, 409)
+        self.clock.advance(2.0)
+        self.assertFalse(self.page.running)
+        self.assertEqual(request.finished, 1)
+        self.assertIn(b'cumulative', b''.join(request.written))
+
+    def test_sample(self):
+        request = debug_request(seconds = '1', mode = 'sample')
+        self.page.render_GET(request)
+        self.clock.advance(1.0)
+        self.assertFalse(self.page.running)
+        self.assertEqual(request.finished, 1)
+
+    def test_client_gone(self):
+        request = debug_request(seconds = '2')
+        self.page.render_GET(request)
+        request.processingFailed(Exception('connection lost'))
+        self.assertFalse(self.page.running)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+
+class SamplerTest(TestCase):
+    def test_sample(self):
+        sampler = Sampler(threading.get_ident())
+        sampler.sample()
+        sampler.sample()
+        lines = sampler.collapsed().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertIn(':test_sample;', lines[0])
+        self.assertTrue(lines[0].endswith(' 2'))
+
+    def test_thread(self):
+        sampler = Sampler(threading.get_ident())
+        sampler.start()
+        time.sleep(0.05)
+        sampler.stop()
+        self.assertIn(':test_thread', sampler.collapsed())
+
+class MemoryPageTest(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.patch(server, 'reactor', self.clock)
+        self.page = MemoryPage(b'secret')
+
+    def test_unauthorized(self):
+        request = debug_request(b'wrong')
+        self.assertEqual(self.page.render_GET(request), b'')
+        self.assertEqual(request.responseCode, 401)
+
+    def test_trace(self):
+        if tracemalloc.is_tracing():
+            raise SkipTest('tracemalloc is already tracing')
+        request = debug_request(seconds = '1', limit = '5')
+        self.assertEqual(self.page.render_GET(request), NOT_DONE_YET)
+        self.assertTrue(tracemalloc.is_tracing())
+        self.kept = [str(i) for i in range(1000)]
+        self.clock.advance(1.0)
+        self.assertFalse(tracemalloc.is_tracing())
+        body = b''.join(request.written)
+        self.assertIn(b'allocation sites', body)
+        self.assertIn(b'test_server.py', body)
+        self.assertLessEqual(len(body.splitlines()), 6)
+
+    def test_already_tracing(self):
+        if tracemalloc.is_tracing():
+            raise SkipTest('tracemalloc is already tracing')
+        tracemalloc.start()
+        self.addCleanup(tracemalloc.stop)
+        body = self.page.render_GET(debug_request())
+        self.assertIn(b'allocation sites', body)
+        self.assertTrue(tracemalloc.is_tracing())
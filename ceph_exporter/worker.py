@@ -0,0 +1,43 @@
+# -*- mode: python; coding: utf-8 -*-
+
+# Copyright © 2016 by Jeffrey C. Ollie
+#
+# This file is part of ceph_exporter.
+#
+# ceph_exporter is free software: you can redistribute it and/or
+# modify it under the terms of the GNU General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# ceph_exporter is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with ceph_exporter.  If not, see
+# <http://www.gnu.org/licenses/>.
+
+from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.logger import Logger
+from twisted.python.threadpool import ThreadPool
+
+class WorkerPool(object):
+    """A small pool of threads that decode command output, build
+    snapshots and render their series so that the reactor thread stays
+    free to answer scrapes.  Only the commit of a prepared snapshot
+    happens on the reactor."""
+
+    log = Logger()
+
+    def __init__(self, size):
+        self.size = size
+        self.pool = ThreadPool(minthreads = 0, maxthreads = size, name = 'ceph_exporter')
+
+    def start(self):
+        self.pool.start()
+        reactor.addSystemEventTrigger('during', 'shutdown', self.pool.stop)
+
+    def run(self, f, *args, **kwargs):
+        return deferToThreadPool(reactor, self.pool, f, *args, **kwargs)
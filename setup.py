@@ -27,7 +27,9 @@ setup(name = 'ceph_exporter',
       license = 'GPLv3',
       url = 'https://github.com/jcollie/ceph_exporter',
       packages = ['ceph_exporter',
+                  'ceph_exporter.benchmark',
                   'ceph_exporter.ceph',
+                  'ceph_exporter.ceph.backends',
                   'ceph_exporter.ceph.commands',
                   'ceph_exporter.ceph.metrics'],
       data_files = [('etc', ['ceph_exporter.service'])],
@@ -37,4 +39,5 @@ setup(name = 'ceph_exporter',
       install_requires = ['Twisted[tls]',
                           'service-identity',
                           'arrow'],
+      extras_require = {'zstd': ['zstandard']},
       classifiers = ['Development Status :: 4 - Beta'])